@@ -11,9 +11,11 @@ describing connectome into a BriCA language JSON file.
 
 """
 
-import sys
 import os
+import sys
 import json
+import argparse
+from brical_converter import write_document, collect_document
 
 
 class Table2BriCAL:
@@ -21,26 +23,76 @@ class Table2BriCAL:
     converts table files describing connectome into a BriCA language JSON file.
     """
 
-    def __init__(self):
-        self.json = {}
-        self.connection = {}
+    def __init__(self, dtype=None):
+        self.dtype = dtype  # DType of the generated ports (None: the BriCA default)
+        self.connection = None  # Connection matrix (rows: self.rowItems, columns: self.headItems)
+        self.rowItems = None
         self.regions = {}
         self.superModules = {}
         self.subModules = {}
         self.modules = {}
-        self.ports = []
-        self.connections = []
+        self.origins = None  # Origin and target regions of the connections (indices into self.modules)
+        self.targets = None
+        self.portOrder = None  # Ports (connection index + connection count for the inputs) sorted by region
+        self.portStarts = None  # Region index ⇒ its first port in self.portOrder
         self.headItems = None
+        self.depth = None  # Hierarchy depth of the coarsened network (None: not coarsened)
+        self.aggregate = "sum"
+        self.groups = {}  # Region ID ⇒ coarse region ID
 
-    def load_connection(self, path):
-        heading = True
-        for line in open(path, 'r'):
-            items = line[:-1].split('\t')
-            if heading:
-                self.headItems = items[1:]
-                heading = False
-            else:
-                self.connection[items[0]] = items[1:]
+    def load_connection(self, path, cache=True):
+        """
+        Load the connection table into a NumPy matrix.
+        Empty cells are read as 0 and cells that are not numbers as NaN (never above a threshold).
+        The matrix is cached in `path`.npy (and the IDs in `path`.ids.json, with the size and the
+        modification time in nanoseconds of the table) and the cache is memory-mapped instead of parsing
+        the table as long as the size and the modification time of the table are the recorded ones.
+        """
+        import numpy
+        cache_path = path + ".npy"
+        ids_path = path + ".ids.json"
+        stat = os.stat(path)
+        source = [stat.st_size, stat.st_mtime_ns]
+        if cache and os.path.isfile(cache_path) and os.path.isfile(ids_path):
+            with open(ids_path, 'r') as fp:
+                ids = json.load(fp)
+            if ids.get("source") == source:
+                self.rowItems = ids["rows"]
+                self.headItems = ids["columns"]
+                self.connection = numpy.load(cache_path, mmap_mode='r')
+                return
+
+        self.rowItems = []
+        with open(path, 'r') as fp:
+            self.headItems = fp.readline().rstrip('\r\n').split('\t')[1:]
+            for line in fp:
+                if line.strip() != '':
+                    self.rowItems.append(line.split('\t', 1)[0])
+        columns = range(1, len(self.headItems) + 1)
+        try:
+            self.connection = numpy.loadtxt(path, delimiter='\t', skiprows=1, usecols=columns, ndmin=2)
+        except ValueError:  # empty or invalid cells
+            self.connection = numpy.loadtxt(path, delimiter='\t', skiprows=1, usecols=columns, ndmin=2,
+                                            converters=self.to_float)
+            for i, j in numpy.argwhere(numpy.isnan(self.connection)):
+                print("Cannot convert item " + str(j) + " for id:" + self.rowItems[i] + ".")
+
+        if cache:
+            try:
+                numpy.save(cache_path, self.connection)
+                with open(ids_path, 'w') as fp:
+                    json.dump({"rows": self.rowItems, "columns": self.headItems, "source": source}, fp)
+            except IOError:
+                sys.stderr.write("Warning: cannot write the cache " + cache_path + ".\n")
+
+    @staticmethod
+    def to_float(item):
+        if item.strip() == '':
+            return 0.0
+        try:
+            return float(item)
+        except ValueError:
+            return float("nan")
 
     def load_regions(self, path):
         for line in open(path, 'r'):
@@ -63,68 +115,308 @@ class Table2BriCAL:
                 self.subModules[items[1]] = sub_modules
 
     def build(self, threshold):
-        for id in self.connection:
-            origin_name = self.modules[id]["Name"]
-            items = self.connection[id]
-            for i in range(0, len(items)):
-                try:
-                    if items[i].strip() == '':
-                        items[i] = '0'
-                    var = float(items[i])
-                    if var >= threshold:
-                        target_id = self.headItems[i]
-                        target_name = self.modules[target_id]["Name"]
-                        origin_module = self.modules[id]
-                        self.create_port("Output", origin_module, origin_name, target_name)
-                        target_module = self.modules[target_id]
-                        self.create_port("Input", target_module, origin_name, target_name)
-                        self.create_connection(id, target_id)
-                except ValueError:
-                    print("Cannot convert item " + str(i) + ":'" + items[i] + "' for id:" + id + ".")
-                    print(items)
+        """
+        Build the connections from the connection matrix, keeping them as the indices of the regions
+        (see set_connections).
+        """
+        import numpy
+        index = dict((id, i) for i, id in enumerate(self.modules))
+        rows = numpy.array([index.get(id, -1) for id in self.rowItems], dtype=numpy.intp)
+        columns = numpy.array([index.get(id, -1) for id in self.headItems], dtype=numpy.intp)
+        indices = numpy.nonzero(self.connection >= threshold)
+        origins, targets = rows[indices[0]], columns[indices[1]]
+        known = (origins >= 0) & (targets >= 0)
+        for i in numpy.flatnonzero(~known).tolist():
+            print("Unknown region in the connection " + self.rowItems[indices[0][i]] + "-" +
+                  self.headItems[indices[1][i]] + ".")
+        self.set_connections(origins[known], targets[known])
         self.add_hierarchy_to_modules()
 
-    def create_port(self, type, module, origin, target):
-        port_name = self.alter_module_name(origin) + "-" + self.alter_module_name(target) + "-" + type
-        if "Ports" in module:
-            ports = module["Ports"]
-        else:
+    def build_from_edges(self, path, threshold):
+        """
+        Build from an edge list instead of a connection table, streaming the edges.
+        Each line of the file is `source ID<TAB>target ID<TAB>score`.  Lines starting with '#'
+        are comments, except an optional `# shape <rows> <columns>` line declaring the number of
+        source and target regions; a first line whose score is not a number is a heading.
+        When the network is coarsened, the scores are aggregated per pair of coarse regions
+        before the threshold is applied, and the connections are added in the order of the regions.
+        """
+        import array
+        self.edgeShape = None
+        index = dict((id, i) for i, id in enumerate(self.modules))
+        origin_indices = array.array('q')
+        target_indices = array.array('q')
+        sources = set()
+        targets = set()
+        defined = set()
+        aggregated = {}
+        for id, target_id, var in self.read_edges(path):
+            if self.depth is None and var < threshold:
+                continue
+            regions = self.modules if self.depth is None else self.groups
+            if id not in regions or target_id not in regions:
+                print("Unknown region in the edge " + id + "-" + target_id + ".")
+                continue
+            sources.add(id)
+            targets.add(target_id)
+            if self.depth is not None:
+                pair = (self.groups[id], self.groups[target_id])
+                if pair[0] == pair[1] and id != target_id:  # inside a coarse region
+                    continue
+                if pair in aggregated:
+                    aggregated[pair] = max(aggregated[pair], var) if self.aggregate == "max" else aggregated[pair] + var
+                else:
+                    aggregated[pair] = var
+                continue
+            if (id, target_id) in defined:
+                continue
+            defined.add((id, target_id))
+            origin_indices.append(index[id])
+            target_indices.append(index[target_id])
+        # The coarse connections in the region order
+        for pair in sorted(aggregated, key=lambda pair: (index[pair[0]], index[pair[1]])):
+            if aggregated[pair] >= threshold:
+                origin_indices.append(index[pair[0]])
+                target_indices.append(index[pair[1]])
+        if self.edgeShape is not None and (len(sources) > self.edgeShape[0] or len(targets) > self.edgeShape[1]):
+            sys.stderr.write("Warning: the edges have more regions than the shape " + str(self.edgeShape) + ".\n")
+        self.set_connections(origin_indices, target_indices)
+        self.add_hierarchy_to_modules()
+
+    def read_edges(self, path):
+        """
+        Generate (source ID, target ID, score) from an edge list (see build_from_edges).
+        """
+        heading = True
+        for line in open(path, 'r'):
+            line = line.rstrip('\r\n')
+            if line.strip() == '':
+                continue
+            if line[0] == '#':
+                items = line[1:].split()
+                if len(items) == 3 and items[0] == "shape":
+                    self.edgeShape = (int(items[1]), int(items[2]))
+                continue
+            items = line.split('\t')
+            if len(items) < 3:
+                print("Cannot read the edge '" + line + "'.")
+                continue
+            try:
+                var = float(items[2]) if items[2].strip() != '' else 0.0
+            except ValueError:
+                if not heading:
+                    print("Cannot convert the score '" + items[2] + "' of the edge " + items[0] + "-" + items[1] + ".")
+                heading = False
+                continue
+            heading = False
+            yield items[0].strip(), items[1].strip(), var
+
+    def get_ancestors(self, id):
+        """
+        Returns:
+          [id, its upper region, ..., the top region]
+        """
+        ancestors = [id]
+        while id in self.superModules and len(ancestors) <= len(self.modules):
+            id = self.superModules[id]
+            ancestors.append(id)
+        return ancestors
+
+    def get_group(self, id, depth):
+        """
+        Returns:
+          the ancestor of the region at the depth (0: top regions), or the region itself
+          if it is not deeper than that.
+        """
+        ancestors = self.get_ancestors(id)
+        if len(ancestors) - 1 <= depth:
+            return id
+        return ancestors[len(ancestors) - 1 - depth]
+
+    def max_depth(self):
+        return max([len(self.get_ancestors(id)) - 1 for id in self.modules] + [0])
+
+    def count_modules(self, depth):
+        return len([id for id in self.modules if len(self.get_ancestors(id)) - 1 <= depth])
+
+    def depth_for_modules(self, target):
+        """
+        Returns:
+          the deepest depth at which the network has at most `target` modules (at least 0).
+        """
+        for depth in range(self.max_depth(), 0, -1):
+            if self.count_modules(depth) <= target:
+                return depth
+        return 0
+
+    def coarsen_matrix(self, depth, aggregate="sum"):
+        """
+        Aggregate the connection matrix up to the regions at the depth.
+        Returns:
+          (matrix, row IDs, column IDs)
+        """
+        import numpy
+        rows = [self.get_group(id, depth) for id in self.rowItems]
+        columns = [self.get_group(id, depth) for id in self.headItems]
+        row_ids = list(dict.fromkeys(rows))
+        column_ids = list(dict.fromkeys(columns))
+        row_index = dict((id, i) for i, id in enumerate(row_ids))
+        column_index = dict((id, i) for i, id in enumerate(column_ids))
+        row_map = numpy.array([row_index[id] for id in rows], dtype=numpy.intp)
+        column_map = numpy.array([column_index[id] for id in columns], dtype=numpy.intp)
+        ufunc = numpy.maximum if aggregate == "max" else numpy.add
+        initial = -numpy.inf if aggregate == "max" else 0.0
+        matrix = numpy.nan_to_num(numpy.asarray(self.connection), nan=initial)
+        # Connections between different regions inside a coarse region are dropped
+        ids = dict((id, i) for i, id in enumerate(dict.fromkeys(rows + columns + self.rowItems + self.headItems)))
+        inside = (numpy.array([ids[id] for id in rows])[:, None] == numpy.array([ids[id] for id in columns])) & \
+                 (numpy.array([ids[id] for id in self.rowItems])[:, None] != numpy.array([ids[id] for id in self.headItems]))
+        matrix[inside] = initial
+        partial = numpy.full((len(row_ids), matrix.shape[1]), initial)
+        ufunc.at(partial, row_map, matrix)
+        coarse = numpy.full((len(column_ids), len(row_ids)), initial)
+        ufunc.at(coarse, column_map, partial.T)
+        return coarse.T, row_ids, column_ids
+
+    def coarsen(self, depth, aggregate="sum"):
+        """
+        Coarsen the network to the regions at the depth (0: top regions): the regions below it are
+        removed and their connection scores are aggregated (sum or max) into their ancestors.
+        Connections between different regions inside a coarse region are dropped.
+        Call after loading the tables and before build() or build_from_edges().
+        """
+        self.depth = depth
+        self.aggregate = aggregate
+        self.groups = dict((id, self.get_group(id, depth)) for id in self.modules)
+        if self.connection is not None:
+            self.connection, self.rowItems, self.headItems = self.coarsen_matrix(depth, aggregate)
+        removed = [id for id in self.modules if len(self.get_ancestors(id)) - 1 > depth]
+        for id in removed:
+            del self.modules[id]
+            if id in self.superModules:
+                del self.superModules[id]
+            if id in self.subModules:
+                del self.subModules[id]
+        for id in list(self.subModules):
+            self.subModules[id] = [sub for sub in self.subModules[id] if sub in self.modules]
+            if len(self.subModules[id]) == 0:
+                del self.subModules[id]
+
+    def level_report(self, threshold, edges_path=None, aggregate="sum"):
+        """
+        Returns:
+          a list of (depth, number of modules, number of connections) for each depth.
+        """
+        import numpy
+        report = []
+        for depth in range(self.max_depth() + 1):
+            if edges_path is None:
+                matrix = self.coarsen_matrix(depth, aggregate)[0]
+                connections = int(numpy.count_nonzero(matrix >= threshold))
+            else:
+                aggregated = {}
+                for id, target_id, var in self.read_edges(edges_path):
+                    if id not in self.modules or target_id not in self.modules:
+                        continue
+                    pair = (self.get_group(id, depth), self.get_group(target_id, depth))
+                    if pair[0] != pair[1] or id == target_id:
+                        if pair in aggregated:
+                            aggregated[pair] = max(aggregated[pair], var) if aggregate == "max" \
+                                else aggregated[pair] + var
+                        else:
+                            aggregated[pair] = var
+                connections = len([var for var in aggregated.values() if var >= threshold])
+            report.append((depth, self.count_modules(depth), connections))
+        return report
+
+    def set_connections(self, origins, targets):
+        """
+        Set the connections (origin and target region indices into self.modules) and sort their ports by
+        region: in the order of the connections, the output port before the input port of a connection.
+        """
+        import numpy
+        self.origins = numpy.asarray(origins, dtype=numpy.intp)
+        self.targets = numpy.asarray(targets, dtype=numpy.intp)
+        count = len(self.origins)
+        regions = numpy.concatenate((self.origins, self.targets))
+        positions = numpy.concatenate((numpy.arange(count), numpy.arange(count)))
+        kinds = numpy.repeat([0, 1], count)
+        self.portOrder = numpy.lexsort((kinds, positions, regions))
+        self.portStarts = numpy.searchsorted(regions[self.portOrder], numpy.arange(len(self.modules) + 1))
+
+    def iter_modules(self):
+        """
+        Generate the modules with the names of their ports.
+        """
+        names = [module["Name"] for module in self.modules.values()]
+        count = len(self.origins)
+        for i, module in enumerate(self.modules.values()):
             ports = []
-        ports.append(port_name)
-        module["Ports"] = ports
-        port = {"Name": port_name, "Module": module["Name"], "Type": type, "Shape": [10]}
+            for port in self.portOrder[self.portStarts[i]:self.portStarts[i + 1]].tolist():
+                position = port % count
+                type = "Output" if port < count else "Input"
+                ports.append(self.get_port_name(type, names[self.origins[position]], names[self.targets[position]]))
+            document = {"Name": module["Name"], "Comment": module["Comment"]}
+            if len(ports) > 0:
+                document["Ports"] = ports
+            document.update(module)
+            yield document
+
+    def iter_ports(self):
+        """
+        Generate the output and the input port of each connection.
+        """
+        names = [module["Name"] for module in self.modules.values()]
+        for origin, target in zip(self.origins.tolist(), self.targets.tolist()):
+            yield self.create_port("Output", names[origin], names[target])
+            yield self.create_port("Input", names[origin], names[target])
+
+    def iter_connections(self):
+        names = [module["Name"] for module in self.modules.values()]
+        for origin, target in zip(self.origins.tolist(), self.targets.tolist()):
+            yield self.create_connection(names[origin], names[target])
+
+    def get_port_name(self, type, origin, target):
+        return self.alter_module_name(origin) + "-" + self.alter_module_name(target) + "-" + type
+
+    def create_port(self, type, origin, target):
+        port = {"Name": self.get_port_name(type, origin, target), "Module": origin if type == "Output" else target,
+                "Type": type, "Shape": [10]}
+        if self.dtype is not None:
+            port["DType"] = self.dtype
         if type == "Input":
             port["Comment"] = "An input port of " + target + " for connection from " + origin
         else:
             port["Comment"] = "An output port of " + origin + " for connection to " + target
-        self.ports.append(port)
+        return port
 
-    def create_connection(self, originID, targetID):
-        originName = self.modules[originID]["Name"]
-        targetName = self.modules[targetID]["Name"]
+    def create_connection(self, originName, targetName):
         connection = {}
         connectionName = originName + "-" + targetName
         connection["Name"] = connectionName
         connection["FromModule"] = originName
         connection["ToModule"] = targetName
-        outputPortName = self.alter_module_name(originName) + "-" + self.alter_module_name(targetName) + "-Output"
-        inputPortName = self.alter_module_name(originName) + "-" + self.alter_module_name(targetName) + "-Input"
+        outputPortName = self.get_port_name("Output", originName, targetName)
+        inputPortName = self.get_port_name("Input", originName, targetName)
         connection["FromPort"] = outputPortName  # self.getPath(originID) + "/" + outputPortName
         connection["ToPort"] = inputPortName  # self.getPath(targetID) + "/" + inputPortName
         connection["Comment"] = "A connection from " + originName + " to " + targetName
-        self.connections.append(connection)
+        return connection
 
     @staticmethod
     def alter_module_name(name):
         return name.replace('.', '#')
 
     def add_hierarchy_to_modules(self):
+        """
+        Set the SuperModule and the SubModules of the modules by name (the tables refer to the regions by ID).
+        """
         for moduleID in self.modules:
             module = self.modules[moduleID]
             if moduleID in self.superModules:
-                module["SuperModule"] = self.superModules[moduleID]
+                module["SuperModule"] = self.modules[self.superModules[moduleID]]["Name"]
             if moduleID in self.subModules:
-                module["SubModules"] = self.subModules[moduleID]
+                module["SubModules"] = [self.modules[id]["Name"] for id in self.subModules[moduleID]]
 
     def get_path(self, id):
         pathList = [id]
@@ -139,35 +431,93 @@ class Table2BriCAL:
                 path = path + "/" + self.modules[id]["Name"]
         return path
 
-    def write_json(self, path, base):
-        fp = open(path, 'w')
-        header = {"Type": "A"}
-        basename = os.path.basename(path)
-        if "." in basename:
-            header["Name"] = basename[0:basename.rfind(".")]
-        else:
-            header["Name"] = basename
-        header["Base"] = base
-        self.json["Header"] = header
-        modules = []
-        for module in self.modules:
-            modules.append(self.modules[module])
-        self.json["Modules"] = modules
-        self.json["Ports"] = self.ports
-        self.json["Connections"] = self.connections
-        json.dump(self.json, fp, indent=1)
-        fp.close()
+    def get_header(self, name, base):
+        return {"Type": "A", "Name": name, "Base": base}
+
+    def get_document(self, name, base):
+        """
+        Returns:
+          the BriCA language document of the built network, whose Header is named `name`, with
+          generators of the modules, the ports and the connections (see brical_converter.write_document).
+        """
+        return {"Header": self.get_header(name, base), "Modules": self.iter_modules(),
+                "Ports": self.iter_ports(), "Connections": self.iter_connections()}
+
+    def write_json(self, path, base, compact=False):
+        """
+        Write the document, producing the modules, the ports and the connections while writing them.
+        """
+        name = os.path.basename(path)
+        if "." in name:
+            name = name[0:name.rfind(".")]
+        with open(path, 'w') as fp:
+            write_document(fp, self.get_document(name, base), compact)
+
+
+def convert(connection, regions, hierarchy, prefix, threshold, name="brical", dtype=None, cache=True,
+            edge_list=False, depth=None, target_modules=None, aggregate="sum"):
+    """
+    Convert connectome tables into a BriCA language document.
+    Args:
+      connection: the connection table (region x region), or an edge list if edge_list is True.
+      regions: the region table.
+      hierarchy: the inclusion table.
+      prefix: the base name space.
+      threshold: the minimum connection score.
+      name: the Header name (unchanged, e.g. a dotted name space).
+      depth, target_modules, aggregate: the coarsening of the network (see Table2BriCAL.coarsen).
+    Returns:
+      the document (Header, Modules, Ports, Connections).
+    """
+    t2b = Table2BriCAL(dtype=dtype)
+    build(t2b, connection, regions, hierarchy, threshold, cache, edge_list, depth, target_modules, aggregate)
+    return collect_document(t2b.get_document(name, prefix))
+
+
+def build(t2b, connection, regions, hierarchy, threshold, cache=True, edge_list=False, depth=None,
+          target_modules=None, aggregate="sum", report=False):
+    if not edge_list:
+        t2b.load_connection(connection, cache=cache)
+    t2b.load_regions(regions)
+    t2b.load_hierarchy(hierarchy)
+    if report:
+        print("depth\tmodules\tconnections")
+        for level, modules, connections in t2b.level_report(threshold, connection if edge_list else None,
+                                                            aggregate):
+            print(str(level) + "\t" + str(modules) + "\t" + str(connections))
+    if target_modules is not None:
+        depth = t2b.depth_for_modules(target_modules)
+    if depth is not None:
+        t2b.coarsen(depth, aggregate)
+    if edge_list:
+        t2b.build_from_edges(connection, threshold)
+    else:
+        t2b.build(threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts connectome tables into a BriCAL JSON file.")
+    parser.add_argument("connection", help="connection table (region x region) or edge list (with --edge-list)")
+    parser.add_argument("regions", help="region table")
+    parser.add_argument("hierarchy", help="inclusion table")
+    parser.add_argument("output", help="output BriCAL JSON file")
+    parser.add_argument("prefix", help="base name space")
+    parser.add_argument("threshold", type=float, help="minimum connection score")
+    parser.add_argument("--dtype", help="DType of the generated ports (e.g. float32)")
+    parser.add_argument("--no-cache", action="store_true", help="neither read nor write connection.txt.npy")
+    parser.add_argument("--edge-list", action="store_true", help="the connection file is an edge list")
+    parser.add_argument("--compact", action="store_true", help="write the JSON file without indentation")
+    parser.add_argument("--depth", type=int, help="coarsen the network to the regions at this hierarchy depth")
+    parser.add_argument("--target-modules", type=int, help="coarsen to the deepest depth with at most this many modules")
+    parser.add_argument("--aggregate", choices=["sum", "max"], default="sum",
+                        help="aggregation of the scores when coarsening (default: sum)")
+    parser.add_argument("--report", action="store_true", help="print the modules and connections of each depth")
+    args = parser.parse_args()
+    t2b = Table2BriCAL(dtype=args.dtype)
+    build(t2b, args.connection, args.regions, args.hierarchy, args.threshold, not args.no_cache, args.edge_list,
+          args.depth, args.target_modules, args.aggregate, args.report)
+    t2b.write_json(args.output, args.prefix, compact=args.compact)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 7:
-        print("Usage: table2brical.py connection.txt regions.txt hierarchy.txt output.json prefix threshold")
-        quit()
-    params = sys.argv
-    threshold = float(params[6])
-    t2b = Table2BriCAL()
-    t2b.load_connection(params[1])
-    t2b.load_regions(params[2])
-    t2b.load_hierarchy(params[3])
-    t2b.build(threshold)
-    t2b.write_json(params[4], params[5])
+    main()
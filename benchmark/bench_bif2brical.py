@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_bif2brical.py
+=====
+
+Compares the extraction of bif2brical with SPARQL queries (one query joining all the
+connection triples, and one query per module and property: get_label, get_function,
+get_submodules) against the triple-pattern scans (get_connection_rows, index_graph)
+on a generated BIF ontology.
+
+    USE: python bench_bif2brical.py [--circuits N] [--branching N] [--sparql-connections]
+                                    [--save ontology.owl]
+
+"""
+
+import os
+import sys
+import copy
+import time
+import argparse
+import tempfile
+
+import rdflib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bif2brical"))
+import bif2brical
+
+BASE_URI = "https://wba-initiative.org/bench/"
+BIFD_URI = "https://wba-initiative.org/bifd/"
+
+
+def restriction(prop, target):
+    return ('    <rdfs:subClassOf>\n      <owl:Restriction>\n'
+            '        <owl:onProperty rdf:resource="' + BIFD_URI + prop + '"/>\n'
+            '        <owl:someValuesFrom rdf:resource="' + BASE_URI + target + '"/>\n'
+            '      </owl:Restriction>\n    </rdfs:subClassOf>\n')
+
+
+def generate_ontology(fp, circuits, branching):
+    """
+    Write a BIF ontology (RDF/XML) with a tree of circuits; every circuit is connected to
+    its next sibling and every parent circuit to its first child.
+    """
+    fp.write('<?xml version="1.0"?>\n<rdf:RDF xmlns="' + BASE_URI + '"\n     xml:base="' + BASE_URI + '"\n'
+             '     xmlns:owl="http://www.w3.org/2002/07/owl#"\n'
+             '     xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"\n'
+             '     xmlns:rdfs="http://www.w3.org/2000/01/rdf-schema#"\n'
+             '     xmlns:bifd="' + BIFD_URI + '">\n')
+    connections = []
+    for i in range(circuits):
+        name = "C" + str(i)
+        fp.write('  <owl:Class rdf:about="' + BASE_URI + name + '">\n')
+        fp.write('    <rdfs:subClassOf rdf:resource="' + BIFD_URI + 'Circuit"/>\n')
+        children = [j for j in range(i * branching + 1, i * branching + branching + 1) if j < circuits]
+        for j in children:
+            fp.write(restriction("hasPart", "C" + str(j)))
+        fp.write('    <rdfs:label>' + name + ' label</rdfs:label>\n')
+        fp.write('    <bifd:functionality>function of ' + name + '</bifd:functionality>\n')
+        fp.write('  </owl:Class>\n')
+        if children:
+            connections.append((name, "C" + str(children[0])))
+        for a, b in zip(children, children[1:]):
+            connections.append(("C" + str(a), "C" + str(b)))
+    for from_circuit, to_circuit in connections:
+        name = from_circuit + "-" + to_circuit
+        fp.write('  <owl:Class rdf:about="' + BASE_URI + name + '">\n')
+        fp.write('    <rdfs:subClassOf rdf:resource="' + BIFD_URI + 'Connection"/>\n')
+        fp.write(restriction("inputCircuit", from_circuit))
+        fp.write(restriction("outputCircuit", to_circuit))
+        fp.write('    <rdfs:label>' + name + '</rdfs:label>\n')
+        fp.write('  </owl:Class>\n')
+    fp.write('</rdf:RDF>\n')
+
+
+CONNECTION_QUERY = """
+    SELECT DISTINCT ?a ?aname ?from_uri ?to_uri
+    WHERE {
+        ?a rdfs:label ?aname .
+        ?a rdfs:subClassOf bifd:Connection.
+        ?a rdfs:subClassOf ?b.
+        ?b rdf:type owl:Restriction.
+        ?b owl:onProperty <https://wba-initiative.org/bifd/inputCircuit>.
+        ?b owl:someValuesFrom ?from_uri.
+        ?a rdfs:subClassOf ?c.
+        ?c rdf:type owl:Restriction.
+        ?c owl:onProperty <https://wba-initiative.org/bifd/outputCircuit>.
+        ?c owl:someValuesFrom ?to_uri.
+    }"""
+
+
+def get_connection_rows_per_query(g):
+    """ The connection extraction with a SPARQL query """
+    for row in g.query(CONNECTION_QUERY):
+        yield row.a, row.aname, row.from_uri, row.to_uri
+
+
+def define_modules_per_query(modules, module_uris, graphs, g, base_uri):
+    """ The extraction issuing three SPARQL queries per module """
+    for v in modules.values():
+        name = v["Name"]
+        uri = str(module_uris[name])
+        base = bif2brical.get_base_from_uri(uri)
+        v["Comment"] = base + ":" + bif2brical.get_label(graphs[base], uri) + ": " + \
+            bif2brical.get_function(graphs[base], uri)
+        submodules = bif2brical.get_submodules(g, base_uri + name)
+        if len(submodules) > 0:
+            v["SubModules"] = submodules
+        else:
+            v["ImplClass"] = ""
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the module extraction of bif2brical.")
+    parser.add_argument("--circuits", type=int, default=3000, help="number of circuits (default: 3000)")
+    parser.add_argument("--branching", type=int, default=4, help="sub-circuits per circuit (default: 4)")
+    parser.add_argument("--sparql-connections", action="store_true",
+                        help="also time the SPARQL connection query (slow: use with a few hundred circuits)")
+    parser.add_argument("--save", type=str, help="keep the generated ontology in this file")
+    args = parser.parse_args()
+
+    path = args.save
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix=".owl")
+        os.close(fd)
+    with open(path, "w") as fp:
+        generate_ontology(fp, args.circuits, args.branching)
+
+    start = time.perf_counter()
+    g = rdflib.Graph()
+    g.parse(path, format="xml")
+    parse_time = time.perf_counter() - start
+    graphs = {"bench": g}
+
+    modules = {}
+    module_uris = {}
+    start = time.perf_counter()
+    connections, base_uri = bif2brical.define_connections(modules, module_uris, g)
+    connection_time = time.perf_counter() - start
+
+    query_connection_time = None
+    if args.sparql_connections:
+        start = time.perf_counter()
+        rows = set(get_connection_rows_per_query(g))
+        query_connection_time = time.perf_counter() - start
+        if rows != set(bif2brical.get_connection_rows(g)):
+            sys.stderr.write("ERROR: the extracted connections differ!\n")
+            exit(1)
+
+    per_query = copy.deepcopy(modules)
+    start = time.perf_counter()
+    define_modules_per_query(per_query, module_uris, graphs, g, base_uri)
+    per_query_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bif2brical.define_modules(modules, module_uris, graphs, g, base_uri)
+    indexed_time = time.perf_counter() - start
+
+    if args.save is None:
+        os.remove(path)
+    if modules != per_query:
+        sys.stderr.write("ERROR: the extracted modules differ!\n")
+        exit(1)
+    print("circuits: {0}, modules: {1}, connections: {2}".format(args.circuits, len(modules), len(connections)))
+    print("parse: {0:.3f}s, define_connections: {1:.3f}s".format(parse_time, connection_time))
+    if query_connection_time is not None:
+        print("connections per query: {0:.3f}s, scanned: {1:.3f}s ({2:.1f}x)"
+              .format(query_connection_time, connection_time, query_connection_time / max(connection_time, 1e-9)))
+    print("define_modules per query: {0:.3f}s, indexed: {1:.3f}s ({2:.1f}x)"
+          .format(per_query_time, indexed_time, per_query_time / max(indexed_time, 1e-9)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_bif_excel2brical.py
+=====
+
+Compares the ingestion of bif_excel2brical from a read-only workbook (iter_rows) with
+the former ingestion reading every value with ws.cell() from a fully loaded workbook,
+on a generated BIF workbook.
+
+    USE: python bench_bif_excel2brical.py [--circuits N] [--branching N] [--connections N]
+                                          [--per-cell] [--save workbook.xlsx]
+
+"""
+
+import os
+import sys
+import math
+import time
+import argparse
+import tempfile
+
+import openpyxl
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bif_excel2brical"))
+import bif_excel2brical
+
+
+def generate_workbook(path, circuits, branching, connections):
+    """
+    Write a BIF workbook with a tree of circuits (Circuit sheet) and connections between
+    the leaf circuits and from every parent circuit to its first child (BriCA sheet).
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    project = wb.create_sheet("Project")
+    project.append(["Name", "", "Description"])
+    project.append(["Bench", "", "generated workbook"])
+    circuit = wb.create_sheet("Circuit")
+    circuit.append(["Name", "Label", "", "HasPart", "Functionality", "", "ImplClass"])
+    leaves = []
+    for i in range(circuits):
+        children = ["C" + str(j) for j in range(i * branching + 1, i * branching + branching + 1) if j < circuits]
+        if not children:
+            leaves.append("C" + str(i))
+        circuit.append(["C" + str(i), "circuit " + str(i), None, ";".join(children) if children else None,
+                        "function of C" + str(i), None, None if children else "brica1.PipeComponent"])
+    brica = wb.create_sheet("BriCA")
+    brica.append(["fromCircuit", "fromPort", "toCircuit", "toPort", "shape"])
+    for i in range(circuits):
+        j = i * branching + 1
+        if j < circuits:
+            brica.append(["C" + str(i), "in", "C" + str(j), "in", "1"])
+    for k in range(connections):
+        from_circuit = leaves[k % len(leaves)]
+        to_circuit = leaves[(k * 7 + 1) % len(leaves)]
+        brica.append([from_circuit, "out" + str(k % 16), to_circuit, "in" + str(k % 16), "4"])
+    wb.save(path)
+
+
+def create_modules_per_cell(ws):
+    """ The former createModules (two passes of ws.cell() over the Circuit sheet) """
+    modules = {}
+    for p in range(2):
+        for i in range(ws.max_row - 1):
+            val = ws.cell(row=i + 2, column=1).value
+            if val is not None and val.strip() != "":
+                name = val.strip().replace(' ', '_').replace(':', '.')
+                functionality = (ws.cell(row=i + 2, column=5).value or "").strip()
+                implClass = (ws.cell(row=i + 2, column=7).value or "").strip()
+                labels = ws.cell(row=i + 2, column=2).value or ""
+                parts = ws.cell(row=i + 2, column=4).value
+                submodules = [] if parts is None else [part.strip() for part in parts.split(';')]
+                module = {"Name": name, "Comment": labels + ":" + functionality}
+                if len(submodules) > 0:
+                    module["SubModules"] = submodules
+                else:
+                    module["ImplClass"] = implClass
+                modules[name] = module
+    return modules
+
+
+def create_connections_per_cell(ws, modules):
+    """ The former createConnections (ws.cell() and a linear scan of the ports of each module) """
+    ancestors = bif_excel2brical.get_ancestors(modules)
+    connections = []
+    for i in range(ws.max_row - 1):
+        values = [ws.cell(row=i + 2, column=j).value for j in range(1, 7)]
+        fromCircuit = (values[0] or "").strip().replace(' ', '_').replace(':', '.')
+        toCircuit = (values[2] or "").strip().replace(' ', '_').replace(':', '.')
+        if fromCircuit == "" or toCircuit == "":
+            continue
+        shape = [] if values[4] is None else [math.floor(float(v)) for v in str(values[4]).strip().split(",")]
+        connection = {"Name": fromCircuit + "-" + toCircuit, "FromModule": fromCircuit,
+                      "FromPort": (values[1] or "").strip(), "ToModule": toCircuit, "ToPort": (values[3] or "").strip()}
+        connections.append(connection)
+        if bif_excel2brical.upper_p(fromCircuit, toCircuit, ancestors):
+            types = ("Input", "Input")
+        elif bif_excel2brical.upper_p(toCircuit, fromCircuit, ancestors):
+            types = ("Output", "Output")
+        else:
+            types = ("Output", "Input")
+        for module, name, io in ((fromCircuit, connection["FromPort"], types[0]),
+                                 (toCircuit, connection["ToPort"], types[1])):
+            ports = modules[module].setdefault("Ports", [])
+            if not [port for port in ports if port["Name"] == name and port["Type"] == io]:
+                ports.append({"Name": name, "Type": io, "Shape": shape})
+    return connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the workbook ingestion of bif_excel2brical.")
+    parser.add_argument("--circuits", type=int, default=20000, help="rows of the Circuit sheet (default: 20000)")
+    parser.add_argument("--branching", type=int, default=4, help="sub-circuits per circuit (default: 4)")
+    parser.add_argument("--connections", type=int, default=40000,
+                        help="connections between leaf circuits (default: 40000)")
+    parser.add_argument("--per-cell", action="store_true",
+                        help="also time the former ws.cell() ingestion (slow: use with a few thousand rows)")
+    parser.add_argument("--save", type=str, help="keep the generated workbook in this file")
+    args = parser.parse_args()
+
+    path = args.save
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+    generate_workbook(path, args.circuits, args.branching, args.connections)
+
+    start = time.perf_counter()
+    wb = openpyxl.load_workbook(path, read_only=True)
+    modules = bif_excel2brical.createModules(wb['Circuit'])
+    connections, ports = bif_excel2brical.createConnections(wb['BriCA'], modules)
+    wb.close()
+    streamed_time = time.perf_counter() - start
+    print("circuits: {0}, modules: {1}, connections: {2}, ports: {3}".format(
+        args.circuits, len(modules), len(connections), len(ports)))
+    print("read-only iter_rows: {0:.3f}s".format(streamed_time))
+
+    if args.per_cell:
+        start = time.perf_counter()
+        wb = openpyxl.load_workbook(path)
+        per_cell = create_modules_per_cell(wb['Circuit'])
+        per_cell_connections = create_connections_per_cell(wb['BriCA'], per_cell)
+        per_cell_time = time.perf_counter() - start
+        if per_cell != modules or per_cell_connections != connections:
+            sys.stderr.write("ERROR: the ingested modules differ!\n")
+            exit(1)
+        print("per cell: {0:.3f}s ({1:.1f}x)".format(per_cell_time, per_cell_time / max(streamed_time, 1e-9)))
+
+    if args.save is None:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_compiled.py
+=====
+
+Compares the step throughput of brica1.VirtualTimeSyncScheduler with the step function
+compiled by `brical2py.py --compile` on the synthetic networks of `benchmark.py`.
+
+    USE: python bench_compiled.py [--suite small,medium] [--steps N]
+
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import brica1
+import brical
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "brical2py"))
+import brical2py
+import benchmark
+
+
+def build(paths):
+    """ Build a generated network; the components copy in0 to out and their out ports start with 1, 2, ... """
+    nb = brical.NetworkBuilder()
+    for path in paths:
+        with open(path) as f:
+            if not nb.load_file(f):
+                raise RuntimeError("cannot load " + path)
+    if not nb.check_consistency() or not nb.check_grounding():
+        raise RuntimeError("the network is not valid")
+    for module, v in nb.module_dictionary.items():
+        if v["ImplClass"] != "":
+            nb.unit_dic[module].__init__()
+            nb.unit_dic[module].set_map("in0", "out")
+    if not nb.make_ports():
+        raise RuntimeError("cannot make ports")
+    agent_builder = brical.AgentBuilder()
+    agent = agent_builder.create_agent(nb)
+    for i, (module, unit) in enumerate(sorted(agent_builder.get_modules().items())):
+        if isinstance(unit, brica1.Component):
+            port = unit.get_out_port("out")
+            port.buffer = np.full(port.buffer.shape, i + 1, dtype=port.buffer.dtype)
+    return nb, agent_builder, agent
+
+
+def out_values(agent_builder):
+    return {module: unit.get_out_port("out").buffer.tolist()
+            for module, unit in agent_builder.get_modules().items() if isinstance(unit, brica1.Component)}
+
+
+def run(config, steps):
+    with tempfile.TemporaryDirectory() as directory:
+        paths = benchmark.generate_network(directory, **config)
+
+        nb, agent_builder, agent = build(paths)
+        scheduler = brica1.VirtualTimeSyncScheduler(agent)
+        start = time.perf_counter()
+        for i in range(steps):
+            scheduler.step()
+        scheduler_time = time.perf_counter() - start
+        expected = out_values(agent_builder)
+
+        nb, agent_builder, agent = build(paths)
+        start = time.perf_counter()
+        source = io.StringIO()
+        brical2py.compile_network(nb, agent_builder, agent, source)
+        namespace = {}
+        exec(compile(source.getvalue(), "compiled", "exec"), namespace)
+        step = namespace["bind"](agent_builder.get_modules())
+        compile_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(steps):
+            step()
+        compiled_time = time.perf_counter() - start
+        if out_values(agent_builder) != expected:
+            raise RuntimeError("the compiled network computed different values")
+    return scheduler_time, compile_time, compiled_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the compiled step function of brical2py.py.")
+    parser.add_argument("--suite", type=str, default="small,medium",
+                        help="comma separated configurations among " + ", ".join(benchmark.SUITE) +
+                             " (default: small,medium)")
+    parser.add_argument("--steps", type=int, default=1000, help="steps per run (default: 1000)")
+    args = parser.parse_args()
+
+    for name in args.suite.split(","):
+        if name not in benchmark.SUITE:
+            sys.stderr.write("ERROR: unknown configuration " + name + "!\n")
+            exit(-1)
+        scheduler_time, compile_time, compiled_time = run(benchmark.SUITE[name], args.steps)
+        print("{0}: scheduler {1:.0f} steps/s, compiled {2:.0f} steps/s ({3:.1f}x), compile {4:.3f}s".format(
+            name, args.steps / scheduler_time, args.steps / compiled_time, scheduler_time / compiled_time,
+            compile_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+benchmark.py
+=====
+
+This module generates synthetic BriCA language networks and times the stages of
+`NetworkBuilder` and `AgentBuilder` on them.
+
+    USE: python benchmark.py [--suite small,medium] [--output results.json]
+                             [--baseline baseline.json [--update-baseline]]
+
+"""
+
+import os
+import sys
+import math
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+import brica1
+import brical
+
+BASE = "Bench"
+
+# Network configurations of the standard suite
+SUITE = {
+    "small": {"modules": 50, "depth": 1, "fan_out": 2, "width": 16, "files": 2},
+    "medium": {"modules": 300, "depth": 2, "fan_out": 3, "width": 64, "files": 6},
+    "large": {"modules": 1000, "depth": 3, "fan_out": 4, "width": 256, "files": 10},
+}
+
+STAGES = ["load_file", "check_consistency", "check_grounding", "make_ports", "create_agent", "step"]
+
+
+def generate_network(directory, modules, depth, fan_out, width, files):
+    """
+    Write a synthetic network into BriCA language files.
+    Args:
+      directory: the directory to write the files to.
+      modules: the number of leaf components (brica1.PipeComponent).
+      depth: the number of levels of super modules above the components.
+      fan_out: the number of connections from the output port of each component.
+      width: the Shape of every port.
+      files: the number of files the definitions are distributed over.
+    Returns:
+      the list of the written file paths.
+    """
+    if fan_out >= modules:
+        raise ValueError("fan_out must be smaller than the number of modules")
+    groups_per_level = []
+    branching = max(2, int(math.ceil(modules ** (1.0 / (depth + 1)))))
+    count = modules
+    for level in range(depth):
+        count = int(math.ceil(count / float(branching)))
+        groups_per_level.append(count)
+
+    definitions = []  # (module, ports, connections)
+    # Leaf components: L<i> has in0...in<fan_out-1>, out (and ext if it is in a group)
+    for i in range(modules):
+        ports = [("in" + str(j), "Input") for j in range(fan_out)] + [("out", "Output")]
+        if depth > 0:
+            ports.append(("ext", "Input"))
+        module = {"Name": "L" + str(i), "ImplClass": "brica1.PipeComponent"}
+        if depth > 0:
+            module["SuperModule"] = "G1_" + str(i // branching)
+        connections = []
+        for j in range(fan_out):
+            target = "L" + str((i + j + 1) % modules)
+            connections.append({"Name": "L" + str(i) + "-" + target, "FromModule": "L" + str(i), "FromPort": "out",
+                                "ToModule": target, "ToPort": "in" + str(j)})
+        definitions.append((module, ports, connections))
+
+    # Super modules: G<level>_<i> has sin aliased to its first child and sout aliased from it
+    for level in range(1, depth + 1):
+        for i in range(groups_per_level[level - 1]):
+            name = "G" + str(level) + "_" + str(i)
+            module = {"Name": name}
+            if level < depth:
+                module["SuperModule"] = "G" + str(level + 1) + "_" + str(i // branching)
+            if level == 1:
+                child, child_in, child_out = "L" + str(i * branching), "ext", "out"
+            else:
+                child, child_in, child_out = "G" + str(level - 1) + "_" + str(i * branching), "sin", "sout"
+            connections = [{"Name": name + "-" + child, "FromModule": name, "FromPort": "sin",
+                            "ToModule": child, "ToPort": child_in},
+                           {"Name": child + "-" + name, "FromModule": child, "FromPort": child_out,
+                            "ToModule": name, "ToPort": "sout"}]
+            definitions.append((module, [("sin", "Input"), ("sout", "Output")], connections))
+
+    paths = []
+    for k in range(files):
+        jsn = {"Header": {"Type": "A", "Name": "part" + str(k), "Base": BASE},
+               "Modules": [], "Ports": [], "Connections": []}
+        for module, ports, connections in definitions[k::files]:
+            module["Ports"] = [port_name for port_name, io in ports]
+            jsn["Modules"].append(module)
+            for port_name, io in ports:
+                jsn["Ports"].append({"Name": port_name, "Module": module["Name"], "Type": io, "Shape": [width]})
+            jsn["Connections"].extend(connections)
+        path = os.path.join(directory, "part" + str(k).zfill(4) + ".json")
+        with open(path, "w") as fp:
+            json.dump(jsn, fp)
+        paths.append(path)
+    return paths
+
+
+def run_stages(paths, steps):
+    """
+    Build and run a network once.
+    Returns:
+      Map: stage name ⇒ elapsed seconds.
+    """
+    timings = {}
+    nb = brical.NetworkBuilder()
+    start = time.perf_counter()
+    for path in paths:
+        with open(path) as f:
+            if not nb.load_file(f):
+                raise RuntimeError("cannot load " + path)
+    timings["load_file"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if not nb.check_consistency():
+        raise RuntimeError("the network is not consistent")
+    timings["check_consistency"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if not nb.check_grounding():
+        raise RuntimeError("the network is not grounded")
+    timings["check_grounding"] = time.perf_counter() - start
+
+    for module, v in nb.module_dictionary.items():
+        if v["ImplClass"] != "":
+            nb.unit_dic[module].__init__()
+            nb.unit_dic[module].set_map("in0", "out")
+
+    start = time.perf_counter()
+    if not nb.make_ports():
+        raise RuntimeError("cannot make ports")
+    timings["make_ports"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    agent_builder = brical.AgentBuilder()
+    agent = agent_builder.create_agent(nb)
+    timings["create_agent"] = time.perf_counter() - start
+
+    scheduler = brica1.VirtualTimeSyncScheduler(agent)
+    start = time.perf_counter()
+    for i in range(steps):
+        scheduler.step()
+    timings["step"] = (time.perf_counter() - start) / max(steps, 1)
+    return timings
+
+
+def benchmark(config, steps, repeat):
+    """
+    Time every stage on a generated network, keeping the minimum over the repetitions.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        paths = generate_network(directory, **config)
+        best = {}
+        for i in range(repeat):
+            for stage, elapsed in run_stages(paths, steps).items():
+                best[stage] = min(best.get(stage, elapsed), elapsed)
+    return best
+
+
+def compare(results, baseline, tolerance, noise):
+    """
+    Returns:
+      a list of messages, one for each stage slower than the baseline by more than the tolerance.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for stage, elapsed in result["stages"].items():
+            reference = baseline[name]["stages"].get(stage)
+            if reference is None:
+                continue
+            if elapsed > reference * (1.0 + tolerance) and elapsed - reference > noise:
+                regressions.append("{0}.{1}: {2:.6f}s (baseline {3:.6f}s)".format(name, stage, elapsed, reference))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks BriCAL on synthetic networks.")
+    parser.add_argument("--suite", type=str, default="small,medium",
+                        help="comma separated configurations among " + ", ".join(SUITE) + " (default: small,medium)")
+    parser.add_argument("--modules", type=int, help="run a custom configuration with this number of components")
+    parser.add_argument("--depth", type=int, default=2, help="hierarchy depth of the custom configuration")
+    parser.add_argument("--fan_out", type=int, default=3, help="fan-out of the custom configuration")
+    parser.add_argument("--width", type=int, default=64, help="port width of the custom configuration")
+    parser.add_argument("--files", type=int, default=4, help="number of files of the custom configuration")
+    parser.add_argument("--steps", type=int, default=100, help="scheduler steps per run (default: 100)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per configuration (default: 3)")
+    parser.add_argument("--output", type=str, help="write the results (JSON) to this file")
+    parser.add_argument("--baseline", type=str, help="baseline results (JSON) to compare with")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results to the baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown relative to the baseline (default: 0.5, i.e. 50%%)")
+    parser.add_argument("--noise", type=float, default=0.001,
+                        help="differences below this many seconds are ignored (default: 0.001)")
+    args = parser.parse_args()
+
+    if args.modules is not None:
+        configs = {"custom": {"modules": args.modules, "depth": args.depth, "fan_out": args.fan_out,
+                              "width": args.width, "files": args.files}}
+    else:
+        configs = {}
+        for name in args.suite.split(","):
+            if name not in SUITE:
+                sys.stderr.write("ERROR: unknown configuration " + name + "!\n")
+                exit(-1)
+            configs[name] = SUITE[name]
+
+    results = {}
+    for name, config in configs.items():
+        stages = benchmark(config, args.steps, args.repeat)
+        results[name] = {"params": dict(config, steps=args.steps, repeat=args.repeat), "stages": stages}
+        sys.stderr.write(name + ": " + ", ".join("{0} {1:.6f}s".format(stage, stages[stage])
+                                                 for stage in STAGES) + "\n")
+
+    report = {"python": platform.python_version(), "platform": platform.platform(), "results": results}
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write("\n")
+
+    if args.baseline:
+        if args.update_baseline:
+            baseline = {}
+            if os.path.isfile(args.baseline):
+                with open(args.baseline) as fp:
+                    baseline = json.load(fp)["results"]
+            baseline.update(results)
+            with open(args.baseline, "w") as fp:
+                json.dump(dict(report, results=baseline), fp, indent=1)
+            return
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)["results"]
+        regressions = compare(results, baseline, args.tolerance, args.noise)
+        for message in regressions:
+            sys.stderr.write("REGRESSION: " + message + "\n")
+        if regressions:
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
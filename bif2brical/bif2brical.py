@@ -1,7 +1,10 @@
-import xml.etree.ElementTree as et
-import rdflib
+import os
+import sys
+import pickle
+import hashlib
+import concurrent.futures
 import argparse
-import json
+from brical_converter import write_document, collect_document, get_ancestors, upper_p
 
 
 def get_label(graph, uri):
@@ -46,6 +49,38 @@ def get_submodules(g, uri):
     return modules
 
 
+BIFD_URI = "https://wba-initiative.org/bifd/"
+
+
+def index_graph(graph):
+    """
+    Collect the labels, functionalities and sub-modules (hasPart restrictions) of all the
+    classes of a graph with one triple-pattern scan per property, instead of querying each module.
+    Returns:
+      (labels, functions, submodules): Map: URI ⇒ label, Map: URI ⇒ functionality,
+      Map: URI ⇒ list of sub-module names
+    """
+    import rdflib
+    BIFD = rdflib.Namespace(BIFD_URI)
+    labels = {}
+    for s, o in graph.subject_objects(rdflib.RDFS.label):
+        labels.setdefault(str(s), str(o))
+    functions = {}
+    for s, o in graph.subject_objects(BIFD.functionality):
+        functions.setdefault(str(s), str(o))
+    submodules = {}
+    for b in graph.subjects(rdflib.OWL.onProperty, BIFD.hasPart):
+        if (b, rdflib.RDF.type, rdflib.OWL.Restriction) not in graph:
+            continue
+        for m in graph.objects(b, rdflib.OWL.someValuesFrom):
+            m = str(m)
+            for s in graph.subjects(rdflib.RDFS.subClassOf, b):
+                names = submodules.setdefault(str(s), [])
+                if m[m.rfind("/")+1:] not in names:
+                    names.append(m[m.rfind("/")+1:])
+    return labels, functions, submodules
+
+
 def get_name_from_uri(uri):
     return uri[uri.rfind('/', 0, -2) + 1:-1] if uri[-1] == '/' else uri[uri.rfind('/') + 1]
 
@@ -55,53 +90,128 @@ def get_base_from_uri(uri):
     return items[-2] if uri[-3] == '/' else items[-2]
 
 
-def upper_p(module1, module2, modules):
-    if 'SubModules' in modules[module1]:
-        submodules = modules[module1]['SubModules']
-        if module2 in submodules:
-            return True
+URI_TMP = 'https://wba-initiative.org/noprefix/'
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bif2brical")
+
+
+def get_base(graph):
+    """ The base of a parsed ontology: the name of its default name space (the xml:base of the BIFD files) """
+    for prefix, uri in graph.namespaces():
+        if prefix == "":
+            return get_name_from_uri(str(uri))
+    return None
+
+
+def get_cache_path(path, cache_dir):
+    """ The cache file of an ontology, keyed by the hash of its content (and the rdflib version) """
+    import rdflib
+    digest = hashlib.sha256()
+    digest.update((rdflib.__version__ + "\n" + URI_TMP + "\n").encode("utf-8"))
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+    return os.path.join(cache_dir, digest.hexdigest() + ".pickle")
+
+
+def load_ontology(path, cache_dir=None, cache_path=None):
+    """
+    Parse an RDF/XML ontology, or load it from the cache of parsed graphs.
+    Args:
+      path: the ontology file.
+      cache_dir: the cache directory, or None not to use the cache.
+      cache_path: the cache file of the ontology if already known (see get_cache_path).
+    Returns:
+      (base, rdflib.Graph)
+    """
+    if cache_dir is not None:
+        if cache_path is None:
+            cache_path = get_cache_path(path, cache_dir)
+        if os.path.isfile(cache_path):
+            try:
+                with open(cache_path, "rb") as fp:
+                    return pickle.load(fp)
+            except Exception:
+                pass  # A broken cache file is parsed again
+    import rdflib
+    g = rdflib.Graph()
+    g.parse(path, publicID=URI_TMP, format="xml")
+    base = get_base(g)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + "." + str(os.getpid())
+        with open(tmp_path, "wb") as fp:
+            pickle.dump((base, g), fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    return base, g
+
+
+def load_ontologies(paths, cache_dir=None, jobs=None):
+    """
+    Load ontologies; those not in the cache are parsed in worker processes when there are more than one.
+    Returns:
+      the list of (base, rdflib.Graph) in the order of the paths.
+    """
+    loaded = [None] * len(paths)
+    cache_paths = [None if cache_dir is None else get_cache_path(path, cache_dir) for path in paths]
+    parse = []
+    for i, path in enumerate(paths):
+        if cache_paths[i] is not None and os.path.isfile(cache_paths[i]):
+            loaded[i] = load_ontology(path, cache_dir, cache_paths[i])
         else:
-            for submodule in submodules:
-                if upper_p(submodule, module2, modules):
-                    return True
+            parse.append(i)
+    if len(parse) < 2 or jobs == 1:
+        for i in parse:
+            loaded[i] = load_ontology(paths[i], cache_dir, cache_paths[i])
     else:
-        return False
-    return False
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            for i, result in zip(parse, executor.map(load_ontology, [paths[i] for i in parse],
+                                                     [cache_dir] * len(parse), [cache_paths[i] for i in parse])):
+                loaded[i] = result
+    return loaded
 
 
 # Collecting Connections
+def get_connection_rows(g):
+    """
+    Generate (connection URI, label, from URI, to URI) of the bifd:Connection classes of a graph
+    with triple-pattern scans.
+    """
+    import rdflib
+    BIFD = rdflib.Namespace(BIFD_URI)
+    for a in g.subjects(rdflib.RDFS.subClassOf, BIFD.Connection):
+        from_uris = []
+        to_uris = []
+        for b in g.objects(a, rdflib.RDFS.subClassOf):
+            if (b, rdflib.RDF.type, rdflib.OWL.Restriction) not in g:
+                continue
+            for prop in g.objects(b, rdflib.OWL.onProperty):
+                if prop == BIFD.inputCircuit:
+                    from_uris.extend(g.objects(b, rdflib.OWL.someValuesFrom))
+                elif prop == BIFD.outputCircuit:
+                    to_uris.extend(g.objects(b, rdflib.OWL.someValuesFrom))
+        for aname in g.objects(a, rdflib.RDFS.label):
+            for from_uri in from_uris:
+                for to_uri in to_uris:
+                    yield a, aname, from_uri, to_uri
+
+
 def define_connections(modules, module_uris, g):
     connections = {}
     base_uri = ""
-    q = """
-    SELECT DISTINCT ?a ?aname ?from_uri ?to_uri
-    WHERE {
-        ?a rdfs:label ?aname .
-        ?a rdfs:subClassOf bifd:Connection.
-        ?a rdfs:subClassOf ?b.
-        ?b rdf:type owl:Restriction.
-        ?b owl:onProperty <https://wba-initiative.org/bifd/inputCircuit>.
-        ?b owl:someValuesFrom ?from_uri.
-        ?a rdfs:subClassOf ?c.
-        ?c rdf:type owl:Restriction.
-        ?c owl:onProperty <https://wba-initiative.org/bifd/outputCircuit>.
-        ?c owl:someValuesFrom ?to_uri.
-    }"""
-    qres = g.query(q)
-    for row in qres:
-        connection = str(row.aname)
+    for a, aname, from_uri, to_uri in get_connection_rows(g):
+        connection = str(aname)
         if base_uri == "":
-            uri = str(row.a)
+            uri = str(a)
             base_uri = uri[:uri.rfind("/")+1]
         mds = connection.split("-")
         from_module = mds[0]
         to_module = mds[1]
         if from_module not in modules:
             modules[from_module] = {"Name": from_module, "Ports": []}
-            module_uris[from_module] = row.from_uri
+            module_uris[from_module] = from_uri
         if to_module not in modules:
             modules[to_module] = {"Name": to_module, "Ports": []}
-            module_uris[to_module] = row.to_uri
+            module_uris[to_module] = to_uri
         connections[connection] = {"Name": connection, "FromModule": from_module, "FromPort": connection,
                                    "ToModule": to_module, "ToPort": connection}
     return connections, base_uri
@@ -109,40 +219,103 @@ def define_connections(modules, module_uris, g):
 
 # Collecting Modules
 def define_modules(modules, module_uris, graphs, g, base_uri):
+    indexes = {}  # Base ⇒ index of the graph
+    g_index = index_graph(g)
     for v in modules.values():
         name = v["Name"]
         uri = str(module_uris[name])
-        v["Comment"] = get_base_from_uri(uri) + ":" + get_label(graphs[get_base_from_uri(uri)], uri) + ": " + \
-                       get_function(graphs[get_base_from_uri(uri)], uri)
-        submodules = get_submodules(g, base_uri + name)
+        base = get_base_from_uri(uri)
+        if base not in indexes:
+            indexes[base] = g_index if graphs[base] is g else index_graph(graphs[base])
+        labels, functions, _ = indexes[base]
+        v["Comment"] = base + ":" + labels.get(uri, "") + ": " + functions.get(uri, "")
+        submodules = g_index[2].get(base_uri + name, [])
         if len(submodules) > 0:
-            v["SubModules"] = submodules
+            v["SubModules"] = list(submodules)
         else:
             v["ImplClass"] = ""
     return modules
 
 
 # Defining Ports
-def define_ports(connections, modules):
-    ports = []
-    for connection in connections:
-        v = connections[connection]
+def define_ports(connections, modules, dtype=None):
+    """
+    Add the ports of the connections to the modules.
+    Returns:
+      a generator of the ports, or None if the modules have cyclic SubModules.
+    """
+    ancestors = get_ancestors(modules)
+    if ancestors is None:
+        return None
+    for connection, v in connections.items():
+        modules[v["FromModule"]]["Ports"].append(connection)
+        modules[v["ToModule"]]["Ports"].append(connection)
+    return iter_ports(connections, ancestors, dtype)
+
+
+def iter_ports(connections, ancestors, dtype=None):
+    for connection, v in connections.items():
         from_module = v["FromModule"]
         to_module = v["ToModule"]
-        if upper_p(from_module, to_module, modules):
+        if upper_p(from_module, to_module, ancestors):
             connection_from = "Input"
             connection_to = "Input"
-        elif upper_p(to_module, from_module, modules):
+        elif upper_p(to_module, from_module, ancestors):
             connection_from = "Output"
             connection_to = "Output"
         else:
             connection_from = "Output"
             connection_to = "Input"
-        ports.append({"Name": connection, "Module": from_module, "Type": connection_from, "Shape": [1]})
-        ports.append({"Name": connection, "Module": to_module, "Type": connection_to, "Shape": [1]})
-        modules[from_module]["Ports"].append(connection)
-        modules[to_module]["Ports"].append(connection)
-    return ports
+        from_port = {"Name": connection, "Module": from_module, "Type": connection_from, "Shape": [1]}
+        to_port = {"Name": connection, "Module": to_module, "Type": connection_to, "Shape": [1]}
+        if dtype is not None:
+            from_port["DType"] = dtype
+            to_port["DType"] = dtype
+        yield from_port
+        yield to_port
+
+
+def get_document(input, bifd, external_ontologies=None, dtype=None, cache_dir=CACHE_DIR, jobs=None):
+    """
+    Read a BIFD ontology into a BriCA language document whose ports are generated while it is
+    written (see brical_converter.write_document).  The arguments are those of convert.
+    Returns:
+      the document (Header, Modules, Ports, Connections), or None if the conversion failed.
+    """
+    # Get BIFD, Base and Graph, and External Ontologies
+    paths = [bifd, input] + (external_ontologies or [])
+    loaded = load_ontologies(paths, cache_dir, jobs)
+    base, g = loaded[1]
+    graphs = {base: g}
+    for eo_base, eo_g in loaded[2:]:
+        graphs[eo_base] = eo_g
+
+    modules = {}
+    module_uris = {}
+    connections, base_uri = define_connections(modules, module_uris, g)
+    modules = define_modules(modules, module_uris, graphs, g, base_uri)
+    ports = define_ports(connections, modules, dtype)
+    if ports is None:
+        return None
+    return {"Header": {"Type": "A", "Name": base, "Base": base}, "Modules": modules.values(),
+            "Ports": ports, "Connections": connections.values()}
+
+
+def convert(input, bifd, external_ontologies=None, dtype=None, cache_dir=CACHE_DIR, jobs=None):
+    """
+    Convert a BIFD ontology into a BriCA language document.
+    Args:
+      input: the ontology file.
+      bifd: bifd.owl.
+      external_ontologies: the files of the external ontologies.
+      dtype: the `DType` of the ports.
+      cache_dir: the directory of the parsed ontology cache, or None not to use the cache.
+      jobs: the number of worker processes parsing the ontologies.
+    Returns:
+      the document (Header, Modules, Ports, Connections), or None if the conversion failed.
+    """
+    document = get_document(input, bifd, external_ontologies, dtype, cache_dir, jobs)
+    return None if document is None else collect_document(document)
 
 
 def main():
@@ -152,51 +325,21 @@ def main():
     parser.add_argument("--output", help="output file", type=str)
     parser.add_argument("--bifd", help="bifd.owl", type=str)
     parser.add_argument("--external_ontologies", nargs='*', help="URIs", type=str)
+    parser.add_argument("--dtype", help="DType of the ports (e.g. float32)", type=str)
+    parser.add_argument("--compact", help="write the JSON file without indentation", action="store_true")
+    parser.add_argument("--cache_dir", help="directory of the parsed ontology cache (default: " + CACHE_DIR + ")",
+                        type=str, default=CACHE_DIR)
+    parser.add_argument("--no_cache", help="parse the ontologies without the cache", action="store_true")
+    parser.add_argument("--jobs", help="worker processes parsing the ontologies (default: CPU count)", type=int)
     args = parser.parse_args()
 
-    URI_TMP = 'https://wba-initiative.org/noprefix/'
-    BASE = '{http://www.w3.org/XML/1998/namespace}base'
-
-    # Get BIFD
-    g_bifd = rdflib.Graph()
-    g_bifd.parse(args.bifd, publicID=URI_TMP, format="xml")
-
-    # Get Base and Graph
-    tree = et.parse(args.input)
-    base = get_name_from_uri(tree.getroot().get(BASE))
-
-    g = rdflib.Graph()
-    g.parse(args.input, publicID=URI_TMP, format="xml")
-
-    graphs = {base: g}
-
-    # Get External Ontologies
-    if args.external_ontologies is not None:
-        for eo in args.external_ontologies:
-            tree = et.parse(eo)
-            eo_base = get_name_from_uri(tree.getroot().get(BASE))
-            eo_g = rdflib.Graph()
-            eo_g.parse(eo, publicID=URI_TMP, format="xml")
-            graphs[eo_base] = eo_g
-
-    modules = {}
-    module_uris = {}
-    connections, base_uri = define_connections(modules, module_uris, g)
-    modules = define_modules(modules, module_uris, graphs, g, base_uri)
-    ports = define_ports(connections, modules)
-
-    module_array = []
-    for v in modules.values():
-        module_array.append(v)
-
-    output = {"Header": {"Type": "A", "Name": base, "Base": base}, "Modules": module_array, "Ports": ports}
-    connection_array = []
-    for v in connections.values():
-        connection_array.append(v)
-    output["Connections"] = connection_array
+    document = get_document(args.input, args.bifd, args.external_ontologies, args.dtype,
+                           None if args.no_cache else args.cache_dir, args.jobs)
+    if document is None:
+        exit(1)
 
     fp = open(args.output, 'w')
-    json.dump(output, fp, indent=1)
+    write_document(fp, document, args.compact)
     fp.close()
 
 
@@ -1,79 +1,80 @@
 # -*- coding: utf-8 -*-
 """
-    USE: python bif_exel2brical.py infile outfile
+    USE: python bif_exel2brical.py infile outfile [--compact]
 """
 import sys
 import math
-import json
-import openpyxl
+from brical_converter import write_document, collect_document, get_ancestors, upper_p
+
+
+def get_rows(ws, columns):
+    """
+    Generate the rows below the header as tuples of `columns` values
+    (the rows of a read-only worksheet omit the empty trailing cells).
+    """
+    for row in ws.iter_rows(min_row=2, max_col=columns, values_only=True):
+        if len(row) < columns:
+            row = tuple(row) + (None,) * (columns - len(row))
+        yield row
 
 
 def createModules(ws):
     modules = {}
-    for p in range(2):
-        for i in range(ws.max_row - 1):
-            val = ws.cell(row=i + 2, column=1).value
-            if val is not None and val.strip() != "":
-                name = val.strip().replace(' ', '_').replace(':', '.')
-                clm4 = ws.cell(row=i + 2, column=5).value  # Functionality
-                if clm4 is None:
-                    functionality = ""
-                else:
-                    functionality = clm4.strip()
-                clm6 = ws.cell(row=i + 2, column=7).value  # implementation
-                if clm6 is None:
-                    implClass = ""
-                else:
-                    implClass = clm6.strip()
-                labels = ws.cell(row=i + 2, column=2).value
-                if labels is None:
-                    labels = ""
-                parts = ws.cell(row=i + 2, column=4).value
-                submodules = []
-                if parts is not None:
-                    submodules = parts.split(';')
-                    for j in range(len(submodules)):
-                        submodules[j] = submodules[j].strip()
-                module = {"Name": name, "Comment": labels + ":" + functionality}
-                if len(submodules) > 0:
-                    module["SubModules"] = submodules
-                else:
-                    module["ImplClass"] = implClass
-                modules[name] = module
+    for row in get_rows(ws, 7):
+        val = row[0]
+        if val is not None and val.strip() != "":
+            name = val.strip().replace(' ', '_').replace(':', '.')
+            clm4 = row[4]  # Functionality
+            if clm4 is None:
+                functionality = ""
+            else:
+                functionality = clm4.strip()
+            clm6 = row[6]  # implementation
+            if clm6 is None:
+                implClass = ""
+            else:
+                implClass = clm6.strip()
+            labels = row[1]
+            if labels is None:
+                labels = ""
+            parts = row[3]
+            submodules = []
+            if parts is not None:
+                submodules = parts.split(';')
+                for j in range(len(submodules)):
+                    submodules[j] = submodules[j].strip()
+            module = {"Name": name, "Comment": labels + ":" + functionality}
+            if len(submodules) > 0:
+                module["SubModules"] = submodules
+            else:
+                module["ImplClass"] = implClass
+            modules[name] = module
     return modules
 
 
-def upper_p(module1, module2, modules):
-    if 'SubModules' in modules[module1]:
-        if module2 in modules[module1]['SubModules']:
-            return True
-        else:
-            for submodule in modules[module1]['SubModules']:
-                if upper_p(submodule, module2, modules):
-                    return True
-    return False
-
-
 def createConnections(ws, modules):
+    ancestors = get_ancestors(modules)
+    if ancestors is None:
+        return None, None
     connections = []
-    ports = []
-    for i in range(ws.max_row - 1):
+    ports = set()
+    for row in get_rows(ws, 6):
         fromCircuit = ""
-        col1 = ws.cell(row=i + 2, column=1).value   # fromCircuit
+        col1 = row[0]      # fromCircuit
         if col1 is not None:
             col1 = col1.strip()
             fromCircuit = col1.strip().replace(' ', '_').replace(':', '.')
         fromPort = ""
-        col2 = ws.cell(row=i + 2, column=2).value   # fromPort
+        col2 = row[1]      # fromPort
         if col2 is not None:
             fromPort = col2.strip()
         toCircuit = ""
-        col3 = ws.cell(row=i + 2, column=3).value   # toCircuit
+        col3 = row[2]      # toCircuit
         if col3 is not None:
             col3 = col3.strip()
             toCircuit = col3.strip().replace(' ', '_').replace(':', '.')
         toPort = ""
-        col4 = ws.cell(row=i + 2, column=4).value   # toPort
+        col4 = row[3]      # toPort
         if col4 is not None:
             toPort = col4.strip()
         if fromCircuit == "" or toCircuit == "":
@@ -84,7 +85,7 @@ def createConnections(ws, modules):
             sys.stderr.write("WARNING: " + toCircuit + "is not defined in the Circuit sheet!\n")
         connectionID = fromCircuit + "-" + toCircuit
         shape = []
-        col5 = ws.cell(row=i + 2, column=5).value   # shape
+        col5 = row[4]      # shape
         if col5 is not None:
             col5 = str(col5).strip()
             shape = col5.split(",")
@@ -93,77 +94,113 @@ def createConnections(ws, modules):
                     shape[j] = math.floor(float(shape[j]))
                 except ValueError:
                     sys.stderr.write("WARNING: the shape element in " + connectionID + "is not an integer!\n")
+        dtype = None
+        col6 = row[5]      # dtype (optional)
+        if col6 is not None and str(col6).strip() != "":
+            dtype = str(col6).strip()
         connection = {"Name": connectionID, "FromModule": fromCircuit, "FromPort": fromPort,
                       "ToModule": toCircuit, "ToPort": toPort}
         connections.append(connection)
-        ports = add_ports(connection, shape, modules, ports)
+        ports = add_ports(connection, shape, modules, ports, dtype, ancestors)
     return connections, ports
 
 
-def add_ports(connection, shape, modules, ports):
+def add_ports(connection, shape, modules, ports, dtype=None, ancestors=None):
+    """
+    Add the ports of a connection to the modules.
+    Args:
+      ports: the set of (module, port name, type) of the ports already added.
+    """
+    if ancestors is None:
+        ancestors = get_ancestors(modules)
     fromModule = connection["FromModule"]
     toModule = connection["ToModule"]
-    if upper_p(fromModule, toModule, modules):
+    if upper_p(fromModule, toModule, ancestors):
         fromType = "Input"
         toType = "Input"
-    elif upper_p(toModule, fromModule, modules):
+    elif upper_p(toModule, fromModule, ancestors):
         fromType = "Output"
         toType = "Output"
     else:
         fromType = "Output"
         toType = "Input"
     fromPort = {"Name": connection["FromPort"], "Type": fromType, "Shape": shape}
-    if "Ports" in modules[fromModule]:
-        if not defined_port(fromPort, modules[fromModule]["Ports"]):
-            modules[fromModule]["Ports"].append(fromPort)
-    else:
-        modules[fromModule]["Ports"] = [fromPort]
+    if dtype is not None:
+        fromPort["DType"] = dtype
+    if (fromModule, fromPort["Name"], fromType) not in ports:
+        ports.add((fromModule, fromPort["Name"], fromType))
+        modules[fromModule].setdefault("Ports", []).append(fromPort)
     toPort = {"Name": connection["ToPort"], "Type": toType, "Shape": shape}
-    if "Ports" in modules[toModule]:
-        if not defined_port(toPort, modules[toModule]["Ports"]):
-            modules[toModule]["Ports"].append(toPort)
-    else:
-        modules[toModule]["Ports"] = [toPort]
+    if dtype is not None:
+        toPort["DType"] = dtype
+    if (toModule, toPort["Name"], toType) not in ports:
+        ports.add((toModule, toPort["Name"], toType))
+        modules[toModule].setdefault("Ports", []).append(toPort)
     return ports
 
 
-def defined_port(port_2B_checked, ports):
-    for port in ports:
-        if port_2B_checked["Name"] == port["Name"] and port_2B_checked["Type"] == port["Type"]:
-            return True
-    return False
+def iter_modules(modules):
+    """
+    Generate the modules with their ports sorted by type and name.
+    """
+    for v in modules.values():
+        module = dict(v)
+        module["Ports"] = sorted(v["Ports"], key=lambda x: (x['Type'], x['Name']))
+        yield module
+
+
+def get_document(infilePath):
+    """
+    Read a BIF workbook into a BriCA language document whose modules are generated while it is
+    written (see brical_converter.write_document).
+    Returns:
+      the document (Header, Modules, Connections), or None if the conversion failed.
+    """
+    import openpyxl
+    wb = openpyxl.load_workbook(infilePath, read_only=True)
+    try:
+        # Defining an ontology
+        project = wb['Project']
+        pname = project.cell(row=2, column=1).value
+        if not pname:
+            sys.stderr.write("ERROR: no project name\n")
+            return None
+        description = project.cell(row=2, column=3).value
+
+        modules = createModules(wb['Circuit'])
+        connections, ports = createConnections(wb['BriCA'], modules)
+    finally:
+        wb.close()
+    if connections is None:
+        return None
+
+    return {"Header": {"Type": "A", "Name": pname, "Base": pname, "Comment": description},
+            "Modules": iter_modules(modules), "Connections": connections}
+
+
+def convert(infilePath):
+    """
+    Convert a BIF workbook into a BriCA language document.
+    Returns:
+      the document (Header, Modules, Connections), or None if the conversion failed.
+    """
+    document = get_document(infilePath)
+    return None if document is None else collect_document(document)
 
 
 def main():
-    if len(sys.argv) <= 2:
-        print("USE: python bif_exel2brical.py infile bifd_url outfile")
+    args = [arg for arg in sys.argv[1:] if arg != "--compact"]
+    if len(args) < 2:
+        print("USE: python bif_exel2brical.py infile outfile [--compact]")
         exit()
 
-    outfilePath = sys.argv[2]
-    wb = openpyxl.load_workbook(sys.argv[1])
-
-    # Defining an ontology
-    project = wb['Project']
-    pname = project.cell(row=2, column=1).value
-    if not pname:
-        print("Error: no project name")
-        exit()
-    description = project.cell(row=2, column=3).value
-
-    modules = createModules(wb['Circuit'])
-    connections, ports = createConnections(wb['BriCA'], modules)
-
-    module_array = []
-    for v in modules.values():
-        v["Ports"] = sorted(v["Ports"], key=lambda x: (x['Type'], x['Name']))
-        module_array.append(v)
-
-    output = {"Header": {"Type": "A", "Name": pname, "Base": pname, "Comment": description},
-              "Modules": module_array,
-              "Connections": connections}
+    outfilePath = args[1]
+    document = get_document(args[0])
+    if document is None:
+        exit(1)
 
     fp = open(outfilePath, 'w')
-    json.dump(output, fp, indent=1)
+    write_document(fp, document, "--compact" in sys.argv)
     fp.close()
 
 
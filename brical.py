@@ -16,11 +16,69 @@ the contents of BriCA language files.
 
 import os
 import sys
-import brica1
+import copy
+import io
+import time
+import heapq
+import collections
 import json
+import hashlib
+import pickle
 
 debug = False  # True
 
+# Values allowed in the optional `DType` field of a port (NumPy type names)
+port_dtypes = ("bool", "int8", "uint8", "int16", "uint16", "int32", "uint32", "int64", "uint64",
+               "float16", "float32", "float64")
+
+# The checkpoint files of AgentBuilder.save_checkpoint (see write_checkpoint)
+checkpoint_magic = b"BRICALCK"
+checkpoint_alignment = 64
+
+
+# The classes derived from brica1 classes, defined in brical_agent
+agent_classes = ("TopologicalSyncScheduler", "EventDrivenScheduler", "VectorEnvComponent", "VectorGymAgent")
+
+
+def __getattr__(name):
+    if name in agent_classes:
+        import brical_agent
+        return getattr(brical_agent, name)
+    raise AttributeError("module 'brical' has no attribute '" + name + "'")
+
+
+class DocumentCache:
+    """
+    The parsed BriCA language files shared by NetworkBuilders, e.g. the Import files common to several projects.
+    - a file is parsed again when its modification time or size has changed.
+    - NetworkBuilder does not modify the documents it loads (it copies the ports of BriCAL version 2 to set
+      their module); the users of a cache must not modify them either.
+    """
+
+    def __init__(self):
+        self.documents = {}  # Map: absolute path ⇒ ((modification time, size), document)
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, file_object):
+        """
+        Args:
+          file_object: an open BriCA language file.
+        Returns:
+          the parsed document, read from the file only if it is not in the cache.
+        """
+        path = os.path.abspath(file_object.name)
+        stat = os.fstat(file_object.fileno())
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        cached = self.documents.get(path)
+        if cached is not None and cached[0] == stamp:
+            self.hits += 1
+            return cached[1]
+        document = json.load(file_object)
+        self.documents[path] = (stamp, document)
+        self.misses += 1
+        return document
+
 
 class NetworkBuilder:
     """
@@ -28,11 +86,11 @@ class NetworkBuilder:
     - reads BriCA language files.
     """
 
-    def __init__(self):
+    def __init__(self, document_cache=None):
         """
         NetworkBuilder Create a new `NetworkBuilder` instance.
         Args:
-          None.
+          document_cache: a `DocumentCache` the files are loaded through (default: none).
         Returns:
           NetworkBuilder: a new `NetworkBuilder` instance.
         """
@@ -45,12 +103,14 @@ class NetworkBuilder:
         self.__connections_from_to = {}
         self.__alias_in = {}
         self.__alias_out = {}
+        self.__delayed = []  # (to "module.port", from "module.port") of the connections with "Delay": 1
         self.unit_dic = {}  # Map: BriCA unit name ⇒ unit object
         self.super_module = {}  # Sub ⇒ Super modules
         self.sub_modules = {}  # Super ⇒ Sub modules
         self.module_dictionary = {}
         self.__network = {}
         self.__load_files = []
+        self.document_cache = document_cache
 
     def load_file(self, file_object):
         """
@@ -63,11 +123,24 @@ class NetworkBuilder:
         self.__load_files.append(os.path.abspath(file_object.name))
         dir_name = os.path.dirname(file_object.name)
         try:
-            jsn = json.load(file_object)
+            if self.document_cache is not None:
+                jsn = self.document_cache.load(file_object)
+            else:
+                jsn = json.load(file_object)
         except IOError:
             sys.stderr.write("ERROR: File could not be read!\n")
             return False
+        return self.load_document(jsn, dir_name)
 
+    def load_document(self, jsn, dir_name="."):
+        """
+        Load a BriCA language document already in memory (e.g. returned by a converter).
+        Args:
+          jsn: the document (the object a BriCA language json file is parsed into).
+          dir_name: the directory relative Import files are searched for in.
+        Returns:
+          success:True, failure:False
+        """
         if "Header" not in jsn:
             sys.stderr.write("ERROR: Header must be specified!\n")
             return False
@@ -126,6 +199,15 @@ class NetworkBuilder:
                 "SubModules": self.sub_modules, "Ports": self.__ports, "Connections": self.__connections,
                 "Comments": self.__comments}
 
+    def get_delayed_connections(self):
+        """
+        Args:
+        return:
+          a list of (to "module.port", from "module.port") of the connections declared with "Delay": 1,
+          i.e., carrying the value of the previous step in the topological scheduling mode.
+        """
+        return self.__delayed
+
     def upper_p(self, module1, module2):
         if module2 in self.super_module:
             upper = self.super_module[module2]
@@ -153,12 +235,6 @@ class NetworkBuilder:
           function:
           see the consistency check section below.
         """
-        for module_name in self.module_dictionary:
-            if module_name not in self.unit_dic:
-                if debug:
-                    print("Creating " + module_name + ".")
-                self.unit_dic[module_name] = brica1.Module()  # New Module instance
-
         # SuperModule consistency check
         for module, superModule in self.super_module.items():
             if superModule not in self.module_dictionary:
@@ -183,10 +259,10 @@ class NetworkBuilder:
                         + subModule + "!\n")
                     return False
 
-        # Port consistency check
+        # Port consistency check (a super module may have no ports of its own)
         for module_name in self.module_dictionary:
             ports = self.module_dictionary[module_name]["Ports"]
-            if len(ports) == 0:
+            if len(ports) == 0 and module_name not in self.sub_modules:
                 sys.stderr.write("ERROR: The specified module {0} does not have ports!\n".format(module_name))
                 return False
 
@@ -232,23 +308,15 @@ class NetworkBuilder:
                                      .format(last_port_name, module_name))
                     return False
 
-            module = self.unit_dic[module_name]
-            if v["IO"] == "Input":
-                module.make_in_port(last_port_name, length)
-                if debug:
-                    print("Creating an input port " + last_port_name + " (length " + str(
-                        length) + ") to " + module_name + ".")
-            elif v["IO"] == "Output":
-                module.make_out_port(last_port_name, length)
-                if debug:
-                    print("Creating an output port " + last_port_name + " (length " + str(
-                        length) + ") to " + module_name + ".")
-
-        # Connection consistency check
+        # Connection consistency check (on the port definitions: the units are created by check_grounding)
+        port_names = set(port.get("Name") for port in self.__ports)
+        ports = {}  # (module name, port name, IO) ⇒ port definition
+        for v in self.__ports:
+            pv = v["Name"].split(".")
+            ports[(v["Module"], pv[len(pv) - 1], v["IO"])] = v
         for k, v in self.__connections.items():
             for connection in v:
                 # Fatal if the specified ports have not been defined.
-                port_names = [port.get("Name") for port in self.__ports]
                 if not connection[0] in port_names:
                     sys.stderr.write("ERROR: The specified port {0} is not defined in connection {1}.\n"
                                      .format(connection[0], k))
@@ -267,75 +335,81 @@ class NetworkBuilder:
 
                 # else if from_unit is an upper module of to_unit
                 if self.upper_p(from_unit, to_unit):
-                    try:
-                        fr_port_obj = self.unit_dic[from_unit].get_in_port(from_port)
-                        to_port_obj = self.unit_dic[to_unit].get_in_port(to_port)
-                        if fr_port_obj.buffer.shape != to_port_obj.buffer.shape:
-                            sys.stderr.write("ERROR: Port dimension unmatched! from " + from_unit + "." + from_port + str(fr_port_obj.buffer.shape) + 
-                            " to " + to_unit + "." + to_port  + str(to_port_obj.buffer.shape) + "\n")
-                            return False
-                        # Registering a connection (alias)
-                        key = from_unit + ":" + to_unit
-                        if key not in self.__alias_in:
-                            self.__alias_in[key] = []
-                        self.__alias_in[key].append((from_port, to_port))
-                        if debug:
-                            print(
-                                "Creating a connection (alias) from " + from_port + " of " + from_unit + " to "
-                                + to_port + " of " + to_unit + ".")
-                    except KeyError:
+                    from_v = ports.get((from_unit, from_port, "Input"))
+                    to_v = ports.get((to_unit, to_port, "Input"))
+                    if from_v is None or to_v is None:
                         sys.stderr.write(
                             "ERROR: Error adding a connection from the super module port " + from_unit + "." +
                             from_port + " to " + to_unit + "." + to_port +
                             " but not from an input port to an input port!\n")
                         return False
+                    if not self.__check_port_types(from_unit + "." + from_port, from_v, to_unit + "." + to_port, to_v):
+                        return False
+                    # Registering a connection (alias)
+                    key = from_unit + ":" + to_unit
+                    if key not in self.__alias_in:
+                        self.__alias_in[key] = []
+                    self.__alias_in[key].append((from_port, to_port))
+                    if debug:
+                        print(
+                            "Creating a connection (alias) from " + from_port + " of " + from_unit + " to "
+                            + to_port + " of " + to_unit + ".")
                 # else if to_unit is an upper module of from_unit
                 elif self.upper_p(to_unit, from_unit):
-                    try:
-                        fr_port_obj = self.unit_dic[from_unit].get_out_port(from_port)
-                        to_port_obj = self.unit_dic[to_unit].get_out_port(to_port)
-                        if fr_port_obj.buffer.shape != to_port_obj.buffer.shape:
-                            sys.stderr.write("ERROR: Port dimension unmatched! from " + from_unit + "." + from_port + str(fr_port_obj.buffer.shape) + 
-                            " to " + to_unit + "." + to_port  + str(to_port_obj.buffer.shape) + "\n")
-                            return False
-                        # Registering a connection (alias)
-                        key = from_unit + ":" + to_unit
-                        if key not in self.__alias_out:
-                            self.__alias_out[key] = []
-                        self.__alias_out[key].append((from_port, to_port))
-                        if debug:
-                            print(
-                                "Creating a connection (alias) from " + from_port + " of " + from_unit + " to " +
-                                to_port + " of " + to_unit + ".\n")
-                    except KeyError:
+                    from_v = ports.get((from_unit, from_port, "Output"))
+                    to_v = ports.get((to_unit, to_port, "Output"))
+                    if from_v is None or to_v is None:
                         sys.stderr.write(
                             "ERROR: Error adding a connection from " + from_unit + "." + from_port +
                             " to its super module port " + to_unit + "." + to_port
                             + " but not from an output port to an output port!")
                         return False
+                    if not self.__check_port_types(from_unit + "." + from_port, from_v, to_unit + "." + to_port, to_v):
+                        return False
+                    # Registering a connection (alias)
+                    key = from_unit + ":" + to_unit
+                    if key not in self.__alias_out:
+                        self.__alias_out[key] = []
+                    self.__alias_out[key].append((from_port, to_port))
+                    if debug:
+                        print(
+                            "Creating a connection (alias) from " + from_port + " of " + from_unit + " to " +
+                            to_port + " of " + to_unit + ".\n")
                 # else two modules are not in inclusion relation
                 else:
-                    try:
-                        fr_port_obj = self.unit_dic[from_unit].get_out_port(from_port)
-                        to_port_obj = self.unit_dic[to_unit].get_in_port(to_port)
-                        if fr_port_obj.buffer.shape != to_port_obj.buffer.shape:
-                            sys.stderr.write("ERROR: Port dimension unmatched! from " + from_unit + "." + from_port + str(fr_port_obj.buffer.shape) + 
-                            " to " + to_unit + "." + to_port  + str(to_port_obj.buffer.shape) + "\n")
-                            return False
-                        # Registering a connection
-                        key = from_unit + ":" + to_unit
-                        if key not in self.__connections_from_to:
-                            self.__connections_from_to[key] = []
-                        self.__connections_from_to[key].append((from_port, to_port))
-                        if debug:
-                            print(
-                                "Creating a connection from " + from_port + " of " + from_unit + " to " + to_port +
-                                " of " + to_unit + ".\n")
-                    except KeyError:
+                    from_v = ports.get((from_unit, from_port, "Output"))
+                    to_v = ports.get((to_unit, to_port, "Input"))
+                    if from_v is None or to_v is None:
                         sys.stderr.write(
                             "ERROR: adding a connection from " + from_unit + " to " + to_unit +
                             " on the same level but not from an output port to an input port!\n")
                         return False
+                    if not self.__check_port_types(from_unit + "." + from_port, from_v, to_unit + "." + to_port, to_v):
+                        return False
+                    # Registering a connection
+                    key = from_unit + ":" + to_unit
+                    if key not in self.__connections_from_to:
+                        self.__connections_from_to[key] = []
+                    self.__connections_from_to[key].append((from_port, to_port))
+                    if debug:
+                        print(
+                            "Creating a connection from " + from_port + " of " + from_unit + " to " + to_port +
+                            " of " + to_unit + ".\n")
+        return True
+
+    @staticmethod
+    def __check_port_types(from_name, from_v, to_name, to_v):
+        """ true iff two port definitions have the same Shape and DType (int16 by default, as brica1) """
+        if from_v["Shape"] != to_v["Shape"]:
+            sys.stderr.write("ERROR: Port dimension unmatched! from " + from_name + "(" + str(from_v["Shape"]) +
+                             ",) to " + to_name + "(" + str(to_v["Shape"]) + ",)\n")
+            return False
+        from_dtype = from_v.get("DType", "int16")
+        to_dtype = to_v.get("DType", "int16")
+        if from_dtype != to_dtype:
+            sys.stderr.write("ERROR: Port dtype unmatched! from " + from_name + "(" + from_dtype +
+                             ") to " + to_name + "(" + to_dtype + ")\n")
+            return False
         return True
 
     def check_grounding(self):
@@ -345,6 +419,8 @@ class NetworkBuilder:
           true iff the network is grounded, i.e., every module at the bottom of the hierarchy has
           a component specification.
         """
+        import brica1
+        self.__make_units()
         return_value = True
         for module_name, v in self.module_dictionary.items():
             if module_name in self.sub_modules:
@@ -375,23 +451,25 @@ class NetworkBuilder:
         return return_value
 
     def make_ports(self):
+        self.__make_units()
         for module_name, v in self.module_dictionary.items():
             try:
                 ports = self.module_dictionary[module_name]['Ports']
-                if isinstance(ports[0], str):   # BriCAL version 1
+                if len(ports) > 0 and isinstance(ports[0], str):   # BriCAL version 1
                     for port_name in ports:
                         port_v = self.get_port(module_name, port_name)
-                        self.__make_a_port(module_name, port_v['IO'], port_name, port_v['Shape'])
+                        self.__make_a_port(module_name, port_v['IO'], port_name, port_v['Shape'], port_v.get('DType'))
                 else:   # BriCAL version 2
                     for port in ports:
                         port_v = self.get_port(module_name, port["Name"])
-                        self.__make_a_port(module_name, port_v['IO'], port["Name"], port_v['Shape'])
+                        self.__make_a_port(module_name, port_v['IO'], port["Name"], port_v['Shape'], port_v.get('DType'))
             except KeyError:
                 sys.stderr.write("ERROR: cannot create a port for Component " + module_name + "!\n")
                 return False
         return True
 
     def make_connections(self, modules):
+        import brica1
         for submodule in modules:
             self.__set_aliases(submodule)
         for key in self.__connections_from_to.keys():
@@ -423,18 +501,32 @@ class NetworkBuilder:
                 self.__get_lower_modules(submodule, lower_modules)
         return lower_modules
 
-    def __make_a_port(self, module_name, io, port_name, shape):
+    def __make_units(self):
+        """ Create a brica1.Module for every module without a unit (check_grounding replaces those at the bottom) """
+        import brica1
+        for module_name in self.module_dictionary:
+            if module_name not in self.unit_dic:
+                if debug:
+                    print("Creating " + module_name + ".")
+                self.unit_dic[module_name] = brica1.Module()  # New Module instance
+
+    def __make_a_port(self, module_name, io, port_name, shape, dtype=None):
+        import numpy
         module = self.unit_dic[module_name]
         if io == "Input":
             module.make_in_port(port_name, shape)
+            if dtype is not None:
+                module.get_in_port(port_name).buffer = numpy.zeros(shape, dtype=dtype)
             if debug:
                 print("Creating an input port " + port_name + " (length " + str(
-                    shape) + ") to " + module_name + ".")
+                    shape) + ", dtype " + str(dtype) + ") to " + module_name + ".")
         elif io == "Output":
             module.make_out_port(port_name, shape)
+            if dtype is not None:
+                module.get_out_port(port_name).buffer = numpy.zeros(shape, dtype=dtype)
             if debug:
                 print("Creating an output port " + port_name + " (length " + str(
-                    shape) + ") to " + module_name + ".")
+                    shape) + ", dtype " + str(dtype) + ") to " + module_name + ".")
 
     def __set_modules(self, jsn):
         """ Add modules from the JSON description
@@ -469,11 +561,12 @@ class NetworkBuilder:
 
         ports = []
         if "Ports" in module:
-            ports = module["Ports"]
-            for port in ports:  # BriCAL version 2
-                if isinstance(port, dict):
-                    port["Module"] = module["Name"].strip()
-                    self.__set_a_port(port)
+            for port in module["Ports"]:
+                if isinstance(port, dict):  # BriCAL version 2
+                    port = dict(port, Module=module["Name"].strip())
+                    if not self.__set_a_port(port):
+                        return False
+                ports.append(port)
 
         implclass = ""
         if "ImplClass" in module:
@@ -482,6 +575,12 @@ class NetworkBuilder:
         elif self.__type == "C":
             sys.stderr.write("ERROR: ImplClass is necessary if the type C in the module " + module_name + "!\n")
             return False
+        pure = None
+        if "Pure" in module:
+            pure = module["Pure"]
+            if not isinstance(pure, bool):
+                sys.stderr.write("ERROR: Pure of the module " + module_name + " must be true or false!\n")
+                return False
         # Multiple registration
         if defined_module:
             if implclass == "":
@@ -490,8 +589,12 @@ class NetworkBuilder:
                 if defined_module["ImplClass"] != "":
                     print("ImplClass '%s' of '%s' is replaced with '%s'." % (
                         defined_module["ImplClass"], module_name, implclass))
+            if pure is None:
+                pure = defined_module.get("Pure")
 
         self.module_dictionary[module_name] = {"Ports": ports, "ImplClass": implclass}
+        if pure is not None:
+            self.module_dictionary[module_name]["Pure"] = pure
 
         supermodule = ""
         if "SuperModule" in module:
@@ -499,13 +602,14 @@ class NetworkBuilder:
             supermodule = self.__prefix_base_name_space(supermodule)
         if supermodule != "":
             # Multiple registration
-            if module_name in self.super_module:
+            if self.super_module.get(module_name, supermodule) != supermodule:
                 print("Super module '%s' of '%s' is replaced with '%s'." % (
                     self.super_module[module_name], module_name, supermodule))
             self.super_module[module_name] = supermodule
             if supermodule not in self.sub_modules:
                 self.sub_modules[supermodule] = []
-            self.sub_modules[supermodule].append(module_name)
+            if module_name not in self.sub_modules[supermodule]:  # Also in the SubModules of the super module
+                self.sub_modules[supermodule].append(module_name)
 
         if "SubModules" in module:
             for submodule in module["SubModules"]:
@@ -590,9 +694,17 @@ class NetworkBuilder:
             if int(shape[0]) < 1:
                 sys.stderr.write("ERROR: Port dimension < 1!\n")
                 return False
-            self.__ports.append({"Name": port_name, "IO": port_type, "Module": port_module, "Shape": shape[0]})
+            port_v = {"Name": port_name, "IO": port_type, "Module": port_module, "Shape": shape[0]}
         else:
-            self.__ports.append({"Name": port_name, "IO": port_type, "Module": port_module})
+            port_v = {"Name": port_name, "IO": port_type, "Module": port_module}
+
+        if "DType" in port:
+            dtype = str(port["DType"]).strip()
+            if dtype not in port_dtypes:
+                sys.stderr.write("ERROR: Invalid port dtype {0} for the port {1}!\n".format(dtype, port_name))
+                return False
+            port_v["DType"] = dtype
+        self.__ports.append(port_v)
 
         if "Comment" in port:
             self.__comments["Ports." + port_name] = port["Comment"]
@@ -647,6 +759,13 @@ class NetworkBuilder:
             return False
         if "Comment" in connection:
             self.__comments["Connections." + connection_name] = connection["Comment"]
+        if "Delay" in connection:
+            delay = connection["Delay"]
+            if isinstance(delay, bool) or delay not in (0, 1):
+                sys.stderr.write("ERROR: Delay of connection " + connection_name + " must be 0 or 1!\n")
+                return False
+            if delay == 1:
+                self.__delayed.append((to_unit + "." + to_port, from_unit + "." + from_port))
 
         if connection_name not in self.__connections:
             self.__connections[connection_name] = []
@@ -664,8 +783,10 @@ class AgentBuilder:
         self.INCONSISTENT = 1
         self.NOT_GROUNDED = 2
         self.unit_dic = None
+        self.delayed = []  # NetworkBuilder.get_delayed_connections()
 
-    def create_agent(self, network):
+    def create_agent(self, network, profiler=None, memo=None):
+        import brica1
         for module, super_module in network.super_module.items():
             if super_module in network.module_dictionary:
                 if isinstance(network.unit_dic[module], brica1.Component):
@@ -690,9 +811,37 @@ class AgentBuilder:
                     print("Adding a module " + unit_key + " to a BriCA agent.")
         network.make_connections(sub_modules)
         self.unit_dic = network.unit_dic
+        self.delayed = network.get_delayed_connections()
+        self.__cast_results(network)
+        if memo is not None:
+            memo.attach(self.unit_dic, self.get_pure_components(network))
+        if profiler is not None:
+            profiler.attach(agent, self.unit_dic, self.get_transfers())
         return agent
 
-    def create_gym_agent(self, network, model, env):
+    def create_gym_agent(self, network, model, env, profiler=None, memo=None, zero_copy=False):
+        """
+        Args:
+          network: the NetworkBuilder.
+          model: the top module (or component) of the network.
+          env: a gymnasium environment, or a gymnasium vector environment (see VectorGymAgent).
+          profiler: a StepProfiler instrumenting the agent.
+          memo: a FireMemo memoizing the fire() of the pure components.
+          zero_copy: let the components read the "observation" in port and the environment the "action"
+                     out port of the model without copies (see bind_zero_copy).
+        return:
+          the agent, or None if the ports do not fit the spaces of the environment or a single environment
+          is given without brica1.brica_gym (reported to stderr).
+        """
+        import brica1
+        vector = getattr(env, "num_envs", None) is not None  # a gymnasium vector environment
+        if not vector:
+            try:
+                from brica1 import brica_gym  # GymAgent of a single environment, not in every brica1 release
+            except ImportError:
+                sys.stderr.write("ERROR: a single gym environment needs brica1.brica_gym, which the installed brica1 "
+                                 "does not have; pass a gymnasium vector environment (e.g. num_envs=1) instead!\n")
+                return None
         for module, super_module in network.super_module.items():
             if super_module in network.module_dictionary:
                 if isinstance(network.unit_dic[module], brica1.Component):
@@ -708,10 +857,1221 @@ class AgentBuilder:
                 sub_modules.append(unit_key)
 
         # Main logic
-        agent = brica1.brica_gym.GymAgent(model, env)
+        if vector:
+            from brical_agent import VectorGymAgent
+            self.__batch_ports(network, env.num_envs)
+            agent = VectorGymAgent(model, env)
+        else:
+            agent = brica_gym.GymAgent(model, env)
         network.make_connections(sub_modules)
         self.unit_dic = network.unit_dic
+        self.delayed = network.get_delayed_connections()
+        if zero_copy and not self.bind_zero_copy(network, model, agent, env):
+            return None
+        self.__cast_results(network)
+        if memo is not None:
+            memo.attach(self.unit_dic, self.get_pure_components(network))
+        if profiler is not None:
+            profiler.attach(agent, self.unit_dic, self.get_transfers())
         return agent
 
+    def bind_zero_copy(self, network, model, agent, env):
+        """
+        Validate the "observation" in port and the "action" out port of the model against the observation
+        and action spaces of the environment (the Shape is the size of a space and the DType its dtype),
+        and mark the in ports reading them as `zero_copy`: the inputs of their components are then the
+        buffers themselves instead of deep copies.
+        - the buffers are shared: the environment must return new observation arrays at every step
+          (e.g. a vector environment with copy=True, the default) and the components new action arrays.
+        Args:
+          network: the NetworkBuilder.
+          model: the top module (or component) of the network.
+          agent: the agent created by create_gym_agent.
+          env: the environment of the agent.
+        return:
+          True, or False if the ports do not fit the spaces (reported to stderr).
+        Raises:
+          ValueError: the model is not a unit of the network.
+        """
+        import numpy
+        model_name = next((name for name, unit in self.unit_dic.items() if unit is model), None)
+        if model_name is None:
+            raise ValueError("the model " + repr(model) + " is not a unit of the network")
+        spaces = {"observation": ("Input", getattr(env, "single_observation_space", env.observation_space)),
+                  "action": ("Output", getattr(env, "single_action_space", env.action_space))}
+        shared = set()  # Object ids of the model ports
+        for port_name, (io, space) in spaces.items():
+            port_v = network.get_port(model_name, port_name)
+            if port_v is None or port_v["IO"] != io:
+                sys.stderr.write("ERROR: " + model_name + " has no " + io + " port " + port_name + "!\n")
+                return False
+            if io == "Input":
+                port = model.get_in_port(port_name)
+            else:
+                port = model.get_out_port(port_name)
+            size = max(int(numpy.prod(space.shape)), 1)
+            dtype = numpy.dtype(port_v.get("DType", numpy.asarray(port.buffer).dtype))
+            if port_v["Shape"] != size or dtype != space.dtype:
+                sys.stderr.write("ERROR: " + model_name + "." + port_name + " (Shape " + str(port_v["Shape"])
+                                 + ", DType " + str(dtype) + ") does not fit the space " + str(space) + "!\n")
+                return False
+            shared.add(id(port))
+        for component in agent.get_all_components():
+            bound = False
+            for in_port in component.in_ports.values():
+                source = in_port.connection.from_port if hasattr(in_port, "connection") else None
+                if id(in_port) in shared or id(source) in shared:
+                    in_port.zero_copy = True
+                    bound = True
+            if bound:
+                component.input = self.__zero_copy_input(component)
+        return True
+
+    @staticmethod
+    def __zero_copy_input(component):
+        """ brica1.Component.input of a component, without the copies of the zero_copy in ports """
+        def input(time):
+            for identifier, in_port in component.in_ports.items():
+                in_port.sync()
+                in_port.invoke_callbacks()
+                if getattr(in_port, "zero_copy", False):
+                    component.inputs[identifier] = in_port.buffer
+                else:
+                    component.inputs[identifier] = copy.deepcopy(in_port.buffer)
+            assert component.last_input_time <= time, "collect_input() captured a time travel"
+            component.last_input_time = time
+
+        return input
+
     def get_modules(self):
         return self.unit_dic
+
+    def __cast_results(self, network):
+        """
+        Make the fire() of the components with out ports declaring a DType cast their results to it,
+        since brica1 replaces the buffer of an out port with the result of the component.
+        """
+        import brica1
+        dtypes = {}  # Map: module ⇒ {out port ⇒ DType}
+        for port_v in network.get_network()["Ports"]:
+            if port_v["IO"] == "Output" and "DType" in port_v:
+                module_name = port_v["Module"]
+                dtypes.setdefault(module_name, {})[port_v["Name"][len(module_name) + 1:]] = port_v["DType"]
+        for module_name, out_dtypes in dtypes.items():
+            unit = self.unit_dic.get(module_name)
+            if isinstance(unit, brica1.Component):
+                unit.fire = self.__typed_fire(unit, out_dtypes)
+
+    @staticmethod
+    def __typed_fire(component, out_dtypes):
+        """ the fire() of a component, casting its results to the DType of the out ports """
+        import numpy
+        fire = component.fire
+
+        def typed_fire():
+            fire()
+            results = component.results
+            for port_name, dtype in out_dtypes.items():
+                if port_name in results:
+                    results[port_name] = numpy.asarray(results[port_name], dtype=dtype)
+
+        return typed_fire
+
+    @staticmethod
+    def __batch_ports(network, num_envs):
+        """ Give every port of the network a buffer of num_envs rows, one for each sub-environment """
+        import numpy
+        for unit in network.unit_dic.values():
+            for ports in (unit.in_ports, unit.out_ports):
+                for port in ports.values():
+                    buffer = numpy.asarray(port.buffer)
+                    port.buffer = numpy.zeros((num_envs,) + buffer.shape, dtype=buffer.dtype)
+
+    def get_transfers(self):
+        """
+        Args:
+        return:
+          a list of (from module, from port, to module, to port) tuples, one for each connection
+          into a component after the aliases have been resolved.
+        """
+        return [edge[:4] for edge in self.__get_edges()]
+
+    def get_pure_components(self, network):
+        """
+        Args:
+          network: the NetworkBuilder.
+        return:
+          the names of the components declared pure, with "Pure": true in the BriCAL file or with
+          the `pure` decorator on their class ("Pure": false overrides the decorator).
+        """
+        import brica1
+        names = []
+        for name, unit in self.unit_dic.items():
+            if not isinstance(unit, brica1.Component):
+                continue
+            pure = network.module_dictionary.get(name, {}).get("Pure")
+            if pure is None:
+                pure = getattr(type(unit), "brical_pure", False)
+            if pure:
+                names.append(name)
+        return sorted(names)
+
+    def create_scheduler(self, agent, mode="sync", interval=1):
+        """
+        Args:
+          agent: the agent created by create_agent or create_gym_agent.
+          mode: "sync" for brica1.VirtualTimeSyncScheduler (every connection takes a step),
+                "topological" for TopologicalSyncScheduler (only the connections with "Delay": 1 take a step), or
+                "event" for EventDrivenScheduler (as "sync", propagating only the changed values).
+        return:
+          the scheduler, or None if the connections without Delay make a cycle (reported to stderr).
+        """
+        import brica1
+        from brical_agent import TopologicalSyncScheduler, EventDrivenScheduler
+        if mode == "sync":
+            return brica1.VirtualTimeSyncScheduler(agent, interval=interval)
+        if mode == "event":
+            return EventDrivenScheduler(agent, interval)
+        if mode != "topological":
+            sys.stderr.write("ERROR: unknown scheduling mode " + mode + "!\n")
+            return None
+        order = self.get_order()
+        if order is None:
+            return None
+        delayed = {}  # Component ⇒ in ports read from the previous step
+        for from_unit, from_port, to_unit, to_port, delay in self.__get_edges():
+            if delay:
+                delayed.setdefault(self.unit_dic[to_unit], []).append(to_port)
+        return TopologicalSyncScheduler(agent, [self.unit_dic[name] for name in order], delayed, interval)
+
+    def get_order(self):
+        """
+        Args:
+        return:
+          the names of the components in a topological order of the connections without Delay
+          (ties broken by name), or None if they make a cycle (reported to stderr).
+        """
+        import brica1
+        components = sorted(name for name, unit in self.unit_dic.items() if isinstance(unit, brica1.Component))
+        successors = dict((name, set()) for name in components)
+        indegree = dict((name, 0) for name in components)
+        for from_unit, from_port, to_unit, to_port, delay in self.__get_edges():
+            if delay or from_unit not in successors or to_unit in successors[from_unit]:
+                continue
+            successors[from_unit].add(to_unit)
+            indegree[to_unit] += 1
+        ready = [name for name in components if indegree[name] == 0]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            name = heapq.heappop(ready)
+            order.append(name)
+            for successor in successors[name]:
+                indegree[successor] -= 1
+                if indegree[successor] == 0:
+                    heapq.heappush(ready, successor)
+        if len(order) < len(components):
+            cyclic = [name for name in components if indegree[name] > 0]
+            sys.stderr.write("ERROR: cyclic connections without Delay among " + ", ".join(cyclic) + "!\n")
+            return None
+        return order
+
+    def get_latencies(self, mode="sync"):
+        """
+        Args:
+          mode: the scheduling mode (see create_scheduler).
+        return:
+          Map: (source component, sink component) ⇒ the number of steps for an output of the source,
+          including its own step, to reach the sink, along the fastest path.  Sources are the components
+          without incoming connections and sinks those without outgoing connections.
+        """
+        import brica1
+        components = sorted(name for name, unit in self.unit_dic.items() if isinstance(unit, brica1.Component))
+        successors = dict((name, {}) for name in components)  # Component ⇒ Map: successor ⇒ cost
+        has_input = set()
+        for from_unit, from_port, to_unit, to_port, delay in self.__get_edges():
+            if from_unit not in successors:
+                continue
+            cost = 1 if mode == "sync" or delay else 0
+            successors[from_unit][to_unit] = min(cost, successors[from_unit].get(to_unit, cost))
+            has_input.add(to_unit)
+        sinks = set(name for name in components if not successors[name])
+        latencies = {}
+        for source in components:
+            if source in has_input:
+                continue
+            # 0-1 breadth first search
+            distance = {source: 1}
+            queue = collections.deque([source])
+            while queue:
+                name = queue.popleft()
+                for successor, cost in successors[name].items():
+                    if distance[name] + cost < distance.get(successor, float("inf")):
+                        distance[successor] = distance[name] + cost
+                        if cost == 0:
+                            queue.appendleft(successor)
+                        else:
+                            queue.append(successor)
+            for sink, steps in distance.items():
+                if sink in sinks and sink != source:
+                    latencies[(source, sink)] = steps
+        return latencies
+
+    def report_latencies(self, file=sys.stdout):
+        """
+        Print the latency in steps of every path from a source to a sink component in both modes.
+        """
+        sync = self.get_latencies("sync")
+        topological = self.get_latencies("topological")
+        file.write("source\tsink\tsync\ttopological\n")
+        for source, sink in sorted(sync):
+            file.write(source + "\t" + sink + "\t" + str(sync[(source, sink)]) + "\t"
+                       + str(topological[(source, sink)]) + "\n")
+
+    def save_checkpoint(self, file, scheduler=None):
+        """
+        Write the state of the agent to a checkpoint file (see write_checkpoint): the buffers of the ports,
+        the inputs, states and results of the components, their times, the time of the scheduler and
+        the values returned by the get_checkpoint_state() of the components defining it.
+        Args:
+          file: a file name or a binary file object.
+          scheduler: the scheduler of the agent, if its time is to be saved.
+        """
+        values = {}
+        for key, (holder, name) in self.__get_checkpoint_slots(scheduler).items():
+            values[key] = holder[name] if isinstance(holder, dict) else getattr(holder, name)
+        for module_name, unit in sorted(self.unit_dic.items()):
+            if hasattr(unit, "get_checkpoint_state"):
+                for key, value in unit.get_checkpoint_state().items():
+                    values[module_name + "/custom/" + key] = value
+        write_checkpoint(file, values)
+
+    def load_checkpoint(self, file, scheduler=None):
+        """
+        Restore a checkpoint written by save_checkpoint into an agent built from the same network.
+        - the file is read at once; arrays of the same shape and dtype are copied into the existing
+          buffers in place, other values replace them.
+        - the values which are not arrays are unpickled: load only the checkpoints you trust.
+        Args:
+          file: a file name or a binary file object.
+          scheduler: the scheduler of the agent, if its time is to be restored.
+        return:
+          True if the checkpoint has been restored, False if it does not fit the agent (reported to stderr).
+        """
+        import brica1
+        import numpy
+        values = read_checkpoint(file)
+        if values is None:
+            return False
+        slots = self.__get_checkpoint_slots(scheduler)
+        targets = []
+        custom = {}  # Module name ⇒ the argument of set_checkpoint_state()
+        for key, value in values.items():
+            module_name, _, name = key.partition("/")
+            kind, _, sub_key = name.partition("/")
+            unit = self.unit_dic.get(module_name)
+            if key in slots:
+                targets.append((slots[key], value))
+            elif kind in ("inputs", "states", "results") and isinstance(unit, brica1.Component):
+                targets.append(((getattr(unit, kind), sub_key), value))
+            elif module_name == "scheduler" and scheduler is None:
+                continue
+            elif kind == "custom" and hasattr(unit, "set_checkpoint_state"):
+                custom.setdefault(module_name, {})[sub_key] = value
+            else:
+                sys.stderr.write("ERROR: " + key + " of the checkpoint is not in the agent!\n")
+                return False
+        for key, (holder, name) in slots.items():
+            if isinstance(holder, brica1.Port) and key not in values:
+                sys.stderr.write("ERROR: " + key + " of the agent is not in the checkpoint!\n")
+                return False
+        for (holder, name), value in targets:
+            current = holder.get(name) if isinstance(holder, dict) else getattr(holder, name)
+            if isinstance(value, numpy.ndarray):
+                if isinstance(current, numpy.ndarray) and current.shape == value.shape and \
+                        current.dtype == value.dtype and current.flags.writeable:
+                    numpy.copyto(current, value)
+                    continue
+                if value.ndim == 0 and not isinstance(current, numpy.ndarray):
+                    value = value.item()
+                else:
+                    value = value.copy()  # not a view of the whole file
+            if isinstance(holder, dict):
+                holder[name] = value
+            else:
+                setattr(holder, name, value)
+        for module_name, state in custom.items():
+            self.unit_dic[module_name].set_checkpoint_state(state)
+        return True
+
+    def __get_checkpoint_slots(self, scheduler):
+        """ Map: checkpoint key ⇒ (dictionary or object, key or attribute name) of every value of the agent state """
+        import brica1
+        slots = {}
+        seen = set()  # Object ids of the ports (an alias is the port of the lower module)
+        for prefer_component in (True, False):
+            for module_name, unit in sorted(self.unit_dic.items()):
+                if isinstance(unit, brica1.Component) != prefer_component:
+                    continue
+                for io, ports in (("in", unit.in_ports), ("out", unit.out_ports)):
+                    for port_name, port in sorted(ports.items()):
+                        if id(port) not in seen:
+                            seen.add(id(port))
+                            slots[module_name + "/" + io + "/" + port_name] = (port, "buffer")
+                if prefer_component:
+                    for kind in ("inputs", "states", "results"):
+                        values = getattr(unit, kind)
+                        for key in sorted(values):
+                            slots[module_name + "/" + kind + "/" + key] = (values, key)
+                    for name in ("last_input_time", "last_output_time"):
+                        slots[module_name + "/" + name] = (unit, name)
+        if scheduler is not None:
+            for name in ("current_time", "num_steps"):
+                slots["scheduler/" + name] = (scheduler, name)
+        return slots
+
+    def __get_edges(self):
+        """ (from module, from port, to module, to port, whether the connection has Delay) of get_transfers """
+        import brica1
+        owners = {}  # Port object id ⇒ (unit name, port name)
+        for prefer_component in (True, False):
+            for name, unit in self.unit_dic.items():
+                if isinstance(unit, brica1.Component) == prefer_component:
+                    for port_name, port in unit.out_ports.items():
+                        owners.setdefault(id(port), (name, port_name))
+        delayed = set()  # Object ids of the ports the delayed connections go to
+        for to_name, from_name in self.delayed:
+            module, port_name = to_name.rsplit(".", 1)
+            unit = self.unit_dic.get(module)
+            if unit is not None:
+                for ports in (unit.in_ports, unit.out_ports):
+                    if port_name in ports:
+                        delayed.add(id(ports[port_name]))
+        edges = []
+        for name, unit in self.unit_dic.items():
+            if not isinstance(unit, brica1.Component):
+                continue
+            for port_name, port in unit.in_ports.items():
+                if hasattr(port, "connection"):
+                    from_unit, from_port = owners.get(id(port.connection.from_port), ("", ""))
+                    delay = id(port) in delayed or id(port.connection.from_port) in delayed
+                    edges.append((from_unit, from_port, name, port_name, delay))
+        return edges
+
+
+def pure(klass):
+    """
+    Class decorator declaring that the results of the fire() of a component class depend only on
+    its inputs, so that a FireMemo may reuse them (same as "Pure": true in the BriCAL file).
+    """
+    klass.brical_pure = True
+    return klass
+
+
+class FireMemo:
+    """
+    A bounded LRU cache of the results of pure components.
+    - pass it to AgentBuilder.create_agent (or create_gym_agent) to wrap the fire() of the pure components:
+      the results are looked up by a hash of the input buffers and the states, and fire() is called only
+      on a miss; a hit also restores the states left by the fire() it replaces.
+    - `hits`, `misses` and `evictions` count the lookups, and `components` those of each component
+      ([hits, misses]); `size` is the number of bytes of the cached results.
+    """
+
+    def __init__(self, capacity=4096, max_bytes=64 * 1024 * 1024):
+        """
+        Args:
+          capacity: the maximum number of cached results.
+          max_bytes: the maximum number of bytes of the cached results.
+        """
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self.components = {}  # Component name ⇒ [hits, misses]
+        self.__cache = collections.OrderedDict()  # (name, digest) ⇒ (results, states, bytes)
+
+    def attach(self, unit_dic, names):
+        """
+        Memoize the fire() of components.
+        Args:
+          unit_dic: Map: BriCAL module name ⇒ unit object.
+          names: the names of the pure components.
+        """
+        for name in names:
+            self.__wrap_fire(name, unit_dic[name])
+
+    def clear(self):
+        self.__cache.clear()
+        self.size = 0
+
+    def report(self, file=sys.stdout):
+        """
+        Print the statistics of every memoized component.
+        """
+        file.write("hits: {0}, misses: {1}, evictions: {2}, entries: {3}, bytes: {4}\n".format(
+            self.hits, self.misses, self.evictions, len(self.__cache), self.size))
+        for name, (hits, misses) in sorted(self.components.items()):
+            file.write("{0}\t{1}\t{2}\n".format(name, hits, misses))
+
+    def __wrap_fire(self, name, component):
+        fire = component.fire
+        stats = self.components.setdefault(name, [0, 0])
+
+        def memoized_fire():
+            key = (name, self.__digest(component.inputs, component.states))
+            entry = self.__cache.get(key)
+            if entry is not None:
+                self.__cache.move_to_end(key)
+                self.hits += 1
+                stats[0] += 1
+                for identifier, value in entry[0].items():
+                    component.results[identifier] = copy.deepcopy(value)
+                for identifier, value in entry[1].items():
+                    component.states[identifier] = copy.deepcopy(value)
+                return
+            self.misses += 1
+            stats[1] += 1
+            fire()
+            results = copy.deepcopy(component.results)
+            states = copy.deepcopy(component.states)
+            size = sum(getattr(value, "nbytes", sys.getsizeof(value))
+                       for values in (results, states) for value in values.values())
+            if size > self.max_bytes:
+                return
+            self.__cache[key] = (results, states, size)
+            self.size += size
+            while len(self.__cache) > self.capacity or self.size > self.max_bytes:
+                evicted_key, evicted = self.__cache.popitem(last=False)
+                self.size -= evicted[2]
+                self.evictions += 1
+
+        component.fire = memoized_fire
+
+    @staticmethod
+    def __digest(inputs, states):
+        import numpy
+        digest = hashlib.blake2b(digest_size=16)
+        for values in (inputs, states):
+            for identifier in sorted(values):
+                value = values[identifier]
+                digest.update(identifier.encode("utf-8") + b"\0")
+                if isinstance(value, numpy.ndarray) and not value.dtype.hasobject:
+                    digest.update((value.dtype.str + str(value.shape)).encode("utf-8"))
+                    digest.update(numpy.ascontiguousarray(value).data)
+                else:
+                    digest.update(repr(value).encode("utf-8"))
+                digest.update(b"\0")
+            digest.update(b"\1")  # The inputs end
+        return digest.digest()
+
+
+class StepProfiler:
+    """
+    Instrumentation of BriCA agents.
+    - records the time spent in the fire() of each component, the time and bytes of each
+      port transfer and the time of each scheduler step.
+    - is enabled by passing an instance to AgentBuilder.create_agent() or create_gym_agent();
+      agents built without a profiler are not instrumented at all.
+    """
+
+    def __init__(self, trace=False):
+        """
+        Args:
+          trace: if True, keep every event for dump_trace().
+        """
+        self.components = {}  # Module name ⇒ [calls, wall time, CPU time]
+        self.connections = {}  # Connection name ⇒ [calls, wall time, bytes]
+        self.steps = [0, 0.0, 0.0, 0.0]  # [steps, wall time, CPU time, max wall time]
+        self.trace = trace
+        self.events = []
+        self.__origin = time.perf_counter()
+        self.__wrapped = set()  # Object ids of the instrumented components and ports
+
+    def attach(self, agent, unit_dic, transfers):
+        """
+        Instrument the components of an agent; a component or port reachable by several names
+        (e.g. the model of a gym agent, or an in port aliased by a super module) is instrumented once.
+        Args:
+          agent: a BriCA agent.
+          unit_dic: Map: BriCAL module name ⇒ unit object.
+          transfers: connections as returned by AgentBuilder.get_transfers().
+        """
+        import brica1
+        for name, unit in unit_dic.items():
+            if isinstance(unit, brica1.Component):
+                self.__wrap_fire(name, unit)
+        for name, unit in agent.components.items():  # e.g. the environment of a gym agent
+            self.__wrap_fire(name, unit)
+        for from_unit, from_port, to_unit, to_port in transfers:
+            port = unit_dic[to_unit].get_in_port(to_port)
+            self.__wrap_sync(from_unit + "." + from_port + " -> " + to_unit + "." + to_port, port)
+
+    def profile_scheduler(self, scheduler):
+        """
+        Record the total time of each step of a scheduler of the instrumented agent.
+        """
+        step = scheduler.step
+        stats = self.steps
+
+        def timed_step(*args, **kwargs):
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            result = step(*args, **kwargs)
+            end = time.perf_counter()
+            stats[0] += 1
+            stats[1] += end - wall
+            stats[2] += time.process_time() - cpu
+            stats[3] = max(stats[3], end - wall)
+            if self.trace:
+                self.__add_event("step " + str(stats[0]), "step", wall, end)
+            return result
+
+        scheduler.step = timed_step
+        return scheduler
+
+    def report(self, file=sys.stdout):
+        """
+        Write the statistics sorted by wall time.
+        """
+        steps, wall, cpu, max_wall = self.steps
+        if steps > 0:
+            file.write("--- Steps ---\n")
+            file.write("{0} steps, wall {1:.6f}s (mean {2:.6f}s, max {3:.6f}s), cpu {4:.6f}s\n"
+                       .format(steps, wall, wall / steps, max_wall, cpu))
+        file.write("--- Components ---\n")
+        file.write("{0:>12} {1:>12} {2:>8}  {3}\n".format("wall [s]", "cpu [s]", "calls", "module"))
+        for name, v in sorted(self.components.items(), key=lambda item: -item[1][1]):
+            file.write("{0:12.6f} {1:12.6f} {2:8d}  {3}\n".format(v[1], v[2], v[0], name))
+        file.write("--- Connections ---\n")
+        file.write("{0:>12} {1:>12} {2:>8}  {3}\n".format("wall [s]", "bytes", "calls", "connection"))
+        for name, v in sorted(self.connections.items(), key=lambda item: -item[1][1]):
+            file.write("{0:12.6f} {1:12d} {2:8d}  {3}\n".format(v[1], v[2], v[0], name))
+
+    def dump_trace(self, file_object):
+        """
+        Write the recorded events in the Chrome trace event format (chrome://tracing).
+        """
+        if not self.trace:
+            sys.stderr.write("Warning: the profiler was created without trace=True.\n")
+        json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, file_object)
+
+    def __wrap_fire(self, name, component):
+        if id(component) in self.__wrapped:
+            return
+        self.__wrapped.add(id(component))
+        fire = component.fire
+        stats = self.components.setdefault(name, [0, 0.0, 0.0])
+
+        def timed_fire():
+            wall = time.perf_counter()
+            cpu = time.thread_time()
+            fire()
+            end = time.perf_counter()
+            stats[0] += 1
+            stats[1] += end - wall
+            stats[2] += time.thread_time() - cpu
+            if self.trace:
+                self.__add_event(name, "fire", wall, end)
+
+        component.fire = timed_fire
+
+    def __wrap_sync(self, name, port):
+        if id(port) in self.__wrapped:
+            return
+        self.__wrapped.add(id(port))
+        sync = port.sync
+        stats = self.connections.setdefault(name, [0, 0.0, 0])
+
+        def timed_sync():
+            wall = time.perf_counter()
+            sync()
+            end = time.perf_counter()
+            stats[0] += 1
+            stats[1] += end - wall
+            stats[2] += getattr(port.buffer, "nbytes", 0)
+            if self.trace:
+                self.__add_event(name, "transfer", wall, end)
+
+        port.sync = timed_sync
+
+    def __add_event(self, name, category, start, end):
+        self.events.append({"name": name, "cat": category, "ph": "X", "pid": 0, "tid": category,
+                            "ts": (start - self.__origin) * 1e6, "dur": (end - start) * 1e6})
+
+
+class PortRecorder:
+    """
+    Records the buffers of ports at every step into a ring of fixed-size records in a file
+    mapped with numpy.memmap, to be inspected offline with PortRecorder.load().
+    - a record has a "step" field and one field per recorded port, with the Shape and DType
+      of the port in the NetworkBuilder registry, so recording a step copies each buffer once.
+    - the file keeps the last `capacity` steps; its layout and the number of recorded steps are
+      written to a JSON sidecar (path + ".json") by flush() and close().
+    - the ports are looked up by name at every record(), as AgentBuilder.create_agent replaces the in ports
+      of the sub-modules with those of their super modules: a recorder may be made before or after the agent.
+    """
+
+    def __init__(self, network_builder, ports, path, capacity=100000):
+        """
+        Args:
+          network_builder: a NetworkBuilder whose ports have been made (make_ports).
+          ports: the names of the ports to record ("<module name>.<port name>").
+          path: the file of the records (overwritten).
+          capacity: the number of the records of the ring.
+        """
+        import numpy
+        self.path = path
+        self.capacity = capacity
+        self.count = 0
+        self.__fields = []  # (field name, port dictionary of the unit, port name)
+        self.__layout = []
+        fields = [("step", "<i8")]
+        for name in ports:
+            module_name, _, port_name = name.rpartition(".")
+            port_v = network_builder.get_port(module_name, port_name)
+            if port_v is None:
+                raise ValueError("unknown port " + name)
+            unit = network_builder.unit_dic[module_name]
+            unit_ports = unit.in_ports if port_v["IO"] == "Input" else unit.out_ports
+            dtype = numpy.dtype(port_v.get("DType", numpy.asarray(unit_ports[port_name].buffer).dtype))
+            shape = (port_v["Shape"],)
+            fields.append((name, dtype, shape))
+            self.__fields.append((name, unit_ports, port_name))
+            self.__layout.append({"Name": name, "DType": dtype.str, "Shape": list(shape)})
+        self.dtype = numpy.dtype(fields)
+        self.__records = numpy.memmap(path, dtype=self.dtype, mode="w+", shape=(capacity,))
+        self.__views = [(self.__records[name], unit_ports, port_name)
+                        for name, unit_ports, port_name in self.__fields]
+        self.__steps = self.__records["step"]
+        self.flush()
+
+    def record(self):
+        """
+        Copy the current buffers of the ports into the next record of the ring.
+        """
+        slot = self.count % self.capacity
+        self.__steps[slot] = self.count
+        for view, unit_ports, port_name in self.__views:
+            view[slot] = unit_ports[port_name].buffer
+        self.count += 1
+
+    def record_scheduler(self, scheduler):
+        """
+        Record the ports after every step of a scheduler.
+        """
+        step = scheduler.step
+
+        def recorded_step(*args, **kwargs):
+            result = step(*args, **kwargs)
+            self.record()
+            return result
+
+        scheduler.step = recorded_step
+        return scheduler
+
+    def flush(self):
+        """
+        Write the records and the sidecar to the files.
+        """
+        self.__records.flush()
+        with open(self.path + ".json", "w") as fp:
+            json.dump({"Ports": self.__layout, "Capacity": self.capacity, "Count": self.count}, fp, indent=1)
+
+    def close(self):
+        self.flush()
+        del self.__views, self.__steps, self.__records
+
+    @staticmethod
+    def load(path):
+        """
+        Read the records of a PortRecorder file.
+        Returns:
+          a structured array of the recorded steps in order, e.g. records["Module.Port"][i]
+          is the buffer of the port at the step records["step"][i].
+        """
+        import numpy
+        with open(path + ".json") as fp:
+            layout = json.load(fp)
+        dtype = numpy.dtype([("step", "<i8")] + [(port["Name"], port["DType"], tuple(port["Shape"]))
+                                                for port in layout["Ports"]])
+        capacity = layout["Capacity"]
+        count = layout["Count"]
+        records = numpy.memmap(path, dtype=dtype, mode="r", shape=(capacity,))
+        if count <= capacity:
+            return numpy.array(records[:count])
+        start = count % capacity
+        return numpy.concatenate((records[start:], records[:start]))
+
+
+class AsyncGymDriver:
+    """
+    Runs several gym agents built from one network, each with its own environment, with asyncio.
+    - every scheduler step of an agent, i.e. the fire() of its components and the step of its environment
+      one after the other, is run in a thread pool: the steps of different agents overlap when they release
+      the GIL (simulators, renderers, remote environments); pure Python computations do not.  The environment
+      of an agent is not stepped apart from the components of the agent.
+    - `steps`, `episodes` and `time` are those of the last run(): steps / time is the throughput
+      in environment steps per second; `agent_steps` and `agent_episodes` are those of each agent.
+      A scheduler step of a vector environment is `num_envs` environment steps, and its episodes are those
+      finished by its sub-environments (VectorEnvComponent.episodes); the episodes of a single environment
+      are those of the loop, ended when the environment is done or after `max_steps` steps.
+    - a single environment needs brica1.brica_gym (see AgentBuilder.create_gym_agent).
+    """
+
+    def __init__(self, network, model_name, envs, mode="sync", workers=None):
+        """
+        Args:
+          network: a consistent and grounded NetworkBuilder whose ports have been made (make_ports),
+                   copied for every environment.
+          model_name: the name of the top module given to create_gym_agent as the model.
+          envs: the environments, one for each agent.
+          mode: the scheduling mode of AgentBuilder.create_scheduler.
+          workers: the number of threads (default: the number of environments).
+        """
+        import brica1
+        self.agents = []
+        self.steps = 0
+        self.episodes = 0
+        self.agent_steps = [0] * len(envs)
+        self.agent_episodes = [0] * len(envs)
+        self.time = 0.0
+        self.workers = workers or len(envs)
+        for env in envs:
+            network_copy = copy.deepcopy(network)
+            agent_builder = AgentBuilder()
+            agent = agent_builder.create_gym_agent(network_copy, network_copy.unit_dic[model_name], env)
+            if agent is None:
+                raise ValueError("cannot create a gym agent for the environment " + str(env))
+            scheduler = agent_builder.create_scheduler(agent, mode)
+            if scheduler is None:
+                raise ValueError("cannot create a scheduler of the mode " + mode)
+            components = [unit for unit in agent_builder.get_modules().values() if isinstance(unit, brica1.Component)]
+            self.agents.append((agent, scheduler, components))
+
+    def run(self, episode_count=1, max_steps=30):
+        """
+        Run the episodes of every agent (see run_async).
+        Returns:
+          the number of environment steps per second.
+        """
+        import asyncio
+        return asyncio.run(self.run_async(episode_count, max_steps))
+
+    async def run_async(self, episode_count=1, max_steps=30):
+        """
+        Run `episode_count` episodes of at most `max_steps` steps on every agent; an episode ends
+        when the environment is done, as in the loop generated by brical2py.py.
+        Returns:
+          the number of environment steps per second.
+        """
+        import asyncio
+        import concurrent.futures
+        loop = asyncio.get_running_loop()
+        self.steps = 0
+        self.episodes = 0
+        self.agent_steps = [0] * len(self.agents)
+        self.agent_episodes = [0] * len(self.agents)
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            await asyncio.gather(*[self.__run_agent(loop, executor, k, agent, scheduler, components,
+                                                    episode_count, max_steps)
+                                   for k, (agent, scheduler, components) in enumerate(self.agents)])
+        self.time = time.perf_counter() - start
+        return self.steps / self.time if self.time > 0 else 0.0
+
+    async def __run_agent(self, loop, executor, k, agent, scheduler, components, episode_count, max_steps):
+        from brical_agent import VectorEnvComponent
+        vector = isinstance(agent.env, VectorEnvComponent)
+        num_envs = getattr(agent.env, "num_envs", 1)  # Environment steps of a scheduler step
+        for i in range(episode_count):
+            finished = agent.env.episodes if vector else 0
+            for j in range(max_steps):
+                await loop.run_in_executor(executor, scheduler.step)
+                self.steps += num_envs
+                self.agent_steps[k] += num_envs
+                if agent.env.done:
+                    break
+            episodes = agent.env.episodes - finished if vector else 1
+            agent.env.flush = True
+            for component in components:
+                component.reset()
+            await loop.run_in_executor(executor, agent.env.reset)
+            agent.env.done = False
+            self.episodes += episodes
+            self.agent_episodes[k] += episodes
+
+
+def write_checkpoint(file, values):
+    """
+    Write named values to a checkpoint file.
+    - the file has the magic, the length (8 bytes, little endian) of a JSON header with the key, dtype,
+      shape and offset of every array, and the arrays aligned to 64 bytes, so that it can be restored
+      with one read (read_checkpoint) or inspected with numpy.memmap.
+    - the other values than the arrays of numbers and the numbers are pickled after the arrays.
+    Args:
+      file: a file name or a binary file object.
+      values: Map: key ⇒ value.
+    """
+    import numpy
+    arrays = []
+    objects = {}
+    for key, value in values.items():
+        if isinstance(value, (int, float, numpy.generic)):
+            value = numpy.asarray(value)
+        if isinstance(value, numpy.ndarray) and not value.dtype.hasobject:
+            arrays.append((key, value))
+        else:
+            objects[key] = value
+    pickled = pickle.dumps(objects, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def align(offset):
+        return -(-offset // checkpoint_alignment) * checkpoint_alignment
+
+    # The offsets depend on the length of the header: lay it out until the arrays start after it.
+    data_start = 0
+    while True:
+        offset = data_start
+        entries = []
+        for key, array in arrays:
+            entries.append([key, array.dtype.str, list(array.shape), offset])
+            offset = align(offset + array.nbytes)
+        header = json.dumps({"Arrays": entries, "Objects": [offset, len(pickled)]}).encode("utf-8")
+        if align(len(checkpoint_magic) + 8 + len(header)) <= data_start:
+            break
+        data_start = align(len(checkpoint_magic) + 8 + len(header))
+    header += b" " * (data_start - len(checkpoint_magic) - 8 - len(header))
+
+    fp = open(file, "wb") if isinstance(file, str) else file
+    try:
+        fp.write(checkpoint_magic + len(header).to_bytes(8, "little") + header)
+        for key, array in arrays:
+            fp.write(numpy.ascontiguousarray(array).reshape(-1).view(numpy.uint8).data)
+            fp.write(b"\0" * (align(array.nbytes) - array.nbytes))
+        fp.write(pickled)
+    finally:
+        if fp is not file:
+            fp.close()
+
+
+def read_checkpoint(file):
+    """
+    Read a file written by write_checkpoint at once.
+    Args:
+      file: a file name or a binary file object.
+    Returns:
+      Map: key ⇒ value (the arrays are views of the read data), or None if the file is not a checkpoint
+      (reported to stderr).
+    """
+    import numpy
+    if isinstance(file, str):
+        with open(file, "rb") as fp:
+            data = bytearray(os.fstat(fp.fileno()).st_size)
+            fp.readinto(data)
+    else:
+        data = bytearray(file.read())
+    start = len(checkpoint_magic) + 8
+    if data[:len(checkpoint_magic)] != checkpoint_magic:
+        sys.stderr.write("ERROR: not a checkpoint file!\n")
+        return None
+    header = json.loads(bytes(data[start:start + int.from_bytes(data[len(checkpoint_magic):start], "little")]))
+    values = {}
+    for key, dtype, shape, offset in header["Arrays"]:
+        dtype = numpy.dtype(dtype)
+        count = 1
+        for length in shape:
+            count *= length
+        values[key] = numpy.frombuffer(data, dtype, count, offset).reshape(tuple(shape))
+    offset, length = header["Objects"]
+    values.update(pickle.loads(bytes(data[offset:offset + length])))
+    return values
+
+
+def build_agent(document, impl_class=None, dir_name="."):
+    """
+    Build a runnable BriCA agent from a BriCA language document (e.g. returned by a converter)
+    without writing it to a file.
+    Args:
+      document: the BriCA language document.
+      impl_class: the ImplClass given to the modules at the bottom without one (e.g. brica1.NullComponent).
+      dir_name: the directory relative Import files are searched for in.
+    Returns:
+      (NetworkBuilder, AgentBuilder, agent), or None if the network cannot be built (reported to stderr).
+    """
+    network_builder = NetworkBuilder()
+    if not network_builder.load_document(document, dir_name):
+        return None
+    if impl_class is not None:
+        for module_name, v in network_builder.module_dictionary.items():
+            if module_name not in network_builder.sub_modules and v["ImplClass"] == "":
+                v["ImplClass"] = impl_class
+    if not network_builder.check_consistency():
+        sys.stderr.write("ERROR: the network is not consistent!\n")
+        return None
+    if not network_builder.check_grounding():
+        sys.stderr.write("ERROR: the network is not grounded!\n")
+        return None
+    for module_name, v in network_builder.module_dictionary.items():
+        if v["ImplClass"] != "":
+            network_builder.unit_dic[module_name].__init__()
+    if not network_builder.make_ports():
+        return None
+    agent_builder = AgentBuilder()
+    agent = agent_builder.create_agent(network_builder)
+    return network_builder, agent_builder, agent
+
+
+def convert(source, args):
+    """
+    Run a converter in-process.
+    Args:
+      source: "excel" (bif_excel2brical), "bif" (bif2brical), "table" (Table2BriCAL) or "json".
+      args: the parsed command line arguments of the source.
+    Returns:
+      the BriCA language document, or None if the conversion failed.
+    """
+    if source == "json":
+        with open(args.infile) as fp:
+            return json.load(fp)
+    if source == "excel":
+        from bif_excel2brical import bif_excel2brical
+        return bif_excel2brical.convert(args.infile)
+    if source == "bif":
+        from bif2brical import bif2brical
+        return bif2brical.convert(args.input, args.bifd, args.external_ontologies, args.dtype,
+                                  None if args.no_cache else args.cache_dir)
+    if source == "table":
+        from Table2BriCAL import table2brical
+        return table2brical.convert(args.connection, args.regions, args.hierarchy, args.prefix, args.threshold,
+                                    name=args.prefix, dtype=args.dtype, cache=not args.no_cache,
+                                    edge_list=args.edge_list, depth=args.depth, aggregate=args.aggregate)
+    return None
+
+
+# The DocumentCache of a validation worker process (see validate_project)
+worker_document_cache = None
+
+
+def list_project_files(path):
+    """
+    The BriCA language files of a project: the file itself, or the .json files of a project directory in name order
+    except the Import files (whose name starts with "I", loaded by the files importing them) and expected.json
+    (the expected values of testall.py), as test.py loads a test case.
+    """
+    if not os.path.isdir(path):
+        return [path]
+    files = []
+    for file in sorted(os.listdir(path)):
+        if file[0] == "I" or file == "expected.json" or not file.endswith(".json"):
+            continue
+        file = os.path.join(path, file)
+        if os.path.isfile(file):
+            files.append(file)
+    return files
+
+
+def load_project(network_builder, files, impl_class=None):
+    """
+    Load the files of a project.
+    Args:
+      network_builder: the NetworkBuilder.
+      files: the BriCA language files (see list_project_files).
+      impl_class: the ImplClass given to the modules at the bottom without one.
+    Returns:
+      success:True, failure:False
+    """
+    if len(files) == 0:
+        sys.stderr.write("ERROR: No BriCA language file in the project!\n")
+        return False
+    for file in files:
+        with open(file) as fp:
+            if not network_builder.load_file(fp):
+                return False
+    if impl_class is not None:
+        for module_name, v in network_builder.module_dictionary.items():
+            if module_name not in network_builder.sub_modules and v["ImplClass"] == "":
+                v["ImplClass"] = impl_class
+    return True
+
+
+def validate_project(path, impl_class=None):
+    """
+    Load a project and check its consistency and grounding, in a worker process of `validate`.
+    The parsed files are kept in the DocumentCache of the process, so the Import files shared by the projects
+    are parsed once per process.
+    Args:
+      path: a project directory or a BriCA language file.
+      impl_class: the ImplClass given to the modules at the bottom without one.
+    Returns:
+      a result dictionary of the report: the status ("passed", "failed" at a stage or "error"), the time of
+      each stage, the Import files reused from the cache and the lines written to stderr and stdout.
+    """
+    global worker_document_cache
+    if worker_document_cache is None:
+        worker_document_cache = DocumentCache()
+    cache = worker_document_cache
+    hits = cache.hits
+    result = {"path": path, "files": list_project_files(path), "stages": {}}
+    stderr, stdout = sys.stderr, sys.stdout
+    sys.stderr, sys.stdout = io.StringIO(), io.StringIO()
+    start = time.perf_counter()
+    try:
+        network_builder = NetworkBuilder(cache)
+        result["status"] = "passed"
+        for stage in ("load", "consistency", "grounding"):
+            stage_start = time.perf_counter()
+            if stage == "load":
+                success = load_project(network_builder, result["files"], impl_class)
+            elif stage == "consistency":
+                success = network_builder.check_consistency()
+            else:
+                success = network_builder.check_grounding()
+            result["stages"][stage] = time.perf_counter() - stage_start
+            if not success:
+                result["status"] = "failed"
+                result["stage"] = stage
+                break
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = "{0}: {1}".format(type(e).__name__, e)
+    finally:
+        result["diagnostics"] = sys.stderr.getvalue().splitlines()
+        result["messages"] = [line for line in sys.stdout.getvalue().splitlines() if line != ""]
+        sys.stderr, sys.stdout = stderr, stdout
+    result["time"] = time.perf_counter() - start
+    result["imports_reused"] = cache.hits - hits
+    return result
+
+
+def validate(paths, impl_class=None, jobs=None):
+    """
+    Validate many projects concurrently in a process pool (see validate_project).
+    Args:
+      paths: project directories or BriCA language files.
+      impl_class: the ImplClass given to the modules at the bottom without one.
+      jobs: the number of worker processes (default: the number of CPUs).
+    Returns:
+      the report: {"projects": [the results in the order of the paths], "passed": n, "failed": n, "error": n,
+      "time": seconds}.
+    """
+    import concurrent.futures
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(validate_project, paths, [impl_class] * len(paths)))
+    report = {"projects": results}
+    for status in ("passed", "failed", "error"):
+        report[status] = len([result for result in results if result["status"] == status])
+    report["time"] = time.perf_counter() - start
+    return report
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="BriCA language interpreter.")
+    commands = parser.add_subparsers(dest="command")
+    build = commands.add_parser("build", help="convert a BIF workbook, BIFD ontology or connectome tables "
+                                              "into a network and run it")
+    sources = build.add_subparsers(dest="source")
+    excel = sources.add_parser("excel", help="a BIF workbook (bif_excel2brical)")
+    excel.add_argument("infile", help="the BIF Excel file")
+    bif = sources.add_parser("bif", help="a BIFD ontology (bif2brical)")
+    bif.add_argument("--input", required=True, help="the ontology file")
+    bif.add_argument("--bifd", required=True, help="bifd.owl")
+    bif.add_argument("--external_ontologies", nargs='*', help="the external ontology files")
+    bif.add_argument("--cache_dir", help="the directory of the parsed ontology cache")
+    bif.add_argument("--no_cache", action="store_true", help="parse the ontologies without the cache")
+    table = sources.add_parser("table", help="connectome tables (Table2BriCAL)")
+    table.add_argument("connection", help="connection table (region x region) or edge list (with --edge-list)")
+    table.add_argument("regions", help="region table")
+    table.add_argument("hierarchy", help="inclusion table")
+    table.add_argument("prefix", help="base name space")
+    table.add_argument("threshold", type=float, help="minimum connection score")
+    table.add_argument("--no-cache", action="store_true", help="neither read nor write connection.txt.npy")
+    table.add_argument("--edge-list", action="store_true", help="the connection file is an edge list")
+    table.add_argument("--depth", type=int, help="coarsen the network to the regions at this hierarchy depth")
+    table.add_argument("--aggregate", choices=["sum", "max"], default="sum",
+                       help="aggregation of the scores when coarsening (default: sum)")
+    jsn = sources.add_parser("json", help="a BriCA language file")
+    jsn.add_argument("infile", help="the BriCA language file")
+    for source in (bif, table):
+        source.add_argument("--dtype", help="DType of the generated ports (e.g. float32)")
+    for source in (excel, bif, table, jsn):
+        source.add_argument("--impl_class", help="ImplClass of the modules at the bottom without one "
+                                                 "(e.g. brica1.NullComponent)")
+        source.add_argument("--steps", type=int, default=0, help="scheduler steps to run (default: 0)")
+        source.add_argument("--output", help="also write the BriCA language document to this file")
+        source.add_argument("--record", help="record the ports at every step into this file (PortRecorder)")
+        source.add_argument("--record_ports", nargs="+", help="the recorded ports (\"<module>.<port>\", "
+                                                              "default: the output ports of the components)")
+        source.add_argument("--record_capacity", type=int, default=100000,
+                            help="the number of the recorded steps kept (default: 100000)")
+    validation = commands.add_parser("validate", help="check the consistency and grounding of many projects "
+                                                       "in parallel")
+    validation.add_argument("projects", nargs="+", help="project directories or BriCA language files")
+    validation.add_argument("--jobs", type=int, help="worker processes (default: CPU count)")
+    validation.add_argument("--output", help="write the report (JSON) to this file instead of stdout")
+    validation.add_argument("--impl_class", help="ImplClass of the modules at the bottom without one "
+                                                 "(e.g. brica1.NullComponent)")
+    args = parser.parse_args()
+    if args.command == "validate":
+        report = validate(args.projects, args.impl_class, args.jobs)
+        for result in report["projects"]:
+            status = result["status"]
+            if status == "failed":
+                status += " at " + result["stage"]
+            sys.stderr.write("{0}: {1} ({2:.3f}s)\n".format(result["path"], status, result["time"]))
+        if args.output:
+            with open(args.output, "w") as fp:
+                json.dump(report, fp, indent=1)
+        else:
+            json.dump(report, sys.stdout, indent=1)
+            sys.stdout.write("\n")
+        exit(1 if report["failed"] or report["error"] else 0)
+    if args.command != "build" or args.source is None:
+        parser.print_help()
+        exit(1)
+
+    start = time.perf_counter()
+    document = convert(args.source, args)
+    if document is None:
+        exit(1)
+    if args.output:
+        from brical_converter import write_document
+        with open(args.output, "w") as fp:
+            write_document(fp, document)
+    dir_name = os.path.dirname(args.infile) if args.source == "json" else "."
+    built = build_agent(document, args.impl_class, dir_name)
+    if built is None:
+        exit(1)
+    network_builder, agent_builder, agent = built
+    build_time = time.perf_counter() - start
+
+    import brica1
+    scheduler = brica1.VirtualTimeSyncScheduler(agent)
+    recorder = None
+    if args.record:
+        ports = args.record_ports
+        if ports is None:
+            ports = [port["Name"] for port in network_builder.get_network()["Ports"]
+                     if port["IO"] == "Output" and network_builder.module_dictionary[port["Module"]]["ImplClass"] != ""]
+        try:
+            recorder = PortRecorder(network_builder, ports, args.record, args.record_capacity)
+        except ValueError as e:
+            sys.stderr.write("ERROR: " + str(e) + "!\n")
+            exit(1)
+        recorder.record_scheduler(scheduler)
+    start = time.perf_counter()
+    for i in range(args.steps):
+        scheduler.step()
+    if recorder is not None:
+        recorder.close()
+    network = network_builder.get_network()
+    print("{0} modules, {1} connections; built in {2:.3f}s, {3} steps in {4:.3f}s".format(
+        len(network["ModuleDictionary"]), len(network["Connections"]), build_time, args.steps,
+        time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,14 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import argparse
 import brical
 
 import_modules = [
     'import gymnasium',
     'import numpy as np',
     'import sys',
+    'import time',
     'import argparse',
     'import json',
     'import brica1.brica_gym',
@@ -26,6 +28,9 @@ main_code1 = [
     '                        help=\'Model configuration (default: $PROJECT_NAME$.json\')',
     '    parser.add_argument(\'--brical\', type=str, default=\'$PROJECT_NAME$.brical.json\', metavar=\'N\',',
     '                        help=\'a BriCAL json file\')',
+    '    parser.add_argument(\'--stats\', action=\'store_true\', help=\'print step time statistics\')',
+    '    parser.add_argument(\'--envs\', type=int, default=1, metavar=\'N\',',
+    '                        help=\'Number of environments run concurrently by brical.AsyncGymDriver (default: 1)\')',
     '    args = parser.parse_args()',
     '',
     '    with open(args.config) as config_file:',
@@ -52,28 +57,58 @@ main_code1 = [
 main_code2 = [
     '    nb.make_ports()',
     '',
+    '    if args.envs > 1:',
+    '        envs = [env] + [gymnasium.make(config[\'env\'][\'name\'], config=config[\'env\'])',
+    '                        for k in range(args.envs - 1)]',
+    '        driver = brical.AsyncGymDriver(nb, \'$TOP_MODULE$\', envs)',
+    '        driver.run(train["episode_count"], train["max_steps"])',
+    '        print("{0} environments: {1} steps in {2:.3f}s, {3:.1f} steps/s".format(',
+    '            len(envs), driver.steps, driver.time, driver.steps / driver.time))',
+    '        for env in envs:',
+    '            env.close()',
+    '        return',
+    '',
     '    agent_builder = brical.AgentBuilder()',
     '    model = nb.unit_dic[\'$TOP_MODULE$\']',
     '    agent = agent_builder.create_gym_agent(nb, model, env)',
     '    scheduler = brica1.VirtualTimeSyncScheduler(agent)',
     '',
+    '    # Resolve the objects used in the loop once',
+    '    step = scheduler.step',
+    '    token_out = agent.get_out_port(\'token_out\')',
+    '    components = [$COMPONENTS$]',
+    '    step_times = []',
+    '',
     '    for i in range(train["episode_count"]):',
     '        last_token = 0',
     '        for j in range(train["max_steps"]):',
-    '            scheduler.step()',
-    '            current_token = agent.get_out_port(\'token_out\').buffer[0]',
+    '            if args.stats:',
+    '                start = time.perf_counter()',
+    '                step()',
+    '                step_times.append(time.perf_counter() - start)',
+    '            else:',
+    '                step()',
+    '            current_token = token_out.buffer[0]',
     '            if last_token + 1 == current_token:',
     '                last_token = current_token',
     '                # TODO: WRITE END OF ENV CYCLE CODE HERE!!',
     '            if agent.env.done:',
     '                break',
-    '        agent.env.flush = True'
+    '        agent.env.flush = True',
+    '        for component in components:',
+    '            component.reset()'
 ]
 
 main_code3 = [
     '        # TODO: WRITE END OF EPISODE CODE (component reset etc.) HERE!!',
     '        agent.env.reset()',
     '        agent.env.done = False',
+    '',
+    '    if args.stats and step_times:',
+    '        step_times = np.array(step_times)',
+    '        print("steps: {0}, mean: {1:.6f}s, median: {2:.6f}s, max: {3:.6f}s, {4:.1f} steps/s".format(',
+    '            len(step_times), step_times.mean(), np.median(step_times), step_times.max(),',
+    '            len(step_times) / step_times.sum()))',
     ''
 ]
 
@@ -108,13 +143,129 @@ def write_classes(name, ports, comment, wf):
         wf.write('\n')
 
 
-def main():
-    if len(sys.argv) <= 2:
-        print("USE: python brical2py.py infile outfile")
-        exit()
+def compile_network(nb, agent_builder, agent, wf):
+    """
+    Write a Python module whose bind(units) returns a straight-line step() for the network:
+    the resolved port transfers, the input copies, the fire() calls and the outputs of every
+    component, in the order of brica1.VirtualTimeSyncScheduler.step(), on pre-bound objects.
+    Args:
+      nb: a NetworkBuilder of a consistent and grounded network.
+      agent_builder: the AgentBuilder the agent was created with.
+      agent: the agent.
+      wf: a file object to write to.
+    """
+    import brica1
+    units = agent_builder.get_modules()
+    names = {}  # Component object id ⇒ unit name
+    for name, unit in units.items():
+        if isinstance(unit, brica1.Component):
+            names.setdefault(id(unit), name)
+    components = sorted(names[id(component)] for component in agent.get_all_components())
+    sources = {}  # (to unit, to port) ⇒ (from unit, from port)
+    for from_unit, from_port, to_unit, to_port in agent_builder.get_transfers():
+        sources[(to_unit, to_port)] = (from_unit, from_port)
+
+    bind_lines = []
+    transfer_lines = []
+    input_lines = []
+    fire_lines = []
+    output_lines = []
+    for i, name in enumerate(components):
+        unit = units[name]
+        c = 'c' + str(i)
+        bind_lines.append('    ' + c + ' = units[' + repr(name) + ']')
+        for j, port_name in enumerate(sorted(unit.in_ports)):
+            port = c + '_i' + str(j)
+            bind_lines.append('    ' + port + ' = ' + c + '.get_in_port(' + repr(port_name) + ')')
+            if (name, port_name) in sources:
+                from_unit, from_port = sources[(name, port_name)]
+                if from_unit != '':
+                    bind_lines.append('    ' + port + '_from = units[' + repr(from_unit) + '].get_out_port('
+                                      + repr(from_port) + ')')
+                else:
+                    bind_lines.append('    ' + port + '_from = ' + port + '.connection.from_port')
+                transfer_lines.append('        ' + port + '.buffer = ' + port + '_from.buffer')
+            input_lines.append('        ' + c + '.inputs[' + repr(port_name) + '] = ' + port + '.buffer.copy()')
+        if type(unit).train is not brica1.Component.train:
+            fire_lines.append('        ' + c + '.train()')
+        fire_lines.append('        ' + c + '.fire()')
+        if unit.out_ports:
+            output_lines.append('        results = ' + c + '.results')
+        for j, port_name in enumerate(sorted(unit.out_ports)):
+            port = c + '_o' + str(j)
+            bind_lines.append('    ' + port + ' = ' + c + '.get_out_port(' + repr(port_name) + ')')
+            output_lines.append('        if ' + repr(port_name) + ' in results:')
+            output_lines.append('            ' + port + '.buffer = results[' + repr(port_name) + ']')
+
+    wf.write('# -*- coding: utf-8 -*-\n')
+    wf.write('# Header.' + nb.base_name_space + ': compiled by brical2py.py --compile\n')
+    wf.write('# ' + str(len(components)) + ' components, ' + str(len(transfer_lines)) + ' transfers\n')
+    wf.write('\n\n')
+    wf.write('def bind(units):\n')
+    wf.write('    """\n')
+    wf.write('    Args:\n')
+    wf.write('      units: Map: unit name ⇒ unit (AgentBuilder.get_modules()) after AgentBuilder.create_agent.\n')
+    wf.write('    Returns:\n')
+    wf.write('      step(): one step of every component, as brica1.VirtualTimeSyncScheduler.step().\n')
+    wf.write('    """\n')
+    for line in bind_lines:
+        wf.write(line + '\n')
+    wf.write('    time = [0]\n')
+    wf.write('\n')
+    wf.write('    def step():\n')
+    for line in transfer_lines + input_lines + fire_lines:
+        wf.write(line + '\n')
+    wf.write('        time[0] += 1\n')
+    for line in output_lines:
+        wf.write(line + '\n')
+    wf.write('        return time[0]\n')
+    wf.write('\n')
+    wf.write('    return step\n')
+
+
+def build_for_compile(infilePath):
+    """
+    Build the network of a BriCAL file with its components initialized as plain brica1 components
+    (the component constructors are not run), so that it can be compiled.
+    """
+    import brica1
+    nb = brical.NetworkBuilder()
+    f = open(infilePath)
+    if not nb.load_file(f):
+        exit(-1)
+    if not nb.check_consistency():
+        sys.stderr.write("ERROR: " + infilePath + " is not consistent!\n")
+        exit(-1)
+    if not nb.check_grounding():
+        sys.stderr.write("ERROR: " + infilePath + " is not grounded!\n")
+        exit(-1)
+    for key, value in nb.module_dictionary.items():
+        if value['ImplClass'] != '':
+            brica1.Component.__init__(nb.unit_dic[key])
+    if not nb.make_ports():
+        exit(-1)
+    agent_builder = brical.AgentBuilder()
+    agent = agent_builder.create_agent(nb)
+    return nb, agent_builder, agent
+
 
-    infilePath = sys.argv[1]
-    outfilePath = sys.argv[2]
+def main():
+    parser = argparse.ArgumentParser(description="Generates Python code from a BriCAL json file.")
+    parser.add_argument("infile", help="a BriCAL json file")
+    parser.add_argument("outfile", help="the Python file to write")
+    parser.add_argument("--compile", action="store_true",
+                        help="write a module with a compiled step function instead of a skeletal program")
+    args = parser.parse_args()
+
+    infilePath = args.infile
+    outfilePath = args.outfile
+
+    if args.compile:
+        nb, agent_builder, agent = build_for_compile(infilePath)
+        wf = open(outfilePath, 'w')
+        compile_network(nb, agent_builder, agent, wf)
+        wf.close()
+        return
 
     nb = brical.NetworkBuilder()
     f = open(infilePath)
@@ -141,7 +292,7 @@ def main():
         wf.write('\n')
 
     top_level = []
-    for unit_key in nb.unit_dic.keys():
+    for unit_key in nb.module_dictionary.keys():
         if unit_key not in nb.super_module:  # top level
             top_level.append(unit_key)
 
@@ -170,15 +321,14 @@ def main():
     for component in components:
         wf.write('    nb.unit_dic[\'' + component + '\'].__init__(config)\n')
 
+    component_list = ''.join('\n        nb.unit_dic[\'' + component + '\'],' for component in components) + '\n    '
     for item in main_code2:
         itm = item.replace('$PROJECT_DESCRIPTION$', nw['Comments'][hdr_comments]).\
             replace('$PROJECT_NAME$', nb.base_name_space). \
-            replace('$TOP_MODULE$', top_module)
+            replace('$TOP_MODULE$', top_module). \
+            replace('$COMPONENTS$', component_list)
         wf.write(itm + '\n')
 
-    for component in components:
-        wf.write('        nb.unit_dic[\'' + component + '\'].reset()\n')
-
     for item in main_code3:
         wf.write(item + '\n')
 
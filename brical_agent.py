@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+brical_agent.py
+=====
+
+This module contains the classes of the BriCA language interpreter derived from brica1 classes:
+the schedulers `TopologicalSyncScheduler` and `EventDrivenScheduler`, and the gym agent
+`VectorGymAgent` with its `VectorEnvComponent`.  `brical` imports it (and with it brica1 and NumPy)
+only when an agent is built, and re-exports the classes.
+
+"""
+
+import copy
+import brica1
+import numpy
+
+
+class TopologicalSyncScheduler(brica1.VirtualTimeSyncScheduler):
+    """
+    A scheduler firing the components one after another in a topological order of their connections,
+    so that a value propagates through any number of connections within a step.
+    - the in ports of the connections declared with "Delay": 1 receive the value of the previous step,
+      which breaks the feedback cycles.
+    - create it with AgentBuilder.create_scheduler(agent, "topological").
+    """
+
+    def __init__(self, agent, order, delayed, interval=1):
+        """
+        Args:
+          agent: the agent.
+          order: the components in the order to fire them.
+          delayed: Map: component ⇒ the names of its in ports receiving the value of the previous step.
+          interval: the virtual time of a step.
+        """
+        super(TopologicalSyncScheduler, self).__init__(agent, interval=interval)
+        self.order = order
+        self.delayed = delayed
+
+    def step(self):
+        previous = {}  # (component id, in port) ⇒ the value of the previous step
+        for component, port_names in self.delayed.items():
+            for port_name in port_names:
+                in_port = component.get_in_port(port_name)
+                in_port.sync()
+                previous[(id(component), port_name)] = copy.deepcopy(in_port.buffer)
+
+        self.supervisor.step()
+        next_time = self.current_time + self.interval
+        for component in self.order:
+            for port_name, in_port in component.in_ports.items():
+                key = (id(component), port_name)
+                if key in previous:
+                    in_port.buffer = previous[key]
+                else:
+                    in_port.sync()
+                in_port.invoke_callbacks()
+                if getattr(in_port, "zero_copy", False):
+                    component.inputs[port_name] = in_port.buffer
+                else:
+                    component.inputs[port_name] = copy.deepcopy(in_port.buffer)
+            component.last_input_time = self.current_time
+            component.train()
+            component.fire()
+            component.output(next_time)
+        self.current_time = next_time
+        return self.current_time
+
+
+class EventDrivenScheduler(brica1.VirtualTimeSyncScheduler):
+    """
+    A scheduler with the steps of brica1.VirtualTimeSyncScheduler which propagates only the changed values.
+    - every out port has a version counter (`version`), incremented when an output changes its value.
+    - an in port is synced and copied to the inputs only when the version (or the buffer object)
+      of the port it is connected from has changed.
+    - a component with a true `skip_unchanged` attribute is not fired when none of its inputs changed.
+    - `fired` and `skipped` count the components of the last step, `total_fired` and `total_skipped`
+      those of all the steps, and `transfers` the synced in ports of the last step.
+    Components must not modify their inputs in place, and the ports must be written by the outputs
+    of the components or by assigning a new buffer.
+    - create it with AgentBuilder.create_scheduler(agent, "event").
+    """
+
+    def __init__(self, agent, interval=1):
+        super(EventDrivenScheduler, self).__init__(agent, interval=interval)
+        self.fired = 0
+        self.skipped = 0
+        self.total_fired = 0
+        self.total_skipped = 0
+        self.transfers = 0
+        self.__seen = {}  # (component id, in port) ⇒ (source version, source buffer) when last synced
+        self.__published = {}  # Out port id ⇒ (buffer, copy of the value) of the last change
+        self.__started = set()  # Ids of the components fired at least once
+        for component in self.components:
+            for out_port in component.out_ports.values():
+                if not hasattr(out_port, "version"):
+                    out_port.version = 0
+
+    def step(self):
+        fire = []
+        self.transfers = 0
+        for component in self.components:
+            changed = id(component) not in self.__started
+            for port_name, in_port in component.in_ports.items():
+                source = in_port.connection.from_port if hasattr(in_port, "connection") else in_port
+                version = getattr(source, "version", 0)
+                key = (id(component), port_name)
+                seen = self.__seen.get(key)
+                if seen is not None and seen[0] == version and seen[1] is source.buffer:
+                    continue
+                in_port.sync()
+                in_port.invoke_callbacks()
+                if getattr(in_port, "zero_copy", False):
+                    component.inputs[port_name] = in_port.buffer
+                else:
+                    component.inputs[port_name] = copy.deepcopy(in_port.buffer)
+                self.__seen[key] = (version, source.buffer)
+                self.transfers += 1
+                changed = True
+            component.last_input_time = self.current_time
+            if changed or not getattr(component, "skip_unchanged", False):
+                fire.append(component)
+
+        self.supervisor.step()
+        for component in fire:
+            component.train()
+            component.fire()
+            self.__started.add(id(component))
+
+        self.current_time = self.current_time + self.interval
+        for component in fire:
+            for port_name, out_port in component.out_ports.items():
+                if port_name not in component.results:
+                    continue
+                value = component.results[port_name]
+                published = self.__published.get(id(out_port))
+                if published is not None and published[0] is out_port.buffer and self.__same(value, published[1]):
+                    continue
+                out_port.buffer = value
+                out_port.invoke_callbacks()
+                out_port.version = getattr(out_port, "version", 0) + 1
+                self.__published[id(out_port)] = (value, copy.deepcopy(value))
+            component.last_output_time = self.current_time
+
+        self.fired = len(fire)
+        self.skipped = len(self.components) - self.fired
+        self.total_fired += self.fired
+        self.total_skipped += self.skipped
+        return self.current_time
+
+    @staticmethod
+    def __same(a, b):
+        if isinstance(a, numpy.ndarray) or isinstance(b, numpy.ndarray):
+            return isinstance(a, numpy.ndarray) and isinstance(b, numpy.ndarray) and a.dtype == b.dtype \
+                and a.shape == b.shape and numpy.array_equal(a, b)
+        try:
+            return bool(a == b)
+        except Exception:
+            return False
+
+
+class VectorEnvComponent(brica1.Component):
+    """
+    A component stepping a gymnasium vector environment, all the sub-environments at once.
+    - in port "action": the actions, (num_envs, action size); out ports "observation" (num_envs, observation size),
+      "reward" (num_envs,) and "done" (num_envs,), true for the sub-environments which terminated or were truncated.
+    - the sub-environments reset themselves (the autoreset of the vector environment); the components in
+      `reset_components` are told the indices of the done ones with reset_envs(indices) in the same step.
+    - `done` is true when every sub-environment is done, so the loop generated by brical2py.py runs unchanged.
+    """
+
+    def __init__(self, env):
+        super().__init__()
+        self.env = env
+        self.num_envs = env.num_envs
+        self.done = False
+        self.flush = False
+        self.steps = 0  # Steps of the sub-environments
+        self.episodes = 0  # Finished episodes of the sub-environments
+        self.reset_components = []
+        action_space = env.single_action_space
+        self.make_in_port("action", 1)
+        self.get_in_port("action").buffer = numpy.zeros((self.num_envs, max(int(numpy.prod(action_space.shape)), 1)),
+                                                        dtype=action_space.dtype)
+        self.make_out_port("observation", 1)
+        self.make_out_port("reward", 1)
+        self.make_out_port("done", 1)
+        self.reset()
+
+    def fire(self):
+        action = self.inputs["action"]
+        action_space = self.env.action_space
+        observation, reward, terminated, truncated, info = self.env.step(
+            action.reshape(action_space.shape).astype(action_space.dtype, copy=False))
+        dones = numpy.logical_or(terminated, truncated)
+        self.results["observation"] = observation.reshape(self.num_envs, -1)
+        self.results["reward"] = numpy.asarray(reward)
+        self.results["done"] = dones
+        self.steps += self.num_envs
+        if dones.any():
+            indices = numpy.flatnonzero(dones)
+            self.episodes += len(indices)
+            for component in self.reset_components:
+                component.reset_envs(indices)
+        self.done = bool(dones.all())
+
+    def reset(self):
+        """ Reset every sub-environment """
+        observation, info = self.env.reset()
+        self.results["observation"] = observation.reshape(self.num_envs, -1)
+        self.results["reward"] = numpy.zeros(self.num_envs)
+        self.results["done"] = numpy.zeros(self.num_envs, dtype=bool)
+        for port_name, value in self.results.items():
+            self.get_out_port(port_name).buffer = value
+        self.done = False
+
+
+class VectorGymAgent(brica1.Agent):
+    """
+    A BriCA agent driving a gymnasium vector environment with a model (created by AgentBuilder.create_gym_agent).
+    - the "observation", "reward" and "done" in ports of the model are connected from the VectorEnvComponent
+      (`env`) and its "action" out port to the environment, when the model has them.
+    """
+
+    def __init__(self, model, env):
+        super().__init__()
+        self.env = VectorEnvComponent(env)
+        if isinstance(model, brica1.Component):
+            self.add_component("model", model)
+        else:
+            self.add_submodule("model", model)
+        self.add_component("env", self.env)
+        for port_name in ("observation", "reward", "done"):
+            if port_name in model.in_ports:
+                brica1.connect((self.env, port_name), (model, port_name))
+        if "action" in model.out_ports:
+            brica1.connect((model, "action"), (self.env, "action"))
+        self.env.reset_components = [component for component in self.get_all_components()
+                                     if hasattr(component, "reset_envs")]
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+brical_converter.py
+=====
+
+This module contains the functions shared by the converters into the BriCA language
+(bif2brical, bif_excel2brical and Table2BriCAL).
+
+"""
+
+import sys
+import json
+
+
+class JSONStreamWriter:
+    """
+    Writes a JSON object to a file incrementally: the members one by one, and the arrays element by element
+    as they are produced, so that a converter does not have to hold a whole BriCA language document in memory.
+    - with indent=1 the output is the same as json.dump(..., indent=1).
+    - with indent=None the output is compact (no whitespace).
+    """
+
+    def __init__(self, fp, indent=1):
+        """
+        Args:
+          fp: a file object to write to.
+          indent: the indentation width, or None for compact output.
+        Returns:
+          JSONStreamWriter: a new instance; the opening brace has been written.
+        """
+        self.fp = fp
+        self.indent = indent
+        self.__count = 0
+        if indent is None:
+            self.__separators = (',', ':')
+        else:
+            self.__separators = (',', ': ')
+        self.fp.write('{')
+
+    def write_member(self, name, value):
+        """
+        Write a member of the object.
+        """
+        self.__write_name(name)
+        self.fp.write(self.__encode(value, 1))
+
+    def write_array(self, name, elements):
+        """
+        Write an array member, encoding the elements one at a time.
+        Args:
+          name: the member name.
+          elements: an iterable (e.g. a generator) of the elements.
+        Returns:
+          the number of the written elements.
+        """
+        self.__write_name(name)
+        self.fp.write('[')
+        count = 0
+        for element in elements:
+            if count > 0:
+                self.fp.write(',')
+            self.fp.write(self.__newline(2) + self.__encode(element, 2))
+            count += 1
+        if count > 0:
+            self.fp.write(self.__newline(1))
+        self.fp.write(']')
+        return count
+
+    def close(self):
+        """
+        Write the closing brace (the file object is not closed).
+        """
+        if self.__count > 0:
+            self.fp.write(self.__newline(0))
+        self.fp.write('}')
+
+    def __write_name(self, name):
+        if self.__count > 0:
+            self.fp.write(',')
+        self.fp.write(self.__newline(1) + json.dumps(name) + self.__separators[1])
+        self.__count += 1
+
+    def __newline(self, level):
+        if self.indent is None:
+            return ''
+        return '\n' + ' ' * (self.indent * level)
+
+    def __encode(self, value, level):
+        text = json.dumps(value, indent=self.indent, separators=self.__separators)
+        if self.indent is None:
+            return text
+        return text.replace('\n', self.__newline(level))
+
+
+def write_document(fp, document, compact=False):
+    """
+    Write a BriCA language document with a JSONStreamWriter.
+    Args:
+      fp: a file object to write to.
+      document: the document: the Header, and the Modules, Ports and Connections arrays as lists or
+                iterables (e.g. generators), which are consumed as they are written.
+      compact: write it without whitespace instead of as json.dump(..., indent=1).
+    """
+    writer = JSONStreamWriter(fp, indent=None if compact else 1)
+    for name, value in document.items():
+        if isinstance(value, (dict, str, int, float, bool)) or value is None:
+            writer.write_member(name, value)
+        else:
+            writer.write_array(name, value)
+    writer.close()
+
+
+def collect_document(document):
+    """
+    Returns:
+      the document with its arrays (e.g. generators, see write_document) as lists, e.g. for
+      NetworkBuilder.load_document.
+    """
+    return dict((name, value if isinstance(value, (dict, str, int, float, bool)) or value is None else list(value))
+                for name, value in document.items())
+
+
+def get_ancestors(modules):
+    """
+    Build the ancestor index from the SubModules lists.
+    Returns:
+      Map: module name ⇒ set of the modules containing it directly or indirectly,
+      or None if the SubModules declarations are cyclic (reported to stderr).
+    """
+    children = {}
+    indegree = {}
+    for name, v in modules.items():
+        children[name] = list(dict.fromkeys(v.get("SubModules", [])))
+        indegree.setdefault(name, 0)
+        for submodule in children[name]:
+            indegree[submodule] = indegree.get(submodule, 0) + 1
+    ancestors = {name: set() for name in indegree}
+    stack = [name for name, count in indegree.items() if count == 0]
+    while stack:
+        name = stack.pop()
+        for submodule in children.get(name, []):
+            ancestors[submodule] |= ancestors[name]
+            ancestors[submodule].add(name)
+            indegree[submodule] -= 1
+            if indegree[submodule] == 0:
+                stack.append(submodule)
+    cyclic = sorted(name for name, count in indegree.items() if count > 0)
+    if cyclic:
+        sys.stderr.write("ERROR: cyclic SubModules among " + ", ".join(cyclic) + "!\n")
+        return None
+    return ancestors
+
+
+def upper_p(module1, module2, ancestors):
+    return module1 in ancestors.get(module2, ())
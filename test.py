@@ -34,7 +34,7 @@ list_file = os.listdir(path)
 network_builder = brical.NetworkBuilder()
 print("--- Load file ---")
 for file in sorted(list_file):
-    if file[0] == "I":  # Import file
+    if file[0] == "I" or file == "expected.json":  # Import file / expected values of testall.py
         continue
     file = path + "/" + file
     if os.path.isdir(file):  # directory
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+testall.py
+=====
+
+Runs the network test cases under `test/` in parallel and compares the port values
+of every step and the dtypes of the port buffers with the expected values stored in
+`expected.json` of each case.  A case whose network must be rejected has the stage it
+fails at ("Error") and the messages written to stderr ("Diagnostics") instead.
+
+Without case directories, it also runs the behavior checks of `testchecks.py`, and imports
+`brical` and the converters with `python -X importtime` in fresh interpreters and fails if
+they import their heavy dependencies at load time.
+
+    USE: python testall.py [--jobs N] [--output report.json] [--record] [--compiled]
+                           [--scheduler MODE] [--memo] [--no-checks] [--no-importtime] [case-dir ...]
+
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import traceback
+import subprocess
+import concurrent.futures
+
+EXPECTED_FILE = "expected.json"
+
+
+class BuildError(Exception):
+    """ The network of a case could not be built or scheduled """
+
+    def __init__(self, stage, stderr=""):
+        Exception.__init__(self, stage)
+        self.stage = stage
+        self.stderr = stderr
+
+
+# Module ⇒ the modules it must not import when it is imported
+IMPORT_CHECKS = {
+    "brical": ["brica1", "numpy"],
+    "bif2brical.bif2brical": ["rdflib"],
+    "bif_excel2brical.bif_excel2brical": ["openpyxl"],
+    "Table2BriCAL.table2brical": ["numpy"],
+}
+
+
+def list_files(path):
+    """ The BriCAL files of a case directory, as `test.py` loads them """
+    files = []
+    for file in sorted(os.listdir(path)):
+        if file[0] == "I" or file == EXPECTED_FILE:  # Import file / expected values
+            continue
+        file = os.path.join(path, file)
+        if os.path.isdir(file):
+            continue
+        files.append(file)
+    return files
+
+
+def build_case(path, memo=None, profiler=None, before_agent=None):
+    """
+    Build the network of a case and initialize its components as `test.py` does.
+    Args:
+      path: the case directory.
+      memo: a `brical.FireMemo` passed to `create_agent`.
+      profiler: a `brical.StepProfiler` passed to `create_agent`.
+      before_agent: a function called with the NetworkBuilder once its ports are made, before `create_agent`.
+    Returns:
+      (NetworkBuilder, AgentBuilder, agent, probes): the probes are (port name, component, IO, port) tuples
+      of the ports of the components.
+    Raises:
+      BuildError: the network cannot be built (the messages are written to stderr).
+    """
+    import brical
+    import numpy as np
+
+    network_builder = brical.NetworkBuilder()
+    for file in list_files(path):
+        with open(file) as f:
+            if not network_builder.load_file(f):
+                raise BuildError("load file " + os.path.basename(file))
+    network = network_builder.get_network()
+    if not network_builder.check_consistency():
+        raise BuildError("INCONSISTENT")
+    if not network_builder.check_grounding():
+        raise BuildError("NOT_GROUNDED")
+
+    for module, v in network["ModuleDictionary"].items():
+        if v["ImplClass"] != "":
+            network_builder.unit_dic[module].__init__()
+    if not network_builder.make_ports():
+        raise BuildError("make_ports")
+    if before_agent is not None:
+        before_agent(network_builder)
+    agent_builder = brical.AgentBuilder()
+    agent = agent_builder.create_agent(network_builder, profiler=profiler, memo=memo)
+    modules = agent_builder.get_modules()
+
+    # Same initialization as test.py
+    probes = []
+    for module, v in sorted(network["ModuleDictionary"].items()):
+        impl = v["ImplClass"]
+        if impl == "":
+            continue
+        component = modules[module]
+        ports = v["Ports"]
+        for port_name in ports:
+            port = network_builder.get_port(module, port_name)
+            probes.append((module + "." + port_name, component, port["IO"], port_name))
+        if "InputModule" in module:
+            length = network_builder.get_port(module, ports[0])["Shape"]
+            # int16 as in test.py: the DType of the out port (test/n002) is enforced at output
+            component.set_state(ports[0], np.array(range(length), dtype=np.int16))
+        if "PipeComponent" in impl:
+            ip = ""
+            op = ""
+            for port_name in ports:
+                io_type = network_builder.get_port(module, port_name)["IO"]
+                if io_type == "Input":
+                    ip = port_name
+                elif io_type == "Output":
+                    op = port_name
+            component.set_map(ip, op)
+    return network_builder, agent_builder, agent, probes
+
+
+def read_probes(probes):
+    """ Map: port name ⇒ the buffer of the port, for the probes of build_case """
+    values = {}
+    for name, component, io_type, port_name in probes:
+        if io_type == "Input":
+            values[name] = component.get_in_port(port_name).buffer
+        else:
+            values[name] = component.get_out_port(port_name).buffer
+    return values
+
+
+def run_case(path, steps=None, compiled=False, mode="sync", memo=False):
+    """
+    Build the network of a case and record its port values.
+    Args:
+      path: the case directory.
+      steps: the number of steps (default: the number of components, as in `test.py`).
+      compiled: step with the function compiled by `brical2py.py --compile` instead of the scheduler
+                (in the "sync" mode only).
+      mode: the scheduling mode of `AgentBuilder.create_scheduler`.
+      memo: memoize the fire() of the pure components with a `brical.FireMemo`.
+    Returns:
+      (a list of {port name: values} for each step, {port name: dtype} after the last step, the stderr output)
+    Raises:
+      BuildError: the network cannot be built or scheduled.
+    """
+    import brical
+    import numpy as np
+
+    stderr = sys.stderr
+    sys.stderr = io.StringIO()
+    try:
+        network_builder, agent_builder, agent, probes = build_case(path, brical.FireMemo() if memo else None)
+        if steps is None:
+            steps = len(set(id(probe[1]) for probe in probes))
+        if compiled and mode == "sync":
+            sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "brical2py"))
+            import brical2py
+            source = io.StringIO()
+            brical2py.compile_network(network_builder, agent_builder, agent, source)
+            namespace = {}
+            exec(compile(source.getvalue(), path + " (compiled)", "exec"), namespace)
+            step = namespace["bind"](agent_builder.get_modules())
+        else:
+            scheduler = agent_builder.create_scheduler(agent, mode)
+            if scheduler is None:
+                raise BuildError("create_scheduler")
+            step = scheduler.step
+        values = []
+        dtypes = {}
+        for i in range(steps):
+            step()
+            step_values = {}
+            for name, buffer in read_probes(probes).items():
+                step_values[name] = np.asarray(buffer).tolist()
+                dtypes[name] = str(np.asarray(buffer).dtype)
+            values.append(step_values)
+        return values, dtypes, sys.stderr.getvalue()
+    except BuildError as e:
+        e.stderr = sys.stderr.getvalue()
+        raise
+    finally:
+        sys.stderr = stderr
+
+
+def check_case(path, record=False, compiled=False, scheduler=None, memo=False):
+    """
+    Run a case in a worker process.
+    Returns:
+      a result dictionary of the report.
+    """
+    result = {"name": os.path.basename(os.path.normpath(path)), "path": path, "failures": []}
+    start = time.perf_counter()
+    expected_path = os.path.join(path, EXPECTED_FILE)
+    try:
+        expected = None
+        mode = "sync"
+        if os.path.isfile(expected_path):
+            with open(expected_path) as fp:
+                mode = json.load(fp).get("Scheduler", mode)
+        if scheduler is not None and mode == "sync" and not record:
+            mode = scheduler
+        if not record:
+            if not os.path.isfile(expected_path):
+                raise RuntimeError(EXPECTED_FILE + " not found (use --record)")
+            with open(expected_path) as fp:
+                expected = json.load(fp)
+        try:
+            steps = None if expected is None or "Steps" not in expected else len(expected["Steps"])
+            values, dtypes, stderr = run_case(path, steps, compiled, mode, memo)
+            recorded = {"Steps": values, "DTypes": dtypes}
+        except BuildError as e:
+            if not record and "Error" not in expected:
+                raise
+            stderr = e.stderr
+            recorded = {"Error": e.stage, "Diagnostics": stderr.splitlines()}
+        result["stderr"] = stderr
+        if record:
+            with open(expected_path, "w") as fp:
+                if mode != "sync":
+                    recorded["Scheduler"] = mode
+                json.dump(recorded, fp, indent=1, sort_keys=True)
+            result["status"] = "recorded"
+        else:
+            if "Error" in expected or "Error" in recorded:
+                for key in ("Error", "Diagnostics"):
+                    if expected.get(key) != recorded.get(key):
+                        result["failures"].append({"key": key, "expected": expected.get(key),
+                                                   "actual": recorded.get(key)})
+            else:
+                for step, (expected_values, actual_values) in enumerate(zip(expected["Steps"], values)):
+                    for name in sorted(set(expected_values) | set(actual_values)):
+                        if expected_values.get(name) != actual_values.get(name):
+                            result["failures"].append({"step": step + 1, "port": name,
+                                                       "expected": expected_values.get(name),
+                                                       "actual": actual_values.get(name)})
+                for name in sorted(set(expected.get("DTypes", {})) | set(dtypes)):
+                    if expected.get("DTypes", {}).get(name) != dtypes.get(name):
+                        result["failures"].append({"port": name, "expected": expected.get("DTypes", {}).get(name),
+                                                   "actual": dtypes.get(name)})
+            result["status"] = "failed" if result["failures"] else "passed"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+        result["traceback"] = traceback.format_exc()
+    result["time"] = time.perf_counter() - start
+    return result
+
+
+def run_check(name):
+    """
+    Run the function check_<name> of testchecks.py in a worker process.
+    Returns:
+      a result dictionary of the report, failed if the check raised an AssertionError.
+    """
+    import testchecks
+    result = {"name": "check " + name, "path": "testchecks.check_" + name, "failures": []}
+    start = time.perf_counter()
+    stderr = sys.stderr
+    sys.stderr = io.StringIO()
+    try:
+        getattr(testchecks, "check_" + name)()
+        result["status"] = "passed"
+    except AssertionError as e:
+        result["status"] = "failed"
+        result["failures"].append({"message": str(e)})
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+        result["traceback"] = traceback.format_exc()
+    finally:
+        result["stderr"] = sys.stderr.getvalue()
+        sys.stderr = stderr
+    result["time"] = time.perf_counter() - start
+    return result
+
+
+def check_imports(module, heavy):
+    """
+    Import a module in a fresh interpreter with `python -X importtime`.
+    Returns:
+      a result dictionary of the report, failed if one of the heavy modules has been imported;
+      "import_us" is the cumulative import time of the module in microseconds.
+    """
+    result = {"name": "import " + module, "path": module, "failures": []}
+    start = time.perf_counter()
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = root + os.pathsep + env["PYTHONPATH"] if env.get("PYTHONPATH") else root
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                             cwd=root, env=env, capture_output=True, text=True)
+    imported = {}  # Module ⇒ cumulative import time
+    for line in process.stderr.splitlines():
+        fields = line[len("import time:"):].split("|")
+        if line.startswith("import time:") and len(fields) == 3 and fields[1].strip().isdigit():
+            imported[fields[2].strip()] = int(fields[1])
+    if process.returncode != 0:
+        result["status"] = "error"
+        result["error"] = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "import failed"
+    else:
+        result["import_us"] = imported.get(module)
+        for name in heavy:
+            if name in imported:
+                result["failures"].append({"module": name, "import_us": imported[name]})
+        result["status"] = "failed" if result["failures"] else "passed"
+    result["time"] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the BriCAL network test cases.")
+    parser.add_argument("cases", nargs="*", help="case directories (default: every directory under test/)")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--output", type=str, help="write the report (JSON) to this file instead of stdout")
+    parser.add_argument("--record", action="store_true", help="write the current values to " + EXPECTED_FILE)
+    parser.add_argument("--compiled", action="store_true",
+                        help="run the cases with the step function compiled by brical2py.py --compile")
+    parser.add_argument("--scheduler", choices=["sync", "event"],
+                        help="run the cases of the sync mode with this scheduling mode (e.g. event)")
+    parser.add_argument("--memo", action="store_true", help="memoize the fire() of the pure components")
+    parser.add_argument("--no-checks", action="store_true", help="do not run the checks of testchecks.py")
+    parser.add_argument("--no-importtime", action="store_true", help="do not check the imports of the modules")
+    args = parser.parse_args()
+
+    cases = args.cases
+    imports = {} if cases or args.no_importtime else IMPORT_CHECKS
+    checks = []
+    if not cases and not args.no_checks and not args.record:
+        from testchecks import CHECKS as checks
+    if not cases:
+        test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test")
+        cases = [os.path.join(test_dir, d) for d in sorted(os.listdir(test_dir))
+                 if os.path.isdir(os.path.join(test_dir, d))]
+
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        results = list(executor.map(check_case, cases, [args.record] * len(cases),
+                                    [args.compiled] * len(cases), [args.scheduler] * len(cases),
+                                    [args.memo] * len(cases)))
+        results.extend(executor.map(run_check, checks))
+        results.extend(executor.map(check_imports, list(imports), list(imports.values())))
+    report = {"cases": results, "time": time.perf_counter() - start}
+    for status in ("passed", "failed", "error", "recorded"):
+        report[status] = len([result for result in results if result["status"] == status])
+
+    for result in results:
+        sys.stderr.write("{0}: {1} ({2:.3f}s)\n".format(result["name"], result["status"], result["time"]))
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write("\n")
+    if report["failed"] or report["error"]:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
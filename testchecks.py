@@ -0,0 +1,653 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+testchecks.py
+=====
+
+Behavior checks of the features of `brical` beyond the port values of the test cases
+(profiling, recording, checkpoints, environments, validation and the converters).
+`testall.py` runs every function `check_<name>` listed in `CHECKS` in its process pool;
+a check fails by raising an AssertionError.
+
+    USE: python testall.py [--no-checks]
+
+"""
+
+import os
+import io
+import json
+import shutil
+import tempfile
+import contextlib
+import numpy
+import brica1
+
+from testall import build_case, read_probes
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TEST_DIR = os.path.join(ROOT, "test")
+TABLE_DIR = os.path.join(ROOT, "Table2BriCAL", "usecase")
+BIF_DIR = os.path.join(ROOT, "bif2brical", "usecase")
+EXCEL_DIR = os.path.join(ROOT, "bif_excel2brical", "usecase")
+
+CHECKS = ["profiler", "table_cache", "table_edges", "table_coarsen", "table_streaming", "bif_cache",
+          "converter_cycles", "build_agent", "excel", "memo_states", "event_scheduler", "recorder", "checkpoint",
+          "async_driver", "vector_resets", "zero_copy", "validate",
+          "gym_profiler"]
+
+
+def check_profiler():
+    """ A StepProfiler reports the fire() of every component and the steps of the scheduler """
+    import brical
+
+    profiler = brical.StepProfiler(trace=True)
+    network_builder, agent_builder, agent, probes = build_case(os.path.join(TEST_DIR, "n001"), profiler=profiler)
+    scheduler = profiler.profile_scheduler(brica1.VirtualTimeSyncScheduler(agent))
+    for i in range(3):
+        scheduler.step()
+    report = io.StringIO()
+    profiler.report(report)
+    for module in ("BriCA1.InputModule", "BriCA1.MainModule", "BriCA1.OutputModule"):
+        assert profiler.components[module][0] == 3, module + " fired " + str(profiler.components[module][0]) + " times"
+        assert module in report.getvalue(), module + " not in the report"
+    assert profiler.steps[0] == 3, "steps: " + str(profiler.steps[0])
+    assert profiler.connections and all(v[0] == 3 for v in profiler.connections.values()), \
+        "transfers: " + str(profiler.connections)
+    assert any(event["cat"] == "fire" for event in profiler.events), "no fire event in the trace"
+
+
+def check_memo_states():
+    """ A FireMemo looks up the results of a component by its states as well as its inputs """
+    import brical
+
+    memo = brical.FireMemo()
+    component = brica1.ConstantComponent()  # fire() copies the states to the results
+    component.make_out_port("out", 1)
+    memo.attach({"Constant": component}, ["Constant"])
+    for value, hits in ((1, 0), (2, 0), (1, 1), (2, 2)):
+        component.set_state("out", numpy.array([value]))
+        component.fire()
+        assert component.results["out"][0] == value, "results " + str(component.results["out"]) + " for " + str(value)
+        assert memo.hits == hits, "hits: " + str(memo.hits)
+
+
+class DoublingComponent(brica1.Component):
+    """ Doubles its input ("in" to "out"), fired by an EventDrivenScheduler only when the input changed """
+    skip_unchanged = True
+
+    def __init__(self):
+        super().__init__()
+        self.fires = 0
+        self.make_in_port("in", 1)
+        self.make_out_port("out", 1)
+
+    def fire(self):
+        self.fires += 1
+        self.results["out"] = self.inputs["in"] * 2
+
+
+def check_event_scheduler():
+    """
+    An EventDrivenScheduler syncs an in port only when the out port it is connected from has a new version,
+    fires a skip_unchanged component only when its inputs changed and does not bump the version of an out
+    port whose value did not change (a constant source, then a chain of two DoublingComponents).
+    """
+    import brical
+
+    source = brica1.ConstantComponent()
+    source.make_out_port("out", 1)
+    source.set_state("out", numpy.array([1]))
+    first = DoublingComponent()
+    second = DoublingComponent()
+    module = brica1.Module()
+    for name, component in (("source", source), ("first", first), ("second", second)):
+        module.add_component(name, component)
+    agent = brica1.Agent()
+    agent.add_submodule("module", module)
+    brica1.connect((source, "out"), (first, "in"))
+    brica1.connect((first, "out"), (second, "in"))
+    scheduler = brical.EventDrivenScheduler(agent)
+    # (fired, skipped, transfers, fires of first, fires of second, versions of the out ports, input of second)
+    expected = [(3, 0, 2, 1, 1, (1, 1, 1), 0),  # every component fires at the first step
+                (3, 0, 2, 2, 2, (1, 2, 1), 0),  # the unchanged outputs of source and second keep their versions
+                (2, 1, 1, 2, 3, (1, 2, 2), 2),  # first is skipped: its input is unchanged
+                (1, 2, 0, 2, 3, (2, 2, 2), 2),  # source changed to 5: only source fires
+                (2, 1, 1, 3, 3, (2, 3, 2), 2),
+                (2, 1, 1, 3, 4, (2, 3, 3), 10)]
+    for step, values in enumerate(expected):
+        if step == 3:
+            source.set_state("out", numpy.array([5]))
+        scheduler.step()
+        versions = tuple(component.get_out_port("out").version for component in (source, first, second))
+        result = (scheduler.fired, scheduler.skipped, scheduler.transfers, first.fires, second.fires, versions,
+                  int(second.get_in_port("in").buffer[0]))
+        assert result == values, "step " + str(step) + ": " + str(result)
+    assert (scheduler.total_fired, scheduler.total_skipped) == (13, 5), \
+        str((scheduler.total_fired, scheduler.total_skipped))
+
+
+def check_recorder():
+    """
+    A PortRecorder made before the agent records the ports aliased by create_agent, and PortRecorder.load
+    returns the last `capacity` steps in order with the values and DTypes of test/n001.
+    """
+    import brical
+
+    expected = read_expected(os.path.join(TEST_DIR, "n001", "expected.json"))
+    names = sorted(expected["DTypes"])
+    recorders = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "n001.bin")
+
+        def make_recorder(network_builder):
+            recorders.append(brical.PortRecorder(network_builder, names, path, capacity=2))
+
+        network_builder, agent_builder, agent, probes = build_case(os.path.join(TEST_DIR, "n001"),
+                                                                   before_agent=make_recorder)
+        recorder = recorders[0]
+        scheduler = recorder.record_scheduler(brica1.VirtualTimeSyncScheduler(agent))
+        for i in range(len(expected["Steps"])):
+            scheduler.step()
+        recorder.close()
+        records = brical.PortRecorder.load(path)
+    steps = list(range(len(expected["Steps"])))[-2:]
+    assert list(records["step"]) == steps, "steps: " + str(records["step"])
+    for name in names:
+        assert records[name].dtype == numpy.dtype(expected["DTypes"][name]), name + ": " + str(records[name].dtype)
+        assert records[name].tolist() == [expected["Steps"][step][name] for step in steps], \
+            name + ": " + str(records[name].tolist())
+
+
+def check_checkpoint():
+    """
+    An agent of test/n004 (a delayed cycle) restored from a checkpoint into a fresh agent steps as the
+    agent it was saved from.
+    """
+    path = os.path.join(TEST_DIR, "n004")
+    network_builder, agent_builder, agent, probes = build_case(path)
+    scheduler = agent_builder.create_scheduler(agent, "topological")
+    input_module = agent_builder.get_modules()["BriCA1.InputModule"]
+    input_module.set_state("InputModulePort", numpy.array([5, 6, 7], dtype=numpy.int16))
+    for i in range(2):
+        scheduler.step()
+    checkpoint = io.BytesIO()
+    agent_builder.save_checkpoint(checkpoint, scheduler)
+
+    restored = build_case(path)
+    restored_scheduler = restored[1].create_scheduler(restored[2], "topological")
+    checkpoint.seek(0)
+    assert restored[1].load_checkpoint(checkpoint, restored_scheduler), "the checkpoint was not restored"
+    for i in range(3):
+        time = scheduler.step()
+        restored_time = restored_scheduler.step()
+        assert time == restored_time, "time: " + str(restored_time) + " instead of " + str(time)
+        values = read_probes(probes)
+        for name, value in read_probes(restored[3]).items():
+            assert value.tolist() == values[name].tolist(), \
+                name + ": " + str(value.tolist()) + " instead of " + str(values[name].tolist())
+    assert values["BriCA1.MainModule.Port3"].tolist() == [5, 6, 7], "the delayed port was not restored"
+
+
+GYM_NETWORK = {
+    "Header": {"Type": "C", "Name": "Gym", "Base": "Gym"},
+    "Modules": [{"Name": "Agent", "Ports": ["observation", "reward", "done", "action"],
+                 "ImplType": "BriCA1", "ImplClass": "testchecks.GymComponent"}],
+    "Ports": [{"Name": "observation", "Module": "Agent", "Type": "Input", "Shape": [2], "DType": "float32"},
+              {"Name": "reward", "Module": "Agent", "Type": "Input", "Shape": [1]},
+              {"Name": "done", "Module": "Agent", "Type": "Input", "Shape": [1]},
+              {"Name": "action", "Module": "Agent", "Type": "Output", "Shape": [1], "DType": "int64"}]
+}
+
+
+def make_gym_network():
+    """ A NetworkBuilder of GYM_NETWORK with its ports made, for create_gym_agent with the model "Gym.Agent" """
+    import brical
+    network_builder = brical.NetworkBuilder()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "gym.json")
+        with open(path, "w") as fp:
+            json.dump(GYM_NETWORK, fp)
+        with open(path) as fp:
+            assert network_builder.load_file(fp), "GYM_NETWORK not loaded"
+    assert network_builder.check_consistency() and network_builder.check_grounding(), "GYM_NETWORK not built"
+    network_builder.unit_dic["Gym.Agent"].__init__()
+    assert network_builder.make_ports(), "ports of GYM_NETWORK not made"
+    return network_builder
+
+
+def make_tiny_env(length, size=2):
+    """ A gymnasium environment of `size` observations ending after `length` steps, counting its steps and episodes """
+    import gymnasium
+
+    class TinyEnv(gymnasium.Env):
+        observation_space = gymnasium.spaces.Box(0, 100, (size,), dtype=numpy.float32)
+        action_space = gymnasium.spaces.Discrete(2)
+
+        def __init__(self):
+            self.count = 0
+            self.steps = 0
+            self.episodes = 0
+
+        def reset(self, seed=None, options=None):
+            super().reset(seed=seed)
+            self.count = 0
+            return numpy.zeros(size, dtype=numpy.float32), {}
+
+        def step(self, action):
+            self.count += 1
+            self.steps += 1
+            terminated = self.count >= length
+            self.episodes += terminated
+            return numpy.full(size, self.count, dtype=numpy.float32), 1.0, terminated, False, {}
+
+    return TinyEnv()
+
+
+class GymComponent(brica1.Component):
+    """ The model of GYM_NETWORK: action 0 for every sub-environment; records the reset_envs() calls """
+
+    def __init__(self):
+        super().__init__()
+        self.resets = []
+
+    def fire(self):
+        self.results["action"] = numpy.zeros((len(self.inputs["observation"]), 1), dtype=numpy.int64)
+
+    def reset_envs(self, indices):
+        self.resets.append(indices.tolist())
+
+
+def check_async_driver():
+    """
+    An AsyncGymDriver runs the episodes of every agent, each ending when its own environment is done, and counts
+    the steps and the finished episodes of the sub-environments of a vector environment.
+    """
+    import gymnasium
+    import brical
+
+    envs = []
+    for length in (3, 4):
+        env = gymnasium.vector.SyncVectorEnv([lambda length=length: make_tiny_env(length)])
+        envs.append(env)
+    driver = brical.AsyncGymDriver(make_gym_network(), "Gym.Agent", envs)
+    driver.run(episode_count=2, max_steps=10)
+    assert driver.agent_episodes == [2, 2], "episodes: " + str(driver.agent_episodes)
+    assert driver.agent_steps == [6, 8], "steps: " + str(driver.agent_steps)
+    assert driver.steps == 14 and driver.episodes == 4, str(driver.steps) + " steps, " + str(driver.episodes)
+    for env, length in zip(envs, (3, 4)):
+        tiny_env = env.envs[0]
+        assert tiny_env.episodes == 2 and tiny_env.steps == 2 * length, \
+            "the environment of " + str(length) + " steps ran " + str(tiny_env.steps) + " steps"
+        env.close()
+
+    # Two sub-environments: a scheduler step is two environment steps, and only the sub-environment of one
+    # step finishes episodes (twice in each loop of four steps, with the autoreset steps between them)
+    env = gymnasium.vector.SyncVectorEnv([lambda: make_tiny_env(1), lambda: make_tiny_env(5)])
+    driver = brical.AsyncGymDriver(make_gym_network(), "Gym.Agent", [env])
+    driver.run(episode_count=2, max_steps=4)
+    vector_env = driver.agents[0][0].env
+    assert driver.agent_steps == [16] and driver.steps == vector_env.steps == 16, str(driver.agent_steps)
+    assert driver.agent_episodes == [4] and driver.episodes == vector_env.episodes == 4, str(driver.agent_episodes)
+    assert [tiny_env.episodes for tiny_env in env.envs] == [4, 0], str([tiny_env.episodes for tiny_env in env.envs])
+    env.close()
+
+    # A single environment runs with the GymAgent of brica1.brica_gym, and is rejected without it
+    try:
+        from brica1 import brica_gym
+    except ImportError:
+        brica_gym = None
+    env = make_tiny_env(3)
+    stderr = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(stderr):
+            driver = brical.AsyncGymDriver(make_gym_network(), "Gym.Agent", [env])
+    except ValueError:
+        assert brica_gym is None, "the single environment is rejected: " + stderr.getvalue()
+        assert "needs brica1.brica_gym" in stderr.getvalue(), stderr.getvalue()
+    else:
+        assert brica_gym is not None, "a single environment without brica1.brica_gym"
+        driver.run(episode_count=2, max_steps=10)
+        assert driver.agent_steps == [6] and driver.agent_episodes == [2], \
+            str(driver.agent_steps) + " steps, " + str(driver.agent_episodes) + " episodes"
+
+
+def check_gym_profiler():
+    """ The trace of a profiled gym agent has one fire event per component and one transfer per connection a step """
+    import collections
+    import gymnasium
+    import brical
+
+    env = gymnasium.vector.SyncVectorEnv([lambda: make_tiny_env(5)])
+    network_builder = make_gym_network()
+    profiler = brical.StepProfiler(trace=True)
+    agent_builder = brical.AgentBuilder()
+    agent = agent_builder.create_gym_agent(network_builder, network_builder.unit_dic["Gym.Agent"], env,
+                                           profiler=profiler)
+    scheduler = profiler.profile_scheduler(agent_builder.create_scheduler(agent))
+    for i in range(3):
+        scheduler.step()
+    env.close()
+    fires = collections.Counter(event["name"] for event in profiler.events if event["cat"] == "fire")
+    assert fires == {"Gym.Agent": 3, "env": 3}, "fire events: " + str(fires)
+    transfers = collections.Counter(event["name"] for event in profiler.events if event["cat"] == "transfer")
+    assert len(transfers) == 3 and set(transfers.values()) == {3}, "transfer events: " + str(transfers)
+    assert sorted(profiler.components) == ["Gym.Agent", "env"], str(profiler.components)
+
+
+def check_vector_resets():
+    """
+    A model on a vector environment gets the indices of the sub-environments done at each step
+    with reset_envs(), as the vector environment reports them.
+    """
+    import gymnasium
+    import brical
+
+    lengths = (2, 3, 5)
+
+    def make_env():
+        return gymnasium.vector.SyncVectorEnv([lambda length=length: make_tiny_env(length) for length in lengths])
+
+    expected = []
+    env = make_env()
+    env.reset()
+    for i in range(8):
+        observation, reward, terminated, truncated, info = env.step(numpy.zeros(len(lengths), dtype=numpy.int64))
+        dones = numpy.flatnonzero(numpy.logical_or(terminated, truncated)).tolist()
+        if dones:
+            expected.append(dones)
+    env.close()
+
+    env = make_env()
+    network_builder = make_gym_network()
+    agent_builder = brical.AgentBuilder()
+    agent = agent_builder.create_gym_agent(network_builder, network_builder.unit_dic["Gym.Agent"], env)
+    scheduler = agent_builder.create_scheduler(agent)
+    for i in range(8):
+        scheduler.step()
+    env.close()
+    resets = network_builder.unit_dic["Gym.Agent"].resets
+    assert resets == expected, "reset_envs: " + str(resets) + " instead of " + str(expected)
+    assert [0] in resets and [1] in resets, "resets: " + str(resets)
+    assert agent.env.episodes == sum(len(indices) for indices in expected), "episodes: " + str(agent.env.episodes)
+
+
+def check_zero_copy():
+    """
+    create_gym_agent(..., zero_copy=True) rejects an environment whose spaces do not fit the ports of the model,
+    and otherwise gives the model the observation buffer itself as its input.
+    """
+    import gymnasium
+    import brical
+
+    for size, dtype in ((3, numpy.float32), (2, numpy.float64)):
+        env = gymnasium.vector.SyncVectorEnv([lambda: make_tiny_env(3, size)])
+        if dtype != numpy.float32:
+            env.single_observation_space = gymnasium.spaces.Box(0, 100, (size,), dtype=dtype)
+        network_builder = make_gym_network()
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            agent = brical.AgentBuilder().create_gym_agent(network_builder, network_builder.unit_dic["Gym.Agent"],
+                                                           env, zero_copy=True)
+        env.close()
+        assert agent is None, "an observation space of " + str(size) + " " + str(dtype) + " was accepted"
+        assert "Gym.Agent.observation" in stderr.getvalue(), stderr.getvalue()
+
+    env = gymnasium.vector.SyncVectorEnv([lambda: make_tiny_env(3)])
+    network_builder = make_gym_network()
+    agent_builder = brical.AgentBuilder()
+    model = network_builder.unit_dic["Gym.Agent"]
+    agent = agent_builder.create_gym_agent(network_builder, model, env, zero_copy=True)
+    assert agent is not None, "the environment was rejected"
+    scheduler = agent_builder.create_scheduler(agent)
+    for i in range(2):
+        scheduler.step()
+        observation = model.get_in_port("observation").buffer
+        assert model.inputs["observation"] is observation, "the observation was copied"
+        assert model.inputs["reward"] is not model.get_in_port("reward").buffer, "the reward was not copied"
+    assert observation.tolist() == [[1, 1]], "observation: " + str(observation.tolist())
+    env.close()
+
+    try:
+        agent_builder.bind_zero_copy(network_builder, brica1.Component(), agent, env)
+    except ValueError as e:
+        assert "is not a unit of the network" in str(e), str(e)
+    else:
+        assert False, "a model outside the network was accepted"
+
+
+def check_validate():
+    """
+    brical.validate passes a good project, fails a project at the stage it is rejected with its diagnostics,
+    and reports the error of a project with an unreadable file; `python brical.py validate` and `--help`
+    import neither brica1 nor NumPy, and NetworkBuilder leaves the documents it loads (e.g. cached) unchanged.
+    """
+    import sys
+    import subprocess
+    import brical
+
+    document = read_expected(os.path.join(EXCEL_DIR, "n001.brical.json"))  # BriCAL version 2 ports
+    assert brical.NetworkBuilder().load_document(document, EXCEL_DIR), "n001.brical.json is not loaded"
+    assert document == read_expected(os.path.join(EXCEL_DIR, "n001.brical.json")), "the loaded document changed"
+
+    for args in (["--help"], ["validate", os.path.join(TEST_DIR, "n001")]):
+        script = "import sys, brical\nsys.argv = ['brical.py'] + " + repr(args) + "\ntry:\n    brical.main()\n" \
+                 "except SystemExit:\n    pass\nprint(sorted(set(sys.modules) & {'brica1', 'numpy'}))"
+        process = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True)
+        assert process.stdout.splitlines()[-1:] == ["[]"], str(args) + ": " + process.stdout[-200:]
+
+    with tempfile.TemporaryDirectory() as directory:
+        broken = os.path.join(directory, "broken")
+        shutil.copytree(os.path.join(TEST_DIR, "n001"), broken)
+        with open(os.path.join(broken, "03OutputComponent.json"), "w") as fp:
+            fp.write('{"Header": ')
+        paths = [os.path.join(TEST_DIR, "n001"), os.path.join(TEST_DIR, "e004"), broken]
+        report = brical.validate(paths, jobs=2)
+    assert (report["passed"], report["failed"], report["error"]) == (1, 1, 1), str(report)
+    good, inconsistent, unreadable = report["projects"]
+    assert good["status"] == "passed" and good["diagnostics"] == [], str(good)
+    assert list(good["stages"]) == ["load", "consistency", "grounding"], str(good["stages"])
+    expected = read_expected(os.path.join(TEST_DIR, "e004", "expected.json"))
+    assert inconsistent["status"] == "failed" and inconsistent["stage"] == "consistency", str(inconsistent)
+    assert inconsistent["diagnostics"] == expected["Diagnostics"], str(inconsistent["diagnostics"])
+    assert unreadable["status"] == "error" and unreadable["error"].startswith("JSONDecodeError"), str(unreadable)
+
+
+def convert_table(directory, output, threshold=0.5, **options):
+    """ Convert the tables of Table2BriCAL/usecase copied into a directory; returns the written document """
+    from Table2BriCAL import table2brical
+    t2b = table2brical.Table2BriCAL()
+    table2brical.build(t2b, os.path.join(directory, options.pop("connection", "connection.txt")),
+                       os.path.join(directory, "regions.txt"), os.path.join(directory, "hierarchy.txt"),
+                       threshold, **options)
+    path = os.path.join(directory, output)
+    t2b.write_json(path, "Connectome")
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def read_expected(path):
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def check_table_cache():
+    """
+    Table2BriCAL converts the connection table as the original line-by-line version (n001.brical.json, with
+    the super and sub-modules by name), and uses its matrix cache only for the table it was made from.
+    """
+    expected = read_expected(os.path.join(TABLE_DIR, "n001.brical.json"))
+    with tempfile.TemporaryDirectory() as directory:
+        for file in ("connection.txt", "regions.txt", "hierarchy.txt"):
+            shutil.copy(os.path.join(TABLE_DIR, file), directory)
+        assert convert_table(directory, "n001.brical.json") == expected, "the converted table differs"
+        cache_path = os.path.join(directory, "connection.txt.npy")
+        assert os.path.isfile(cache_path), "no matrix cache"
+
+        numpy.save(cache_path, numpy.zeros(numpy.load(cache_path).shape))
+        assert convert_table(directory, "n001.brical.json")["Connections"] == [], "the cache was not used"
+
+        # The same table, with its original (older) modification time
+        shutil.copy2(os.path.join(TABLE_DIR, "connection.txt"), directory)
+        assert convert_table(directory, "n001.brical.json") == expected, "a stale cache was used"
+
+
+def check_table_edges():
+    """ The edge list of the connections of the table converts to the same document as the table """
+    expected = read_expected(os.path.join(TABLE_DIR, "n001.brical.json"))
+    with tempfile.TemporaryDirectory() as directory:
+        for file in ("edges.txt", "regions.txt", "hierarchy.txt"):
+            shutil.copy(os.path.join(TABLE_DIR, file), directory)
+        document = convert_table(directory, "n001.brical.json", connection="edges.txt", edge_list=True)
+        assert document == expected, "the converted edge list differs"
+
+
+def check_table_coarsen():
+    """
+    Coarsening the usecase network to its top regions (with --depth 0, --target-modules 3 or an edge list)
+    gives the document of the original converter on the aggregated tables (depth0.*.txt).
+    """
+    expected = read_expected(os.path.join(TABLE_DIR, "depth0.brical.json"))
+    with tempfile.TemporaryDirectory() as directory:
+        for file in ("connection.txt", "edges.txt", "regions.txt", "hierarchy.txt"):
+            shutil.copy(os.path.join(TABLE_DIR, file), directory)
+        for options in ({"depth": 0}, {"target_modules": 3}, {"depth": 0, "connection": "edges.txt", "edge_list": True}):
+            document = convert_table(directory, "depth0.brical.json", cache=False, **options)
+            assert document == expected, "the coarsened network differs with " + str(options)
+
+
+def check_table_streaming():
+    """
+    Table2BriCAL writes a large network while generating its modules, ports and connections: the memory
+    allocated while writing stays far below the size of the file, which has the document of convert().
+    """
+    import tracemalloc
+    from Table2BriCAL import table2brical
+    size = 120
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, file) for file in ("connection.txt", "regions.txt", "hierarchy.txt")]
+        ids = ["R" + str(i) for i in range(size)]
+        matrix = numpy.random.default_rng(0).random((size, size))
+        with open(paths[0], "w") as fp:
+            fp.write("\t".join(["ID"] + ids) + "\n")
+            for id, row in zip(ids, matrix):
+                fp.write("\t".join([id] + [str(v) for v in row]) + "\n")
+        with open(paths[1], "w") as fp:
+            for id in ids:
+                fp.write(id + "\t" + id.lower() + "\tx\tRegion " + id + "\n")
+        open(paths[2], "w").close()
+        t2b = table2brical.Table2BriCAL()
+        table2brical.build(t2b, paths[0], paths[1], paths[2], 0.5, cache=False)
+        output = os.path.join(directory, "large.brical.json")
+        tracemalloc.start()
+        try:
+            t2b.write_json(output, "Large")
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        written = os.path.getsize(output)
+        assert written > 1 << 20 and peak < written // 8, "peak %d bytes for %d written" % (peak, written)
+        with open(output) as fp:
+            document = json.load(fp)
+        expected = table2brical.convert(paths[0], paths[1], paths[2], "Large", 0.5, name="large.brical",
+                                        cache=False)
+    assert document == expected, "the written document differs from convert()"
+    assert len(document["Connections"]) == numpy.count_nonzero(matrix >= 0.5), len(document["Connections"])
+
+
+def check_build_agent():
+    """
+    The documents of the table (as `python brical.py build table` converts them), workbook and ontology
+    converters build agents that run, and the table converter names the hierarchy by module names.
+    """
+    import argparse
+    import brical
+    from Table2BriCAL import table2brical
+    from bif_excel2brical import bif_excel2brical
+    from bif2brical import bif2brical
+    tables = [os.path.join(TABLE_DIR, file) for file in ("connection.txt", "regions.txt", "hierarchy.txt")]
+    documents = {}
+    for depth in (None, 0):
+        args = argparse.Namespace(connection=tables[0], regions=tables[1], hierarchy=tables[2], prefix="Connectome",
+                                  threshold=0.5, dtype=None, no_cache=True, edge_list=False, depth=depth,
+                                  aggregate="sum")
+        documents["table depth " + str(depth)] = brical.convert("table", args)
+    documents["excel"] = bif_excel2brical.convert(os.path.join(EXCEL_DIR, "n001.bif.xlsx"))
+    paths = [os.path.join(BIF_DIR, file) for file in ("circuits.owl", "bifd.owl", "external.owl")]
+    documents["bif"] = bif2brical.convert(paths[0], paths[1], paths[2:], cache_dir=None)
+    modules = dict((module["Name"], module) for module in documents["table depth None"]["Modules"])
+    assert modules["V1"]["SuperModule"] == "CTX" and modules["BG"]["SubModules"] == ["STR", "GP"], str(modules)
+    for source, document in documents.items():
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            built = brical.build_agent(document, impl_class="brica1.NullComponent")
+        assert built is not None, "the document of " + source + " is not built"
+        assert stdout.getvalue() == "", source + ": " + stdout.getvalue()
+        network_builder, agent_builder, agent = built
+        network = network_builder.get_network()
+        assert len(network["Connections"]) == len(document["Connections"]), source
+        scheduler = brica1.VirtualTimeSyncScheduler(agent)
+        for i in range(3):
+            scheduler.step()
+    document = table2brical.convert(tables[0], tables[1], tables[2], "Connectome", 0.5, name="Connectome.v2",
+                                    cache=False)
+    assert document["Header"]["Name"] == "Connectome.v2", str(document["Header"])
+
+
+def check_bif_cache():
+    """
+    bif2brical converts the usecase ontology as the original version (circuits.brical.json), parsing the
+    ontologies in worker processes into an empty cache, then loading them from the cache without parsing
+    (and hashing each file once).
+    """
+    import rdflib
+    from bif2brical import bif2brical
+    expected = read_expected(os.path.join(BIF_DIR, "circuits.brical.json"))
+    paths = [os.path.join(BIF_DIR, file) for file in ("circuits.owl", "bifd.owl", "external.owl")]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        document = bif2brical.convert(paths[0], paths[1], paths[2:], cache_dir=cache_dir, jobs=2)
+        assert document == expected, "the converted ontology differs"
+        assert len(os.listdir(cache_dir)) == 3, "cache files: " + str(os.listdir(cache_dir))
+
+        parse = rdflib.Graph.parse
+        get_cache_path = bif2brical.get_cache_path
+        hashed = []
+        rdflib.Graph.parse = None  # Loading from the cache must not parse
+        bif2brical.get_cache_path = lambda path, cache_dir: hashed.append(path) or get_cache_path(path, cache_dir)
+        try:
+            document = bif2brical.convert(paths[0], paths[1], paths[2:], cache_dir=cache_dir)
+        finally:
+            rdflib.Graph.parse = parse
+            bif2brical.get_cache_path = get_cache_path
+        assert document == expected, "the ontology converted from the cache differs"
+        assert sorted(hashed) == sorted(paths), "hashed files: " + str(hashed)
+    assert bif2brical.convert(paths[0], paths[1], paths[2:], cache_dir=None) == expected, \
+        "the ontology converted without the cache differs"
+
+
+def check_converter_cycles():
+    """ The ancestor index of the converters follows nested SubModules and reports cyclic ones """
+    from brical_converter import get_ancestors, upper_p
+    modules = {"Top": {"SubModules": ["Middle"]}, "Middle": {"SubModules": ["Bottom", "Bottom"]}, "Bottom": {}}
+    ancestors = get_ancestors(modules)
+    assert ancestors == {"Top": set(), "Middle": {"Top"}, "Bottom": {"Top", "Middle"}}, str(ancestors)
+    assert upper_p("Top", "Bottom", ancestors) and not upper_p("Bottom", "Top", ancestors)
+
+    modules["Bottom"]["SubModules"] = ["Top"]
+    modules["Other"] = {}
+    stderr = io.StringIO()
+    with contextlib.redirect_stderr(stderr):
+        assert get_ancestors(modules) is None, "a cycle was not detected"
+    assert stderr.getvalue() == "ERROR: cyclic SubModules among Bottom, Middle, Top!\n", stderr.getvalue()
+
+
+def check_excel():
+    """ bif_excel2brical converts the usecase workbook as the original version (n001.brical.json) """
+    from bif_excel2brical import bif_excel2brical
+    expected = read_expected(os.path.join(EXCEL_DIR, "n001.brical.json"))
+    document = bif_excel2brical.convert(os.path.join(EXCEL_DIR, "n001.bif.xlsx"))
+    assert document == expected, "the converted workbook differs"
+    for compact in (False, True):
+        fp = io.StringIO()
+        bif_excel2brical.write_document(fp, document, compact)
+        assert json.loads(fp.getvalue()) == expected, "the written document differs (compact=%s)" % compact